@@ -0,0 +1,595 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""asyncio engine of change_swa_preferences.py. It runs the same flow
+(select, find preference email, fetch, modify, append, expunge) over
+non-blocking connections, so one process keeps hundreds of mailbox sessions
+in flight. Requires Python 3.5+
+
+"""
+
+import argparse
+import asyncio
+import csv
+import imaplib
+import itertools
+import re
+import time
+import random
+import warnings
+from typing import AnyStr, List, Union, Set, Tuple, Iterator
+
+from change_swa_preferences import (PreferenceEmail, BulkProgress,
+                                    PreferenceUidCache,
+                                    PREFERENCE_SEARCH,
+                                    PREFERENCE_HEADER_SEARCH,
+                                    appended_uid,
+                                    cached_preference_email,
+                                    create_preference_message,
+                                    create_ssl_context,
+                                    fetch_windows,
+                                    find_option_and_change,
+                                    message_from_fetch_response,
+                                    preference_uids_from_fetch_response,
+                                    uids_from_search_response)
+
+LITERAL_EXPR = re.compile(rb'\{(\d+)\}\r\n$')
+CAPABILITY_EXPR = re.compile(rb'^(?:OK )?\[?CAPABILITY ([^\]]*)', re.I)
+
+
+class ImapError(Exception):
+    """IMAP command failed
+
+    """
+
+
+class ImapAbort(ImapError):
+    """IMAP connection was closed or server response is invalid
+
+    """
+
+
+def quote(value: AnyStr) -> bytes:
+    """Quotes IMAP string argument
+
+    :param value: AnyStr
+    :return: bytes
+    """
+    if isinstance(value, str):
+        value = value.encode()
+    return b'"' + value.replace(b'\\', b'\\\\').replace(b'"', b'\\"') + b'"'
+
+
+class AsyncImapConnection(object):
+    """Minimal asyncio IMAP4rev1 client. Responses are returned in the same
+    format as `build_imap_response_line` returns for imaplib responses.
+    Several commands can be sent with `send` before waiting for any of them,
+    untagged responses are assigned to the next completed command, so it is
+    exact for commands the server runs in order. Reads and writes raise
+    asyncio.TimeoutError if the server does not respond in `timeout` seconds
+
+    """
+
+    def __init__(self, reader: asyncio.StreamReader,
+                 writer: asyncio.StreamWriter, timeout: float = None):
+        self.reader = reader
+        self.writer = writer
+        self.timeout = timeout
+        self.capabilities = set()
+        self.__tags = itertools.count(1)
+        self.__untagged = []
+        self.__completed = {}
+
+    @staticmethod
+    async def open(host: str, port: int, use_ssl: bool = False,
+                   timeout: float = None):
+        """Connects to the imap server and reads greeting
+
+        :param host: str
+        :param port: int
+        :param use_ssl: boolean
+        :param timeout: seconds to wait for connection and each response or
+            None to wait forever
+        :return: AsyncImapConnection
+        """
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(
+            host, port, ssl=create_ssl_context() if use_ssl else None
+        ), timeout)
+        conn = AsyncImapConnection(reader, writer, timeout)
+        try:
+            greeting, _ = await conn.read_response()
+        except asyncio.TimeoutError:
+            conn.close()
+            raise
+        if not greeting.startswith(b'* OK'):
+            conn.close()
+            raise ImapAbort('Unexpected greeting {}'.format(greeting))
+        conn.update_capabilities(greeting[2:])
+        return conn
+
+    def update_capabilities(self, line: bytes):
+        """Saves capabilities from CAPABILITY response or response code
+
+        :param line: untagged response without '* ' or tagged response text
+        :return:
+        """
+        match = CAPABILITY_EXPR.match(line)
+        if match:
+            self.capabilities = set(
+                match.group(1).decode('ascii', 'replace').upper().split()
+            )
+
+    async def read_response(self) -> Tuple[bytes, List[bytes]]:
+        """Reads response line with its literals. Literal sizes are kept in
+        line, e.g. b'* 1 FETCH (UID 444 RFC822 {6868})', [b'...']
+
+        :return: tuple line, literals
+        """
+        parts = []
+        literals = []
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(),
+                                          self.timeout)
+            if not line.endswith(b'\n'):
+                raise ImapAbort('Connection closed by the imap server')
+            match = LITERAL_EXPR.search(line)
+            if not match:
+                parts.append(line.rstrip(b'\r\n'))
+                return b''.join(parts), literals
+            parts.append(line[:-2])
+            literals.append(await asyncio.wait_for(
+                self.reader.readexactly(int(match.group(1))), self.timeout
+            ))
+
+    def send(self, name: str, *args: AnyStr, literal: bytes = None) -> bytes:
+        """Writes command without waiting for its response. Literal is sent
+        with the command only if the server supports LITERAL+, synchronizing
+        literals are sent by `command`
+
+        :param name: IMAP command, e.g. 'UID FETCH'
+        :param args: command arguments
+        :param literal: the last argument sent as non-synchronizing literal
+        :return: tag of command
+        """
+        tag = 'A{:04d}'.format(next(self.__tags)).encode()
+        line = b' '.join([tag, name.encode()] + [
+            arg.encode() if isinstance(arg, str) else arg for arg in args
+        ])
+        if literal is not None:
+            if 'LITERAL+' not in self.capabilities:
+                raise ImapError('Server does not support LITERAL+')
+            line += ' {{{}+}}\r\n'.format(len(literal)).encode() + literal
+        self.writer.write(line + b'\r\n')
+        return tag
+
+    async def read(self) -> bool:
+        """Reads one response. Untagged responses are collected until
+        the next tagged response
+
+        :return: True if it is continuation request
+        """
+        line, literals = await self.read_response()
+        if line.startswith(b'* '):
+            self.update_capabilities(line[2:])
+            self.__untagged.append((line[2:], literals))
+        elif line.startswith(b'+'):
+            return True
+        else:
+            tag, _, line = line.partition(b' ')
+            status, _, text = line.partition(b' ')
+            self.update_capabilities(text)
+            self.__completed[tag] = status, self.__untagged, text
+            self.__untagged = []
+        return False
+
+    async def wait(self, tag: bytes) -> \
+            Tuple[bytes, List[Tuple[bytes, List[bytes]]], bytes]:
+        """Reads responses until tagged response of command
+
+        :param tag: bytes
+        :return: tuple status, untagged responses without '* ', tagged
+            response text
+        """
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+        while tag not in self.__completed:
+            if await self.read():
+                raise ImapAbort('Unexpected continuation request')
+        return self.__completed.pop(tag)
+
+    async def command(self, name: str, *args: AnyStr,
+                      literal: bytes = None) -> \
+            Tuple[bytes, List[Tuple[bytes, List[bytes]]], bytes]:
+        """Executes command and reads its response
+
+        :param name: IMAP command
+        :param args: command arguments
+        :param literal: the last argument, sent as non-synchronizing literal
+            if the server supports LITERAL+
+        :return: see `wait`
+        """
+        if literal is None or 'LITERAL+' in self.capabilities:
+            return await self.wait(self.send(name, *args, literal=literal))
+        tag = self.send(name, *args, '{{{}}}'.format(len(literal)))
+        await asyncio.wait_for(self.writer.drain(), self.timeout)
+        while not await self.read():
+            if tag in self.__completed:
+                return self.__completed.pop(tag)
+        self.writer.write(literal + b'\r\n')
+        return await self.wait(tag)
+
+    async def logout(self):
+        """Logs out and closes connection
+
+        :return:
+        """
+        try:
+            await self.command('LOGOUT')
+        except (OSError, ImapError, asyncio.IncompleteReadError,
+                asyncio.TimeoutError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        """Closes connection
+
+        :return:
+        """
+        self.writer.close()
+
+
+# errors of IMAP connection which are retried in bulk mode
+ASYNC_RETRY_EXCEPTIONS = (OSError, ImapAbort, asyncio.IncompleteReadError,
+                          asyncio.TimeoutError)
+
+
+async def async_create_imap_connection(conn_data: argparse.Namespace) -> \
+        AsyncImapConnection:
+    """Creates new connection to the imap server and authorize user
+
+    :param conn_data: argparse.Namespace
+    :return: AsyncImapConnection
+    """
+    port = conn_data.port
+    if conn_data.use_ssl and port == imaplib.IMAP4_PORT:
+        port = imaplib.IMAP4_SSL_PORT
+    conn = await AsyncImapConnection.open(
+        conn_data.host, port, conn_data.use_ssl,
+        getattr(conn_data, 'timeout', None) or None
+    )
+    status, _, text = await conn.command('LOGIN', quote(conn_data.username),
+                                         quote(conn_data.password))
+    if status != b'OK':
+        conn.close()
+        raise ImapError('Could not connect to the imap server. '
+                        'Error message {}'.format(text))
+    if not CAPABILITY_EXPR.match(text):
+        # server may advertise other capabilities after login, they are
+        # requested with SELECT by `async_change_swa_settings`
+        conn.capabilities = set()
+    return conn
+
+
+async def async_fetch_from_imap(conn: AsyncImapConnection, *args: AnyStr,
+                                cmd: str = 'FETCH') -> \
+        List[Tuple[bytes, List[bytes]]]:
+    """Executes IMAP command and raises exception if it failed
+
+    :param conn: AsyncImapConnection
+    :param args: command arguments
+    :param cmd: IMAP command
+    :return: untagged responses, see `AsyncImapConnection.wait`
+    """
+    status, untagged, text = await conn.command(cmd, *args)
+    if status != b'OK':
+        raise ImapError('Failed to execute fetch command: {}'.format(text))
+    return untagged
+
+
+async def async_search_preference_uids(
+        conn: AsyncImapConnection, tag: bytes = None,
+        criteria: Tuple[str] = PREFERENCE_SEARCH) -> \
+        Union[List[bytes], None]:
+    """UIDs of not deleted preference messages found by server side SEARCH,
+    see `search_preference_uids`
+
+    :param conn: AsyncImapConnection
+    :param tag: tag of already sent SEARCH command
+    :param criteria: search criteria if command was not sent
+    :return: list of UIDs or None if SEARCH failed
+    """
+    if tag is None:
+        tag = conn.send('UID SEARCH', *criteria)
+    status, untagged, text = await conn.wait(tag)
+    if status != b'OK':
+        warnings.warn('Server side search of preference emails failed, '
+                      'fetching envelopes instead. Error {}.'.format(text),
+                      RuntimeWarning)
+        return None
+    return uids_from_search_response(
+        [line for line, _ in untagged if line.startswith(b'SEARCH')]
+    )
+
+
+async def async_find_swa_preference_email(
+        conn: AsyncImapConnection, exists: int = None, search: bytes = None,
+        search_preferences: bool = True) -> \
+        Tuple[Union[PreferenceEmail, None], Set[int]]:
+    """Searches for preference messages, see `find_swa_preference_email`
+
+    :param conn: AsyncImapConnection
+    :param exists: number of messages in mailbox
+    :param search: tag of already sent SEARCH command
+    :param search_preferences: use server side SEARCH, see
+        `SEARCH_PREFERENCES`
+    :return: tuple PreferenceEmail or None, set of orphan preference uids
+    """
+    uids = None
+    if search or search_preferences:
+        uids = await async_search_preference_uids(conn, search)
+    if uids == [] and exists and await async_search_preference_uids(
+            conn, criteria=PREFERENCE_HEADER_SEARCH) != []:
+        uids = None
+    if uids is None:
+        uids = []
+        for message_set in fetch_windows(exists):
+            uids.extend(preference_uids_from_fetch_response(
+                await async_fetch_from_imap(conn, message_set,
+                                            '(UID ENVELOPE FLAGS)')
+            ))
+    email = None
+    orphan_preference_emails = set()
+    for uid in uids:
+        if not email:
+            email = message_from_fetch_response(
+                uid, await async_fetch_from_imap(conn, uid, '(RFC822)',
+                                                 cmd='UID FETCH')
+            )
+        else:
+            orphan_preference_emails.add(int(uid))
+    return email, orphan_preference_emails
+
+
+async def async_change_swa_settings(
+        conn: AsyncImapConnection, swa_options: dict,
+        cached: Tuple[int, int, int] = None, search_preferences: bool = True,
+        replace_invalid_xml: bool = False) -> \
+        Union[Tuple[int, int, int], None]:
+    """Changes swa preference email or create a new one if message with
+    preference does not exists, see `change_swa_settings`. Independent
+    commands are pipelined: CAPABILITY (if it is unknown), SELECT and SEARCH
+    (or FETCH of cached UID) are sent at once, then STORE of old preference
+    emails and APPEND
+
+    :param conn: AsyncImapConnection
+    :param swa_options: dict
+    :param cached: UIDVALIDITY, UID and size of preference email saved by
+        previous run, see `PreferenceUidCache`
+    :param search_preferences: use server side SEARCH, see
+        `SEARCH_PREFERENCES`
+    :param replace_invalid_xml: use preference template instead of invalid
+        xml even if `PreferenceEmail.REPLACE_INVALID_XML` is False
+    :return: UIDVALIDITY, UID and size of saved preference email if server
+        supports UIDPLUS or None
+    """
+    capability = None
+    if not conn.capabilities:
+        capability = conn.send('CAPABILITY')
+    select = conn.send('SELECT', quote('#Scalix/Oddpost'))
+    search = fetch = None
+    if cached:
+        # result is used only if UIDVALIDITY is the same
+        fetch = conn.send('UID FETCH', str(cached[1]), '(FLAGS RFC822)')
+    elif search_preferences:
+        search = conn.send('UID SEARCH', *PREFERENCE_SEARCH)
+    status, untagged, text = await conn.wait(select)
+    if capability:
+        # capabilities were saved while reading responses
+        await conn.wait(capability)
+    if status != b'OK':
+        raise ImapError('Could not select folder #Scalix/Oddpost. '
+                        'Imap response: {}'.format(text))
+
+    exists = 0
+    uidvalidity = None
+    for line, _ in untagged:
+        match = re.match(rb'(\d+) EXISTS', line)
+        if match:
+            exists = int(match.group(1))
+        match = re.match(rb'OK \[UIDVALIDITY (\d+)\]', line, re.I)
+        if match:
+            uidvalidity = int(match.group(1))
+
+    orphan_uids = set()
+    email = None
+    if fetch:
+        status, untagged, _ = await conn.wait(fetch)
+        if status == b'OK' and exists and cached[0] == uidvalidity:
+            email = cached_preference_email(cached[1], cached[2], untagged)
+    if exists and not email:
+        email, orphan_uids = await async_find_swa_preference_email(
+            conn, exists, search, search_preferences
+        )
+    elif search:
+        await conn.wait(search)
+    if not email:
+        email = create_preference_message()
+    if replace_invalid_xml:
+        email.REPLACE_INVALID_XML = True
+
+    for key, value in swa_options.items():
+        find_option_and_change(email.preferences, key, value)
+
+    if email.uid:
+        orphan_uids.add(email.uid)
+
+    message = imaplib.MapCRLF.sub(imaplib.CRLF, email.as_bytes())
+    store = None
+    uids_del = ','.join(str(uid) for uid in sorted(orphan_uids))
+    if orphan_uids:
+        store = conn.send('UID STORE', uids_del, '+FLAGS.SILENT',
+                          '(\\Deleted)')
+    status, _, text = await conn.command(
+        'APPEND', quote('#Scalix/Oddpost'), '(\\Seen)',
+        imaplib.Time2Internaldate(time.time()), literal=message
+    )
+    if store:
+        store_status, _, store_text = await conn.wait(store)
+        if store_status != b'OK':
+            warnings.warn(
+                'Could not delete duplicate preference emails {}'
+                '. Error {}.'.format(orphan_uids, store_text),
+                RuntimeWarning
+            )
+    if status != b'OK':
+        if email.uid:
+            await conn.command('UID STORE', str(email.uid), '-FLAGS',
+                               '(\\Deleted)')
+        raise ImapError('Could not save email. Error message {}'.format(text))
+
+    # expunge only old preference emails if server supports UID EXPUNGE
+    if orphan_uids:
+        if 'UIDPLUS' in conn.capabilities:
+            await conn.command('UID EXPUNGE', uids_del)
+        else:
+            await conn.command('EXPUNGE')
+
+    saved = appended_uid([text])
+    return saved + (len(message),) if saved else None
+
+
+async def async_change_user_swa_settings(
+        conn_data: argparse.Namespace, swa_options: dict, retries: int = 3,
+        backoff: float = 1.0, cache: PreferenceUidCache = None,
+        search_preferences: bool = True,
+        replace_invalid_xml: bool = False) -> int:
+    """Connects to the imap server as user and changes SWA preferences, see
+    `change_user_swa_settings`. Blocking calls of cache run in default
+    executor of event loop
+
+    :param conn_data: argparse.Namespace with host, port, use_ssl, username,
+        password and optional timeout
+    :param swa_options: dict
+    :param retries: max number of retries
+    :param backoff: delay before the first retry in seconds
+    :param cache: PreferenceUidCache or None
+    :param search_preferences: see `async_change_swa_settings`
+    :param replace_invalid_xml: see `async_change_swa_settings`
+    :return: number of attempts
+    """
+    loop = asyncio.get_event_loop()
+    attempt = 0
+    while True:
+        attempt += 1
+        conn = None
+        try:
+            conn = await async_create_imap_connection(conn_data)
+            cached = None
+            if cache is not None:
+                cached = await loop.run_in_executor(
+                    None, cache.get, conn_data.host, conn_data.username
+                )
+            saved = await async_change_swa_settings(
+                conn, swa_options, cached, search_preferences,
+                replace_invalid_xml
+            )
+            if cache is not None:
+                await loop.run_in_executor(None, cache.set, conn_data.host,
+                                           conn_data.username, saved)
+            return attempt
+        except ASYNC_RETRY_EXCEPTIONS:
+            if attempt > retries:
+                raise
+        finally:
+            if conn is not None:
+                await conn.logout()
+        await asyncio.sleep(backoff * 2 ** (attempt - 1) *
+                            random.uniform(0.5, 1.5))
+
+
+async def async_bulk_change_swa_settings(
+        conn_data: argparse.Namespace,
+        users: Iterator[Tuple[str, str, dict]], results: str,
+        workers: int = 100, retries: int = 3, backoff: float = 1.0,
+        progress_interval: float = 5.0, cache: PreferenceUidCache = None,
+        search_preferences: bool = True,
+        replace_invalid_xml: bool = False) -> BulkProgress:
+    """Changes SWA preferences of many users with at most `workers` IMAP
+    sessions in flight, see `bulk_change_swa_settings`
+
+    :param conn_data: argparse.Namespace with host, port, use_ssl and
+        optional timeout
+    :param users: iterable of tuples username, password, SWA options
+    :param results: CSV filename with result of each user
+    :param workers: number of concurrent IMAP sessions
+    :param retries: see `async_change_user_swa_settings`
+    :param backoff: see `async_change_user_swa_settings`
+    :param progress_interval: seconds between progress reports
+    :param cache: PreferenceUidCache or None
+    :param search_preferences: see `async_change_swa_settings`
+    :param replace_invalid_xml: see `async_change_swa_settings`
+    :return: BulkProgress
+    """
+    async def process(username: str, password: str, swa_options: dict) -> \
+            Tuple[int, float]:
+        started = time.time()
+        user_conn_data = argparse.Namespace(**vars(conn_data))
+        user_conn_data.username = username
+        user_conn_data.password = password
+        attempts = await async_change_user_swa_settings(
+            user_conn_data, swa_options, retries, backoff, cache,
+            search_preferences, replace_invalid_xml
+        )
+        return attempts, time.time() - started
+
+    progress = BulkProgress(progress_interval)
+    with open(results, 'w', newline='') as results_fd:
+        writer = csv.writer(results_fd)
+        writer.writerow(('username', 'status', 'attempts', 'seconds',
+                         'error'))
+
+        def save_results(done):
+            for future in done:
+                username = pending.pop(future)
+                try:
+                    attempts, seconds = future.result()
+                    writer.writerow((username, 'ok', attempts,
+                                     '{:.3f}'.format(seconds), ''))
+                    progress.add(True)
+                except Exception as exc:
+                    writer.writerow((username, 'failed', '', '',
+                                     '{}: {}'.format(type(exc).__name__,
+                                                     exc)))
+                    progress.add(False)
+            results_fd.flush()
+
+        pending = {}
+        for username, password, swa_options in users:
+            if len(pending) >= workers:
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                save_results(done)
+            pending[asyncio.ensure_future(
+                process(username, password, swa_options)
+            )] = username
+        while pending:
+            done, _ = await asyncio.wait(pending,
+                                         return_when=asyncio.FIRST_COMPLETED)
+            save_results(done)
+    progress.print()
+    return progress
+
+
+def run_bulk_change_swa_settings(*args, **kwargs) -> BulkProgress:
+    """Runs `async_bulk_change_swa_settings` in new event loop
+
+    :return: BulkProgress
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            async_bulk_change_swa_settings(*args, **kwargs)
+        )
+    finally:
+        loop.close()
@@ -7,21 +7,46 @@ application
 """
 
 import argparse
+import csv
 import imaplib
+import json
 import operator
+import os
+import random
 import re
+import socket
+import sqlite3
+import ssl
+import sys
+import threading
 import time
 import warnings
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
 from email import policy
 from email.message import EmailMessage
 from email.parser import BytesParser
 from email.base64mime import body_decode
 from email.errors import InvalidBase64CharactersDefect
-from typing import AnyStr, Generator, List, Union, Set, Tuple, Any
+from typing import (AnyStr, Generator, List, Union, Set, Tuple, Any,
+                    Iterator)
 from xml.etree import ElementTree
 from xml.etree.ElementTree import Element, ParseError
 
-import collections
+import collections.abc
+
+# errors of IMAP connection which are retried in bulk mode
+RETRY_EXCEPTIONS = (OSError, imaplib.IMAP4.abort)
+
+# server side search of preference messages. If SEARCH fails preference
+# messages are found by fetching envelopes in windows of FETCH_WINDOW messages.
+# Empty result is confirmed by search of SWA header
+SEARCH_PREFERENCES = True
+PREFERENCE_SEARCH = ('UNDELETED', 'SUBJECT', '"[prefs(v2.1) data]"')
+PREFERENCE_HEADER_SEARCH = ('UNDELETED', 'HEADER', 'X-Oddpost-Class', 'prefs')
+FETCH_WINDOW = 500
+
+# columns of bulk users file which are not SWA preference options
+BULK_USER_FIELDS = ('username', 'password')
 
 PREFERENCE_TEMPLATE = """<?xml version="1.0"?>
 <preferences>
@@ -70,7 +95,8 @@ PREFERENCE_TEMPLATE = """<?xml version="1.0"?>
 
 
 class PreferenceEmail(object):
-    """Generic class for preference email
+    """Generic class for preference email. REPLACE_INVALID_XML can be
+    changed for class or for one email
 
     """
 
@@ -108,7 +134,7 @@ class PreferenceEmail(object):
                 self.__preferences = self.__parse_preferences()
             except ParseError as parserError:
                 warnings.warn(parserError, RuntimeWarning)
-                if PreferenceEmail.REPLACE_INVALID_XML:
+                if self.REPLACE_INVALID_XML:
                     self.__preferences = ElementTree.fromstring(
                         PREFERENCE_TEMPLATE
                     )
@@ -189,24 +215,52 @@ class PreferenceEmail(object):
         return self.__message.as_bytes()
 
 
+def create_ssl_context() -> ssl.SSLContext:
+    """SSL context of IMAP connections of both engines. Certificates are not
+    verified like imaplib.IMAP4_SSL does by default, Scalix servers usually
+    have self-signed certificates
+
+    :return: ssl.SSLContext
+    """
+    context = ssl.create_default_context()
+    context.check_hostname = False
+    context.verify_mode = ssl.CERT_NONE
+    return context
+
+
 def create_imap_connection(conn_data: argparse.Namespace) -> imaplib.IMAP4:
     """Creates new connection to the imap server and authorize user
 
     :param conn_data: argparse.Namespace
     :return: imaplib.IMAP4
     """
-    imap_cls = imaplib.IMAP4
     port = conn_data.port
+    kwargs = {}
+    timeout = getattr(conn_data, 'timeout', None)
+    if timeout and sys.version_info >= (3, 9):
+        # before Python 3.9 socket.setdefaulttimeout is used, see main
+        kwargs['timeout'] = timeout
     if conn_data.use_ssl:
-        imap_cls = imaplib.IMAP4_SSL
         if port == imaplib.IMAP4_PORT:
             port = imaplib.IMAP4_SSL_PORT
-    conn = imap_cls(conn_data.host, port)
+        conn = imaplib.IMAP4_SSL(conn_data.host, port,
+                                 ssl_context=create_ssl_context(), **kwargs)
+    else:
+        conn = imaplib.IMAP4(conn_data.host, port, **kwargs)
     status, data = conn.login(conn_data.username, conn_data.password)
     if status != 'OK':
         raise Exception('Could not connect to the imap server. '
                         'Error message {}'.format(data))
 
+    # server may advertise other capabilities after login, e.g. UIDPLUS,
+    # in response code of LOGIN or in response to CAPABILITY
+    capabilities = conn.untagged_responses.pop('CAPABILITY', None)
+    if not capabilities:
+        status, capabilities = conn.capability()
+    if status == 'OK' and capabilities and capabilities[-1]:
+        conn.capabilities = tuple(
+            capabilities[-1].decode('ascii', 'replace').upper().split()
+        )
     return conn
 
 
@@ -216,7 +270,7 @@ def is_iterable(item) -> bool:
     :param item:
     :return: boolean
     """
-    return isinstance(item, collections.Iterable) and not \
+    return isinstance(item, collections.abc.Iterable) and not \
         isinstance(item, (bytes, str))
 
 
@@ -242,6 +296,9 @@ def build_imap_response_line(lines: List[Any]) -> Tuple[bytes, List[bytes]]:
     """
     lines = iter(lines)
     for line in lines:
+        if line is None:
+            # imaplib returns [None] if nothing was found
+            continue
         result = []
         literals = []
         while True:
@@ -257,8 +314,9 @@ def build_imap_response_line(lines: List[Any]) -> Tuple[bytes, List[bytes]]:
 
 def fetch_from_imap(conn: imaplib.IMAP4, *args, cmd='fetch', **kwargs) -> \
         Tuple[bytes, List[bytes]]:
-    """Function which will call imaplib function but it always will check status
-    of the executed command and will raise Exception if IMAP command failed
+    """Function which will call imaplib function but it always will check
+    status of the executed command and will raise Exception if IMAP command
+    failed
 
     :param conn: imaplib.IMAP4 object
     :param args:
@@ -266,27 +324,124 @@ def fetch_from_imap(conn: imaplib.IMAP4, *args, cmd='fetch', **kwargs) -> \
     :param kwargs:
     :return: Tuple[bytes, List[bytes]]
     """
-    # first lets execute CHECK IMAP command. It will flush any pending
-    # operation in session
-    conn.check()
     status, data = getattr(conn, cmd)(*args, **kwargs)
     if status != 'OK':
         raise Exception('Failed to execute fetch command: {}'.format(data))
     return build_imap_response_line(data)
 
 
-def fetch_message_rfc822(conn: imaplib.IMAP4, uid: AnyStr) -> PreferenceEmail:
-    """Fetches email
+def pipeline_imap_commands(conn: imaplib.IMAP4, *commands: Tuple) -> \
+        List[Tuple[str, List[bytes]]]:
+    """Sends IMAP commands without waiting for responses of the previous ones
+    and then reads their responses, so independent commands cost one round
+    trip. imaplib has no public API for it, its _command and
+    _command_complete are used like imaplib.IMAP4._simple_command does. If
+    they are missing commands are run one by one, see `run_imap_command`
+
+    :param conn: imaplib.IMAP4
+    :param commands: tuples of command name and arguments, e.g.
+        ('UID', 'STORE', '1,2', '+FLAGS', '(\\Deleted)'). The last argument
+        of APPEND is the message. If the server supports LITERAL+ it is sent
+        as non-synchronizing literal, otherwise imaplib waits for
+        continuation before sending it
+    :return: list of tuples status, data in order of commands. Failed
+        commands have status 'NO' or 'BAD' instead of exception
+    """
+    if not (hasattr(conn, '_command') and
+            hasattr(conn, '_command_complete')):
+        return [run_imap_command(conn, *command) for command in commands]
+    tags = []
+    for name, *args in commands:
+        if name == 'APPEND':
+            *args, message = args
+            message = imaplib.MapCRLF.sub(imaplib.CRLF, message)
+            if 'LITERAL+' in conn.capabilities:
+                args.append('{{{}+}}'.format(len(message)).encode() +
+                            imaplib.CRLF + message)
+            else:
+                conn.literal = message
+        tags.append((name, conn._command(name, *args)))
+    results = []
+    for name, tag in tags:
+        try:
+            results.append(conn._command_complete(name, tag))
+        except imaplib.IMAP4.abort:
+            raise
+        except imaplib.IMAP4.error as error:
+            results.append(('BAD', [str(error).encode()]))
+    return results
+
+
+def run_imap_command(conn: imaplib.IMAP4, name: str, *args) -> \
+        Tuple[str, List[bytes]]:
+    """Runs IMAP command by public imaplib API, e.g. conn.uid for UID
+    commands
 
     :param conn: imaplib.IMAP4
+    :param name: command name, see `pipeline_imap_commands`
+    :param args: command arguments
+    :return: tuple status, data. Failed command has status 'NO' or 'BAD'
+        instead of exception
+    """
+    try:
+        return getattr(conn, name.lower())(*args)
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error as error:
+        return 'BAD', [str(error).encode()]
+
+
+def appended_uid(data: List[bytes]) -> Union[Tuple[int, int], None]:
+    """UIDVALIDITY and UID of appended message from APPENDUID response code
+    of UIDPLUS servers
+
+    :param data: APPEND response data
+    :return: tuple UIDVALIDITY, UID or None
+    """
+    for line in data or []:
+        if isinstance(line, bytes):
+            match = re.search(rb'\[APPENDUID (\d+) (\d+)\]', line, re.I)
+            if match:
+                return int(match.group(1)), int(match.group(2))
+    return None
+
+
+def cached_preference_email(
+        uid: int, size: int,
+        response: Iterator[Tuple[bytes, List[bytes]]]) -> \
+        Union[PreferenceEmail, None]:
+    """Finds preference email of cached UID in response of
+    UID FETCH (FLAGS RFC822) command. UIDs are not reused while UIDVALIDITY
+    is the same, so message is valid if it is not deleted and has cached size
+
+    :param uid: cached UID
+    :param size: cached message size
+    :param response: iterable of tuples response line, literals, see
+        `build_imap_response_line`
+    :return: PreferenceEmail or None if message is not valid anymore
+    """
+    for line, literals in response:
+        if not re.search(rb'UID\s' + str(uid).encode() + rb'\D', line):
+            continue
+        if b'\\Deleted' in line or len(literals) != 1 or \
+                len(literals[0]) != size:
+            return None
+        return PreferenceEmail.from_bytes(uid, literals[0])
+    return None
+
+
+def message_from_fetch_response(
+        uid: AnyStr, response: Iterator[Tuple[bytes, List[bytes]]]) -> \
+        Union[PreferenceEmail, None]:
+    """Finds email in response of UID FETCH (RFC822) command
+
     :param uid: UID
-    :return: PreferenceEmail
+    :param response: iterable of tuples response line, literals, see
+        `build_imap_response_line`
+    :return: PreferenceEmail or None
     """
-    #  bellow we are calling conn.uid('fetch', uid, (RFC822))
-    #  see IMAP4.uid or IMAP.fetch function docstring  for details
-    fetch_args = [conn, 'fetch', uid, '(RFC822)']
     warn_msg = 'Message RFC822 was not fetched using UID {}'.format(uid)
-    for line, literals in fetch_from_imap(*fetch_args, cmd='uid'):
+    for line, literals in response:
         match = re.search(rb'RFC822\s+\{(\d+)\}', line)
         if match:
             msg_size = int(match.group(1))
@@ -310,31 +465,136 @@ def fetch_message_rfc822(conn: imaplib.IMAP4, uid: AnyStr) -> PreferenceEmail:
         warnings.warn(warn_msg, RuntimeWarning)
 
 
-def find_swa_preference_email(conn: imaplib.IMAP4) -> \
+def fetch_message_rfc822(conn: imaplib.IMAP4, uid: AnyStr) -> PreferenceEmail:
+    """Fetches email
+
+    :param conn: imaplib.IMAP4
+    :param uid: UID
+    :return: PreferenceEmail
+    """
+    #  bellow we are calling conn.uid('fetch', uid, (RFC822))
+    #  see IMAP4.uid or IMAP.fetch function docstring  for details
+    fetch_args = [conn, 'fetch', uid, '(RFC822)']
+    return message_from_fetch_response(
+        uid, fetch_from_imap(*fetch_args, cmd='uid')
+    )
+
+
+def preference_uids_from_fetch_response(
+        response: Iterator[Tuple[bytes, List[bytes]]]) -> List[bytes]:
+    """UIDs of preference messages which are not deleted in response of
+    FETCH (UID ENVELOPE FLAGS) command
+
+    :param response: iterable of tuples response line, literals, see
+        `build_imap_response_line`
+    :return: list of UIDs in mailbox order
+    """
+    uids = []
+    for line, _ in response:
+        if b'[prefs(v2.1) data]' in line and b'\\Deleted' not in line:
+            match = re.search(rb'UID\s(\d+)', line)
+            if match:
+                uids.append(match.group(1))
+    return uids
+
+
+def uids_from_search_response(lines: List[bytes]) -> List[bytes]:
+    """UIDs of SEARCH response in ascending order
+
+    :param lines: untagged SEARCH response lines with or without 'SEARCH'
+    :return: list of UIDs
+    """
+    uids = []
+    for line in lines:
+        if isinstance(line, bytes):
+            uids.extend(uid for uid in line.split() if uid.isdigit())
+    return sorted(uids, key=int)
+
+
+def fetch_windows(exists: int = None, window: int = None) -> List[str]:
+    """Message sets to fetch mailbox in windows of `window` messages
+
+    :param exists: number of messages in mailbox or None if it is unknown
+    :param window: int, FETCH_WINDOW by default
+    :return: list of message sets, e.g. ['1:500', '501:1000']
+    """
+    if not exists:
+        return ['1:*']
+    window = window or FETCH_WINDOW
+    return ['{}:{}'.format(start, min(start + window - 1, exists))
+            for start in range(1, exists + 1, window)]
+
+
+def search_preference_uids(conn: imaplib.IMAP4,
+                           criteria: Tuple[str] = PREFERENCE_SEARCH) -> \
+        Union[List[bytes], None]:
+    """UIDs of not deleted preference messages found by server side SEARCH
+
+    :param conn: imaplib.IMAP4
+    :param criteria: search criteria
+    :return: list of UIDs or None if SEARCH failed
+    """
+    try:
+        status, data = conn.uid('SEARCH', *criteria)
+    except imaplib.IMAP4.abort:
+        raise
+    except imaplib.IMAP4.error as error:
+        status, data = 'BAD', error
+    if status != 'OK':
+        warnings.warn('Server side search of preference emails failed, '
+                      'fetching envelopes instead. Error {}.'.format(data),
+                      RuntimeWarning)
+        return None
+    return uids_from_search_response(data)
+
+
+def find_swa_preference_email(conn: imaplib.IMAP4, exists: int = None) -> \
         Tuple[Union[PreferenceEmail, None], Set[int]]:
     """Searches for preference messages. It will grab first email and the rest
     emails preferences if they exists will be ignored - its the same behaviour
-    as SWA has.
+    as SWA has. Preference messages are found by server side SEARCH, if it
+    fails or SEARCH_PREFERENCES is False envelopes of all messages are
+    fetched in windows of FETCH_WINDOW messages. Server may not search
+    subjects the same way as we match envelopes, so if SEARCH finds nothing
+    in not empty mailbox envelopes are fetched only if search of SWA header
+    finds something or fails
 
     :param conn: imaplib.IMAP4
+    :param exists: number of messages in mailbox
     :return: tuple first is PreferenceEmail what we found found , second
         value - set of orphan email preferences uids
 
     """
+    uids = search_preference_uids(conn) if SEARCH_PREFERENCES else None
+    if uids == [] and exists and search_preference_uids(
+            conn, PREFERENCE_HEADER_SEARCH) != []:
+        uids = None
+    if uids is None:
+        uids = []
+        for message_set in fetch_windows(exists):
+            uids.extend(preference_uids_from_fetch_response(
+                fetch_from_imap(conn, message_set, '(UID ENVELOPE FLAGS)')
+            ))
     email = None
     orphan_preference_emails = set()
-    for line, _ in fetch_from_imap(conn, '1:*', '(UID ENVELOPE FLAGS)'):
-        if b'[prefs(v2.1) data]' in line and b'\\Deleted' not in line:
-            match = re.search(rb'UID\s(\d+)', line)
-            if not match:
-                continue
-            if not email:
-                email = fetch_message_rfc822(conn, match.group(1))
-            else:
-                orphan_preference_emails.add(int(match.group(1)))
+    for uid in uids:
+        if not email:
+            email = fetch_message_rfc822(conn, uid)
+        else:
+            orphan_preference_emails.add(int(uid))
     return email, orphan_preference_emails
 
 
+def selected_uidvalidity(conn: imaplib.IMAP4) -> Union[int, None]:
+    """UIDVALIDITY of selected mailbox
+
+    :param conn: imaplib.IMAP4
+    :return: int or None if server did not send it
+    """
+    _, data = conn.response('UIDVALIDITY')
+    return int(data[0]) if data and data[0] else None
+
+
 def find_option_and_change(document: ElementTree, name: AnyStr, value: AnyStr):
     """Finds option in xml document and sets value
 
@@ -370,13 +630,19 @@ def create_preference_message() -> PreferenceEmail:
     return PreferenceEmail(0, msg)
 
 
-def change_swa_settings(conn: imaplib.IMAP4, swa_options: dict):
+def change_swa_settings(conn: imaplib.IMAP4, swa_options: dict,
+                        cached: Tuple[int, int, int] = None) -> \
+        Union[Tuple[int, int, int], None]:
     """Changes swa preference email or create a new one if message with
     preference does not exists.
 
     :param swa_options:
     :param conn: imaplib.IMAP4
-    :return:
+    :param cached: UIDVALIDITY, UID and size of preference email saved by
+        previous run, see `PreferenceUidCache`. The message is fetched
+        directly if UIDVALIDITY of mailbox is the same
+    :return: UIDVALIDITY, UID and size of saved preference email if server
+        supports UIDPLUS or None
     """
     status, data = conn.select('#Scalix/Oddpost')
     if status != 'OK':
@@ -384,12 +650,18 @@ def change_swa_settings(conn: imaplib.IMAP4, swa_options: dict):
                         'Imap response: {}'.format(data))
 
     orphan_uids = set()
-    if not int(data[0]):
+    email = None
+    exists = int(data[0])
+    if exists and cached and cached[0] == selected_uidvalidity(conn):
+        email = cached_preference_email(cached[1], cached[2], fetch_from_imap(
+            conn, 'fetch', str(cached[1]), '(FLAGS RFC822)', cmd='uid'
+        ))
+    if not exists:
         #  there are no messages in mailbox fetching will fail so we will
         #  skip it
         email = create_preference_message()
-    else:
-        email, orphan_uids = find_swa_preference_email(conn)
+    elif not email:
+        email, orphan_uids = find_swa_preference_email(conn, exists)
 
     if not email:
         email = create_preference_message()
@@ -402,40 +674,320 @@ def change_swa_settings(conn: imaplib.IMAP4, swa_options: dict):
     if email.uid:
         orphan_uids.add(email.uid)
 
+    # STORE and APPEND are independent, so they are pipelined
+    message = imaplib.MapCRLF.sub(imaplib.CRLF, email.as_bytes())
+    commands = []
+    uids_del = ','.join(str(uid) for uid in sorted(orphan_uids))
     if orphan_uids:
-        uids_del = b','.join([str(uid).encode() for uid in orphan_uids])
-        status, data = conn.uid('STORE', uids_del.decode(), '+FLAGS',
-                                '\\Deleted')
-        if status != 'OK':
-            warnings.warn(
-                'Could not delete duplicate preference emails {}'
-                '. Error {}.'.format(orphan_uids, data),
-                RuntimeWarning
-            )
+        commands.append(('UID', 'STORE', uids_del, '+FLAGS.SILENT',
+                         '(\\Deleted)'))
+    commands.append(('APPEND', '#Scalix/Oddpost', '(\\Seen)',
+                     imaplib.Time2Internaldate(time.time()), message))
+    results = pipeline_imap_commands(conn, *commands)
+
+    if orphan_uids and results[0][0] != 'OK':
+        warnings.warn(
+            'Could not delete duplicate preference emails {}'
+            '. Error {}.'.format(orphan_uids, results[0][1]),
+            RuntimeWarning
+        )
 
-    status, data = conn.append('#Scalix/Oddpost', '\\Seen',
-                               imaplib.Time2Internaldate(time.time()),
-                               email.as_bytes())
+    status, data = results[-1]
     if status != 'OK':
         if email.uid:
-            conn.uid('STORE', email.uid, '-FLAGS', '\\Deleted')
+            conn.uid('STORE', str(email.uid), '-FLAGS', '\\Deleted')
         raise Exception('Could not save email. Error message {}'.format(data))
 
-    conn.expunge()
+    # expunge only old preference emails if server supports UID EXPUNGE
+    if orphan_uids:
+        if 'UIDPLUS' in conn.capabilities:
+            conn.uid('EXPUNGE', uids_del)
+        else:
+            conn.expunge()
+
+    saved = appended_uid(data)
+    return saved + (len(message),) if saved else None
+
+
+def parse_swa_settings(options: List[str]) -> dict:
+    """Parses SWA preference options in format OPTION=VALUE
+
+    :param options: list of strings
+    :return: dict
+    """
+    swa_settings = {}
+    for option in options or []:
+        if '=' not in option:
+            raise Exception('Invalid SWA configuration option format : {}.'
+                            ' Supported format: OPTION=VALUE'.format(option))
+        option_name, option_value = option.split('=', 1)
+        swa_settings[option_name] = option_value.strip('\'"')
+    return swa_settings
+
+
+def read_bulk_users(filename: str, password: str = None,
+                    swa_options: dict = None) -> \
+        Iterator[Tuple[str, str, dict]]:
+    """Reads users and their SWA preference options from CSV or JSONL file.
+    CSV file has header with username, optional password and SWA option
+    names, empty cells are skipped. Each line of JSONL file is object with
+    username, optional password and settings object. Options of the file
+    override common options
+
+    :param filename: CSV or JSONL (.jsonl, .json) file
+    :param password: password of users without password in the file
+    :param swa_options: common SWA preference options
+    :return: generator of tuples username, password, SWA options
+    """
+    swa_options = swa_options or {}
+    with open(filename, newline='') as users_fd:
+        if os.path.splitext(filename)[1].lower() in ('.jsonl', '.json'):
+            rows = (json.loads(line) for line in users_fd if line.strip())
+            rows = (dict(row.get('settings') or {}, username=row['username'],
+                         password=row.get('password')) for row in rows)
+        else:
+            rows = csv.DictReader(users_fd)
+        for row in rows:
+            username = (row.get('username') or '').strip()
+            if not username:
+                continue
+            settings = dict(swa_options)
+            settings.update((key, value) for key, value in row.items()
+                            if key not in BULK_USER_FIELDS and
+                            value not in (None, ''))
+            yield username, row.get('password') or password, settings
+
+
+def change_user_swa_settings(conn_data: argparse.Namespace,
+                             swa_options: dict, retries: int = 3,
+                             backoff: float = 1.0,
+                             cache: 'PreferenceUidCache' = None) -> int:
+    """Connects to the imap server as user and changes SWA preferences.
+    Connection errors are retried with exponential backoff
+
+    :param conn_data: argparse.Namespace with host, port, use_ssl, username
+        and password
+    :param swa_options: dict
+    :param retries: max number of retries
+    :param backoff: delay before the first retry in seconds, it is doubled
+        on each retry
+    :param cache: PreferenceUidCache or None
+    :return: number of attempts
+    """
+    attempt = 0
+    while True:
+        attempt += 1
+        conn = None
+        try:
+            conn = create_imap_connection(conn_data)
+            if cache is None:
+                change_swa_settings(conn, swa_options)
+            else:
+                cache.set(conn_data.host, conn_data.username,
+                          change_swa_settings(conn, swa_options, cache.get(
+                              conn_data.host, conn_data.username
+                          )))
+            return attempt
+        except RETRY_EXCEPTIONS:
+            if attempt > retries:
+                raise
+        finally:
+            if conn is not None:
+                try:
+                    conn.logout()
+                except (OSError, imaplib.IMAP4.error):
+                    pass
+        time.sleep(backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+
+
+class PreferenceUidCache(object):
+    """SQLite cache of UIDVALIDITY of #Scalix/Oddpost, UID and size of users
+    preference email, so repeated runs fetch only one message per user
+    instead of searching for it. Thread safe
+
+    """
+
+    def __init__(self, filename: str):
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(filename, isolation_level=None,
+                                    check_same_thread=False)
+        self.__db.execute('PRAGMA journal_mode=WAL')
+        self.__db.execute('PRAGMA synchronous=NORMAL')
+        self.__db.execute('CREATE TABLE IF NOT EXISTS preference_uids ('
+                          'host TEXT, username TEXT, uidvalidity INTEGER, '
+                          'uid INTEGER, size INTEGER, '
+                          'PRIMARY KEY (host, username))')
+
+    def get(self, host: str, username: str) -> \
+            Union[Tuple[int, int, int], None]:
+        """Cached preference email of user
+
+        :param host: imap server
+        :param username: str
+        :return: tuple UIDVALIDITY, UID, size or None
+        """
+        with self.__lock:
+            return self.__db.execute(
+                'SELECT uidvalidity, uid, size FROM preference_uids '
+                'WHERE host = ? AND username = ?', (host, username)
+            ).fetchone()
+
+    def set(self, host: str, username: str,
+            saved: Union[Tuple[int, int, int], None]):
+        """Saves preference email of user. Unknown preference email (server
+        does not support UIDPLUS) removes user from cache
+
+        :param host: imap server
+        :param username: str
+        :param saved: tuple UIDVALIDITY, UID, size or None
+        :return:
+        """
+        with self.__lock:
+            if saved:
+                self.__db.execute(
+                    'INSERT OR REPLACE INTO preference_uids (host, username, '
+                    'uidvalidity, uid, size) VALUES (?, ?, ?, ?, ?)',
+                    (host, username) + tuple(saved)
+                )
+            else:
+                self.__db.execute('DELETE FROM preference_uids WHERE '
+                                  'host = ? AND username = ?',
+                                  (host, username))
+
+    def close(self):
+        """Closes database
+
+        :return:
+        """
+        with self.__lock:
+            self.__db.close()
+
+
+class BulkProgress(object):
+    """Thread safe counters of processed users which are printed not often
+    than each `interval` seconds
+
+    """
+
+    def __init__(self, interval: float = 5.0, stream=sys.stderr):
+        self.interval = interval
+        self.stream = stream
+        self.started = time.time()
+        self.succeeded = 0
+        self.failed = 0
+        self.__printed = 0.0
+        self.__lock = threading.Lock()
+
+    def add(self, success: bool):
+        """Counts processed user and prints progress
+
+        :param success: boolean
+        :return:
+        """
+        with self.__lock:
+            if success:
+                self.succeeded += 1
+            else:
+                self.failed += 1
+            if time.time() - self.__printed >= self.interval:
+                self.print()
+
+    def print(self):
+        """Prints number of processed users and throughput
+
+        :return:
+        """
+        seconds = time.time() - self.started
+        done = self.succeeded + self.failed
+        print('Processed {} users ({} failed) in {:.1f} seconds, {:.2f} '
+              'users/sec'.format(done, self.failed, seconds,
+                                 done / seconds if seconds else 0),
+              file=self.stream)
+        self.__printed = time.time()
+
+
+def bulk_change_swa_settings(conn_data: argparse.Namespace,
+                             users: Iterator[Tuple[str, str, dict]],
+                             results: str, workers: int = 8,
+                             retries: int = 3, backoff: float = 1.0,
+                             progress_interval: float = 5.0,
+                             cache: PreferenceUidCache = None) -> \
+        BulkProgress:
+    """Changes SWA preferences of many users by pool of `workers` threads,
+    each user has own IMAP connection. At most 2 * `workers` users are read
+    ahead. Result of each user is written to CSV file as soon as user is
+    processed
+
+    :param conn_data: argparse.Namespace with host, port and use_ssl
+    :param users: iterable of tuples username, password, SWA options, see
+        `read_bulk_users`
+    :param results: CSV filename with username, status, attempts, seconds
+        and error of each user
+    :param workers: number of concurrent IMAP connections
+    :param retries: see `change_user_swa_settings`
+    :param backoff: see `change_user_swa_settings`
+    :param progress_interval: seconds between progress reports
+    :param cache: PreferenceUidCache or None
+    :return: BulkProgress
+    """
+    def process(username: str, password: str, swa_options: dict) -> \
+            Tuple[int, float]:
+        started = time.time()
+        user_conn_data = argparse.Namespace(**vars(conn_data))
+        user_conn_data.username = username
+        user_conn_data.password = password
+        attempts = change_user_swa_settings(user_conn_data, swa_options,
+                                            retries, backoff, cache)
+        return attempts, time.time() - started
+
+    progress = BulkProgress(progress_interval)
+    with open(results, 'w', newline='') as results_fd, \
+            ThreadPoolExecutor(max_workers=workers) as executor:
+        writer = csv.writer(results_fd)
+        writer.writerow(('username', 'status', 'attempts', 'seconds',
+                         'error'))
+
+        def save_result(future):
+            username = pending.pop(future)
+            try:
+                attempts, seconds = future.result()
+                writer.writerow((username, 'ok', attempts,
+                                 '{:.3f}'.format(seconds), ''))
+                progress.add(True)
+            except Exception as exc:
+                writer.writerow((username, 'failed', '', '',
+                                 '{}: {}'.format(type(exc).__name__, exc)))
+                progress.add(False)
+            results_fd.flush()
+
+        pending = {}
+        for username, password, swa_options in users:
+            if len(pending) >= 2 * workers:
+                for future in wait(pending, return_when=FIRST_COMPLETED)[0]:
+                    save_result(future)
+            pending[executor.submit(process, username, password,
+                                    swa_options)] = username
+        while pending:
+            for future in wait(pending, return_when=FIRST_COMPLETED)[0]:
+                save_result(future)
+    progress.print()
+    return progress
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(add_help=True)
     parser.add_argument('--host', type=str, required=True,
                         help='Imap server hostname or ip')
-    parser.add_argument('--username', type=str, required=True,
+    parser.add_argument('--username', type=str,
                         help='Username to login')
-    parser.add_argument('--password', type=str, required=True,
-                        help='User password')
-    parser.add_argument('--settings', nargs='*', required=True,
+    parser.add_argument('--password', type=str,
+                        help='User password. In bulk mode it is used for '
+                             'users without password in the users file')
+    parser.add_argument('--settings', nargs='*',
                         help='Multiplier SWA preference option which need to '
                              'change. Usage for e.g. '
-                             'OPTION=VALUE OPTION2=VALUE')
+                             'OPTION=VALUE OPTION2=VALUE. In bulk mode they '
+                             'are applied to all users')
     parser.add_argument('--port', type=int, help='Imap server port',
                         default=imaplib.IMAP4_PORT)
     parser.add_argument('--use-ssl', type=bool, help='Use ssl connection',
@@ -446,18 +998,85 @@ if __name__ == '__main__':
                         default=False)
     parser.add_argument('--debug', default=0, type=int,
                         help='Sets debug level for the imaplib module.')
+    parser.add_argument('--no-search', action='store_true',
+                        help='Find preference email by fetching envelopes of '
+                             'all messages instead of server side SEARCH.')
+    parser.add_argument('--cache', metavar='FILENAME',
+                        help='SQLite file with UIDs of users preference '
+                             'emails. Cached email is fetched directly '
+                             'instead of searching while UIDVALIDITY of '
+                             'the folder is the same.')
+    parser.add_argument('--bulk', metavar='FILENAME',
+                        help='Change SWA preferences of users from CSV file '
+                             '(username, password and option columns) or '
+                             'JSONL file ({"username": ..., "password": ..., '
+                             '"settings": {...}} per line).')
+    parser.add_argument('--workers', type=int, default=8,
+                        help='Number of concurrent IMAP connections in bulk '
+                             'mode.')
+    parser.add_argument('--engine', choices=('threads', 'asyncio'),
+                        default='threads',
+                        help='Bulk mode engine: pool of threads with blocking '
+                             'imaplib connections or asyncio connections '
+                             '(Python 3.5+) which keep hundreds of sessions '
+                             'in flight on one core.')
+    parser.add_argument('--retries', type=int, default=3,
+                        help='Number of retries of user on connection errors '
+                             'in bulk mode.')
+    parser.add_argument('--backoff', type=float, default=1.0,
+                        help='Delay in seconds before the first retry, it is '
+                             'doubled on each retry.')
+    parser.add_argument('--results', metavar='FILENAME',
+                        help='CSV file with result of each user in bulk '
+                             'mode. Default: FILENAME.results.csv')
+    parser.add_argument('--progress-interval', type=float, default=5.0,
+                        help='Seconds between progress reports in bulk mode.')
+    parser.add_argument('--timeout', type=float, default=60.0,
+                        help='Seconds to wait for IMAP server to connect or '
+                             'respond. 0 - wait forever.')
 
     cmd_args = parser.parse_args()
+    if not cmd_args.bulk and not (cmd_args.username and cmd_args.password
+                                  and cmd_args.settings):
+        parser.error('--username, --password and --settings are required '
+                     'without --bulk')
 
-    swa_settings = {}
-    for option in cmd_args.settings:
-        if '=' not in option:
-            raise Exception('Invalid SWA configuration option format : {}.'
-                            ' Supported format: OPTION=VALUE'.format(option))
-        option_name, option_value = option.split('=', 1)
-        swa_settings[option_name] = option_value.strip('\'"')
+    swa_settings = parse_swa_settings(cmd_args.settings)
 
     imaplib.Debug = cmd_args.debug
+    if cmd_args.timeout and sys.version_info < (3, 9):
+        # imaplib has timeout argument since Python 3.9
+        socket.setdefaulttimeout(cmd_args.timeout)
     PreferenceEmail.REPLACE_INVALID_XML = cmd_args.replace_invalid_xml
+    SEARCH_PREFERENCES = not cmd_args.no_search
+    uid_cache = PreferenceUidCache(cmd_args.cache) if cmd_args.cache else None
+
+    if cmd_args.bulk:
+        bulk_engine = bulk_change_swa_settings
+        engine_options = {}
+        if cmd_args.engine == 'asyncio':
+            from async_swa_preferences import run_bulk_change_swa_settings
+            bulk_engine = run_bulk_change_swa_settings
+            engine_options = dict(
+                search_preferences=SEARCH_PREFERENCES,
+                replace_invalid_xml=cmd_args.replace_invalid_xml
+            )
+        bulk_progress = bulk_engine(
+            cmd_args,
+            read_bulk_users(cmd_args.bulk, cmd_args.password, swa_settings),
+            cmd_args.results or cmd_args.bulk + '.results.csv',
+            workers=max(cmd_args.workers, 1), retries=cmd_args.retries,
+            backoff=cmd_args.backoff,
+            progress_interval=cmd_args.progress_interval, cache=uid_cache,
+            **engine_options
+        )
+        sys.exit(1 if bulk_progress.failed else 0)
 
-    change_swa_settings(create_imap_connection(cmd_args), swa_settings)
+    imap_conn = create_imap_connection(cmd_args)
+    if uid_cache is None:
+        change_swa_settings(imap_conn, swa_settings)
+    else:
+        uid_cache.set(cmd_args.host, cmd_args.username, change_swa_settings(
+            imap_conn, swa_settings,
+            uid_cache.get(cmd_args.host, cmd_args.username)
+        ))
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Local stand-in IMAP server for tests of change_swa_preferences.py and
+async_swa_preferences.py. It implements only the commands both engines use
+on one #Scalix/Oddpost folder per user. The server runs its asyncio loop in
+a background thread, so blocking imaplib clients can use it too
+
+"""
+
+import asyncio
+import re
+import threading
+from typing import List, Tuple
+
+FOLDER = '#Scalix/Oddpost'
+
+ARGUMENT_EXPR = re.compile(rb'"(?:[^"\\]|\\.)*"|\([^)]*\)|\S+')
+LITERAL_EXPR = re.compile(rb'\{(\d+)(\+?)\}$')
+HEADER_EXPR = re.compile(rb'^Subject: (.*?)\r?$', re.M | re.I)
+BODY_EXPR = re.compile(rb'\r?\n\r?\n')
+
+
+class FakeMailbox(object):
+    """#Scalix/Oddpost folder of one user. Messages are lists UID, set of
+    flags, message bytes
+
+    """
+
+    def __init__(self, password: str, uidvalidity: int = 1000):
+        self.password = password
+        self.uidvalidity = uidvalidity
+        self.uidnext = 1
+        self.messages = []
+
+    def add(self, data: bytes, flags: Tuple[str] = ('\\Seen', )) -> int:
+        """Appends message
+
+        :param data: message bytes
+        :param flags: message flags
+        :return: UID of message
+        """
+        uid = self.uidnext
+        self.uidnext += 1
+        self.messages.append([uid, set(flags), data])
+        return uid
+
+    def select(self, message_set: bytes, uid: bool) -> List[Tuple[int, list]]:
+        """Messages of message set
+
+        :param message_set: e.g. b'1:500' or b'3,7'
+        :param uid: message set contains UIDs instead of sequence numbers
+        :return: list of tuples sequence number, message
+        """
+        last = len(self.messages)
+        if uid:
+            last = self.messages[-1][0] if self.messages else 0
+        numbers = set()
+        for part in message_set.decode().split(','):
+            start, _, end = part.partition(':')
+            start = last if start == '*' else int(start)
+            end = start if not end else last if end == '*' else int(end)
+            numbers.update(range(min(start, end), max(start, end) + 1))
+        return [(seq, message) for seq, message in
+                enumerate(self.messages, 1)
+                if (message[0] if uid else seq) in numbers]
+
+
+class FakeImapServer(object):
+    """IMAP server on localhost. Options change behaviour of the following
+    connections:
+
+    uidplus, literalplus - advertise UIDPLUS and LITERAL+
+    login_capabilities - None to advertise the same capabilities before and
+        after LOGIN, 'CODE' or 'COMMAND' to advertise UIDPLUS and LITERAL+
+        only after LOGIN in its response code or in response to CAPABILITY
+    search - 'OK', 'BAD' to reject UID SEARCH or 'EMPTY' to find nothing
+        by SUBJECT, HEADER search still works
+    fail_append - reject APPEND with NO
+    greeting - False to leave connections without greeting, e.g. for
+        timeouts
+
+    Names of received commands are saved in `commands`, for literals of
+    commands True is saved in `literals` if it was sent without waiting for
+    continuation (LITERAL+)
+
+    """
+
+    def __init__(self, uidplus: bool = True, literalplus: bool = False,
+                 search: str = 'OK', fail_append: bool = False,
+                 greeting: bool = True, login_capabilities: str = None):
+        self.uidplus = uidplus
+        self.literalplus = literalplus
+        self.login_capabilities = login_capabilities
+        self.search = search
+        self.fail_append = fail_append
+        self.greeting = greeting
+        self.mailboxes = {}
+        self.commands = []
+        self.literals = []
+        self.port = None
+        self.__loop = asyncio.new_event_loop()
+        self.__server = None
+        self.__thread = None
+
+    def add_user(self, username: str, password: str) -> FakeMailbox:
+        """Creates user with empty #Scalix/Oddpost folder
+
+        :param username: str
+        :param password: str
+        :return: FakeMailbox
+        """
+        self.mailboxes[username] = FakeMailbox(password)
+        return self.mailboxes[username]
+
+    def capabilities(self, authenticated: bool = True) -> str:
+        """Advertised capabilities
+
+        :param authenticated: client is logged in
+        :return: str
+        """
+        capabilities = ['IMAP4rev1']
+        if self.login_capabilities and not authenticated:
+            return ' '.join(capabilities)
+        if self.uidplus:
+            capabilities.append('UIDPLUS')
+        if self.literalplus:
+            capabilities.append('LITERAL+')
+        return ' '.join(capabilities)
+
+    def start(self) -> int:
+        """Starts server in background thread
+
+        :return: port
+        """
+        self.__server = self.__loop.run_until_complete(
+            asyncio.start_server(self.handle, '127.0.0.1', 0)
+        )
+        self.port = self.__server.sockets[0].getsockname()[1]
+        self.__thread = threading.Thread(target=self.__loop.run_forever,
+                                         daemon=True)
+        self.__thread.start()
+        return self.port
+
+    def stop(self):
+        """Stops server and its thread
+
+        :return:
+        """
+        self.__loop.call_soon_threadsafe(self.__loop.stop)
+        self.__thread.join()
+        self.__server.close()
+        self.__loop.run_until_complete(self.__server.wait_closed())
+        self.__loop.close()
+
+    async def handle(self, reader: asyncio.StreamReader,
+                     writer: asyncio.StreamWriter):
+        """Serves one connection
+
+        :param reader: asyncio.StreamReader
+        :param writer: asyncio.StreamWriter
+        :return:
+        """
+        if not self.greeting:
+            # waits until client closes connection
+            await reader.read()
+            writer.close()
+            return
+        session = FakeImapSession(self, writer)
+        session.send('* OK [CAPABILITY {}] fake server ready'.format(
+            self.capabilities(False)
+        ))
+        try:
+            while not writer.is_closing():
+                line = await reader.readline()
+                if not line.endswith(b'\n'):
+                    break
+                line = line.rstrip(b'\r\n')
+                literal = None
+                match = LITERAL_EXPR.search(line)
+                if match:
+                    self.literals.append(bool(match.group(2)))
+                    if not match.group(2):
+                        session.send('+ Ready for literal')
+                    literal = await reader.readexactly(int(match.group(1)))
+                    line = line[:match.start()].rstrip()
+                    if match.group(2) and not self.literalplus:
+                        # client did not wait for continuation
+                        literal = None
+                    line += await reader.readline()
+                    line = line.rstrip(b'\r\n')
+                session.execute(line, literal, bool(match))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+class FakeImapSession(object):
+    """State of one connection of FakeImapServer
+
+    """
+
+    def __init__(self, server: FakeImapServer, writer: asyncio.StreamWriter):
+        self.server = server
+        self.writer = writer
+        self.mailbox = None
+
+    def send(self, line: str, literal: bytes = None):
+        """Writes response line. Literal is written before the rest of line,
+        e.g. send('* 1 FETCH (RFC822 {} FLAGS ())', b'...')
+
+        :param line: str, '{}' is replaced by literal
+        :param literal: bytes or None
+        :return:
+        """
+        if literal is None:
+            self.writer.write(line.encode() + b'\r\n')
+            return
+        head, tail = line.split('{}', 1)
+        self.writer.write(head.encode() + '{{{}}}\r\n'.format(
+            len(literal)).encode() + literal + tail.encode() + b'\r\n')
+
+    def execute(self, line: bytes, literal: bytes, has_literal: bool):
+        """Runs command and sends its response
+
+        :param line: command line without literal
+        :param literal: literal of command or None
+        :param has_literal: command had literal, it is None if LITERAL+
+            was used but not advertised
+        :return:
+        """
+        tag, *args = ARGUMENT_EXPR.findall(line)
+        tag = tag.decode()
+        name = args.pop(0).decode().upper() if args else ''
+        uid = name == 'UID' and bool(args)
+        if uid:
+            name = 'UID ' + args.pop(0).decode().upper()
+        self.server.commands.append(name)
+        if has_literal and literal is None:
+            self.send('{} BAD LITERAL+ is not supported'.format(tag))
+            return
+        handler = getattr(self, 'do_' + name.replace(' ', '_'), None)
+        if handler is None or name not in ('CAPABILITY', 'LOGIN', 'LOGOUT') \
+                and self.mailbox is None:
+            self.send('{} BAD unknown command or not logged in'.format(tag))
+            return
+        status = handler(tag, [arg.strip(b'"') for arg in args], literal)
+        self.send('{} {}'.format(tag, status or 'OK completed'))
+        if name == 'LOGOUT':
+            self.writer.close()
+
+    def do_CAPABILITY(self, tag, args, literal):
+        self.send('* CAPABILITY ' + self.server.capabilities(
+            self.mailbox is not None
+        ))
+
+    def do_LOGIN(self, tag, args, literal):
+        mailbox = self.server.mailboxes.get(args[0].decode())
+        if mailbox is None or mailbox.password != args[1].decode():
+            return 'NO [AUTHENTICATIONFAILED] invalid credentials'
+        self.mailbox = mailbox
+        if self.server.login_capabilities == 'CODE':
+            return 'OK [CAPABILITY {}] LOGIN completed'.format(
+                self.server.capabilities()
+            )
+
+    def do_LOGOUT(self, tag, args, literal):
+        self.send('* BYE logging out')
+
+    def do_SELECT(self, tag, args, literal):
+        if args[0].decode() != FOLDER:
+            return 'NO no such folder'
+        self.send('* {} EXISTS'.format(len(self.mailbox.messages)))
+        self.send('* 0 RECENT')
+        self.send('* OK [UIDVALIDITY {}] UIDs valid'.format(
+            self.mailbox.uidvalidity
+        ))
+        self.send('* OK [UIDNEXT {}] predicted next UID'.format(
+            self.mailbox.uidnext
+        ))
+        return 'OK [READ-WRITE] SELECT completed'
+
+    def do_FETCH(self, tag, args, literal, uid=False):
+        items = args[1].upper()
+        for seq, (uid_, flags, data) in self.mailbox.select(args[0], uid):
+            flags = ' '.join(sorted(flags))
+            if b'ENVELOPE' in items:
+                subject = HEADER_EXPR.search(data)
+                self.send('* {} FETCH (UID {} ENVELOPE (NIL "{}" NIL NIL NIL '
+                          'NIL NIL NIL NIL NIL) FLAGS ({}))'.format(
+                              seq, uid_,
+                              subject.group(1).decode() if subject else '',
+                              flags))
+            else:
+                self.send('* {} FETCH (UID {} FLAGS ({}) RFC822 {{}})'.format(
+                    seq, uid_, flags), data)
+
+    def do_UID_FETCH(self, tag, args, literal):
+        self.do_FETCH(tag, args, literal, True)
+
+    def do_UID_STORE(self, tag, args, literal):
+        flags = set(args[2].strip(b'()').decode().split())
+        operation = args[1].decode().upper()
+        for seq, message in self.mailbox.select(args[0], True):
+            if operation.startswith('+'):
+                message[1] |= flags
+            elif operation.startswith('-'):
+                message[1] -= flags
+            else:
+                message[1] = flags
+            if not operation.endswith('.SILENT'):
+                self.send('* {} FETCH (UID {} FLAGS ({}))'.format(
+                    seq, message[0], ' '.join(sorted(message[1]))
+                ))
+
+    def do_UID_SEARCH(self, tag, args, literal):
+        if self.server.search == 'BAD':
+            return 'BAD SEARCH is not supported'
+        if b'HEADER' in args:
+            index = args.index(b'HEADER')
+            header = re.compile(re.escape(args[index + 1]) + rb':[^\n]*' +
+                                re.escape(args[index + 2]), re.M | re.I)
+        elif self.server.search != 'EMPTY':
+            header = re.compile(rb'^Subject:[^\n]*' + re.escape(
+                args[args.index(b'SUBJECT') + 1]
+            ), re.M | re.I)
+        else:
+            header = None
+        uids = [uid for uid, flags, data in self.mailbox.messages
+                if header and '\\Deleted' not in flags and
+                header.search(BODY_EXPR.split(data, 1)[0])]
+        self.send('* SEARCH' + ''.join(' {}'.format(uid) for uid in uids))
+
+    def do_APPEND(self, tag, args, literal):
+        if self.server.fail_append:
+            return 'NO [OVERQUOTA] quota exceeded'
+        flags = args[1].strip(b'()').decode().split()
+        uid = self.mailbox.add(literal, flags)
+        self.send('* {} EXISTS'.format(len(self.mailbox.messages)))
+        if self.server.uidplus:
+            return 'OK [APPENDUID {} {}] APPEND completed'.format(
+                self.mailbox.uidvalidity, uid
+            )
+
+    def expunge(self, uids: set = None):
+        """Removes deleted messages
+
+        :param uids: set of UIDs or None for all deleted messages
+        :return:
+        """
+        messages = self.mailbox.messages
+        seq = 0
+        while seq < len(messages):
+            uid, flags, _ = messages[seq]
+            if '\\Deleted' in flags and (uids is None or uid in uids):
+                del messages[seq]
+                self.send('* {} EXPUNGE'.format(seq + 1))
+            else:
+                seq += 1
+
+    def do_EXPUNGE(self, tag, args, literal):
+        self.expunge()
+
+    def do_UID_EXPUNGE(self, tag, args, literal):
+        if not self.server.uidplus:
+            return 'BAD UIDPLUS is not supported'
+        self.expunge(set(message[0] for _, message in
+                         self.mailbox.select(args[0], True)))
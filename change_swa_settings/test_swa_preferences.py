@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+"""Tests of both engines against FakeImapServer. Run with
+python3 -m unittest test_swa_preferences
+
+"""
+
+import argparse
+import asyncio
+import imaplib
+import os
+import tempfile
+import unittest
+
+import async_swa_preferences
+import change_swa_preferences
+from change_swa_preferences import PreferenceEmail, PreferenceUidCache
+from fake_imap_server import FakeImapServer
+
+
+def preference_message(locale: str = 'en_US') -> bytes:
+    """Preference email with locale option
+
+    :param locale: str
+    :return: bytes
+    """
+    email = change_swa_preferences.create_preference_message()
+    change_swa_preferences.find_option_and_change(email.preferences,
+                                                  'locale', locale)
+    return email.as_bytes()
+
+
+def locale_option(data: bytes) -> str:
+    """Locale option of preference email
+
+    :param data: message bytes
+    :return: str
+    """
+    return PreferenceEmail.from_bytes(0, data).preferences.find(
+        './/preference[@name="locale"]'
+    ).text
+
+
+class SyncEngineTest(unittest.TestCase):
+    """Preference changes by imaplib engine
+
+    """
+
+    def setUp(self):
+        self.server = FakeImapServer()
+        self.mailbox = self.server.add_user('user', 'secret')
+        self.conn_data = argparse.Namespace(
+            host='127.0.0.1', port=self.server.start(), use_ssl=False,
+            username='user', password='secret'
+        )
+
+    def tearDown(self):
+        self.server.stop()
+
+    def change(self, swa_options: dict, cache: PreferenceUidCache = None):
+        change_swa_preferences.change_user_swa_settings(
+            self.conn_data, swa_options, retries=0, cache=cache
+        )
+
+    def add_messages(self, count: int = 3):
+        for number in range(count):
+            self.mailbox.add('Subject: mail {}\r\n\r\nhello\r\n'.format(
+                number
+            ).encode())
+
+    def preferences(self) -> list:
+        """Locale options of preference emails in mailbox
+
+        :return: list of tuples UID, locale, deleted
+        """
+        return [(uid, locale_option(data), '\\Deleted' in flags)
+                for uid, flags, data in self.mailbox.messages
+                if b'[prefs(v2.1) data]' in data]
+
+    def test_create_in_empty_folder(self):
+        self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(1, 'fr_FR', False)])
+
+    def test_change_found_by_search(self):
+        self.add_messages()
+        self.mailbox.add(preference_message())
+        self.add_messages()
+        self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(8, 'fr_FR', False)])
+        self.assertEqual(len(self.mailbox.messages), 7)
+        for command in ('SELECT', 'UID SEARCH', 'UID FETCH', 'UID STORE',
+                        'APPEND', 'UID EXPUNGE'):
+            self.assertIn(command, self.server.commands)
+        self.assertNotIn('FETCH', self.server.commands)
+
+    def test_search_bad(self):
+        self.server.search = 'BAD'
+        self.add_messages()
+        self.mailbox.add(preference_message())
+        with self.assertWarns(RuntimeWarning):
+            self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(5, 'fr_FR', False)])
+        self.assertIn('FETCH', self.server.commands)
+
+    def test_search_empty(self):
+        self.server.search = 'EMPTY'
+        self.mailbox.add(preference_message())
+        self.add_messages()
+        self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(5, 'fr_FR', False)])
+        self.assertEqual(self.server.commands.count('UID SEARCH'), 2)
+        self.assertIn('FETCH', self.server.commands)
+
+    def test_search_without_preferences(self):
+        self.add_messages()
+        self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(4, 'fr_FR', False)])
+        self.assertEqual(self.server.commands.count('UID SEARCH'), 2)
+        self.assertNotIn('FETCH', self.server.commands)
+
+    def test_orphans_uid_expunge(self):
+        self.mailbox.add(preference_message('de_DE'))
+        self.mailbox.add(preference_message('es_ES'))
+        self.mailbox.add(b'Subject: draft\r\n\r\nhello\r\n',
+                         ('\\Deleted', ))
+        self.change({'dateSeparatorChar': '.'})
+        self.assertEqual(self.preferences(), [(4, 'de_DE', False)])
+        self.assertEqual([uid for uid, _, _ in self.mailbox.messages],
+                         [3, 4])
+        self.assertNotIn('EXPUNGE', self.server.commands)
+
+    def test_orphans_expunge_without_uidplus(self):
+        self.server.uidplus = False
+        self.mailbox.add(preference_message('de_DE'))
+        self.mailbox.add(preference_message('es_ES'))
+        self.mailbox.add(b'Subject: draft\r\n\r\nhello\r\n',
+                         ('\\Deleted', ))
+        self.change({'dateSeparatorChar': '.'})
+        self.assertEqual(self.preferences(), [(4, 'de_DE', False)])
+        self.assertEqual([uid for uid, _, _ in self.mailbox.messages], [4])
+        self.assertIn('EXPUNGE', self.server.commands)
+        self.assertNotIn('UID EXPUNGE', self.server.commands)
+
+    def test_append_literal(self):
+        self.mailbox.add(preference_message())
+        self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(2, 'fr_FR', False)])
+        self.assertEqual(self.server.literals, [False])
+
+    def test_append_literal_plus(self):
+        self.server.literalplus = True
+        self.mailbox.add(preference_message())
+        self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(2, 'fr_FR', False)])
+        self.assertEqual(self.server.literals, [True])
+
+    def check_capabilities_after_login(self, mode: str):
+        self.server.login_capabilities = mode
+        self.server.literalplus = True
+        self.mailbox.add(preference_message('de_DE'))
+        self.mailbox.add(preference_message('es_ES'))
+        self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(3, 'fr_FR', False)])
+        self.assertEqual(self.server.literals, [True])
+        self.assertIn('UID EXPUNGE', self.server.commands)
+        self.assertNotIn('EXPUNGE', self.server.commands)
+
+    def test_capabilities_in_login_response(self):
+        self.check_capabilities_after_login('CODE')
+
+    def test_capabilities_after_login(self):
+        self.check_capabilities_after_login('COMMAND')
+
+    def test_append_failure_rollback(self):
+        self.server.fail_append = True
+        self.mailbox.add(preference_message())
+        with self.assertRaises(Exception):
+            self.change({'locale': 'fr_FR'})
+        self.assertEqual(self.preferences(), [(1, 'en_US', False)])
+
+    def test_timeout(self):
+        self.server.greeting = False
+        self.conn_data.timeout = 0.2
+        with self.assertRaises((OSError, asyncio.TimeoutError)):
+            self.change({'locale': 'fr_FR'})
+
+    def test_cache(self):
+        self.mailbox.add(preference_message())
+        self.add_messages()
+        with tempfile.TemporaryDirectory() as directory:
+            cache = PreferenceUidCache(os.path.join(directory, 'cache.db'))
+            try:
+                self.change({'locale': 'fr_FR'}, cache)
+                del self.server.commands[:]
+                self.change({'locale': 'de_DE'}, cache)
+                self.assertEqual(cache.get('127.0.0.1', 'user')[1], 6)
+            finally:
+                cache.close()
+        self.assertEqual(self.preferences(), [(6, 'de_DE', False)])
+        self.assertNotIn('UID SEARCH', self.server.commands)
+
+
+class PublicImaplibConnection(object):
+    """imaplib connection without private API
+
+    """
+
+    def __init__(self, conn: imaplib.IMAP4):
+        self.conn = conn
+
+    def __getattr__(self, name: str):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.conn, name)
+
+
+class PipelineTest(unittest.TestCase):
+    """pipeline_imap_commands without private imaplib API
+
+    """
+
+    def setUp(self):
+        self.server = FakeImapServer()
+        self.mailbox = self.server.add_user('user', 'secret')
+        self.mailbox.add(preference_message())
+        self.conn = change_swa_preferences.create_imap_connection(
+            argparse.Namespace(host='127.0.0.1', port=self.server.start(),
+                               use_ssl=False, username='user',
+                               password='secret')
+        )
+
+    def tearDown(self):
+        self.conn.logout()
+        self.server.stop()
+
+    def test_sequential_commands(self):
+        self.conn.select('#Scalix/Oddpost')
+        results = change_swa_preferences.pipeline_imap_commands(
+            PublicImaplibConnection(self.conn),
+            ('UID', 'STORE', '1', '+FLAGS.SILENT', '(\\Deleted)'),
+            ('APPEND', '#Scalix/Oddpost', '(\\Seen)',
+             imaplib.Time2Internaldate(0), preference_message('fr_FR'))
+        )
+        self.assertEqual([status for status, _ in results], ['OK', 'OK'])
+        self.assertEqual([(uid, locale_option(data), '\\Deleted' in flags)
+                          for uid, flags, data in self.mailbox.messages],
+                         [(1, 'en_US', True), (2, 'fr_FR', False)])
+
+
+class AsyncEngineTest(SyncEngineTest):
+    """Preference changes by asyncio engine
+
+    """
+
+    def change(self, swa_options: dict, cache: PreferenceUidCache = None):
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                async_swa_preferences.async_change_user_swa_settings(
+                    self.conn_data, swa_options, retries=0, cache=cache
+                )
+            )
+        finally:
+            loop.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
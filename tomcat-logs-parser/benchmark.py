@@ -0,0 +1,301 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Benchmark of parse_tomcat_logs.py modes on generated tomcat logs
+
+Logs are generated from fixed seed, so results of different runs (and
+different versions of parser) can be compared. Each mode is executed in
+separate process to measure its peak RSS.
+
+"""
+from __future__ import unicode_literals, with_statement, print_function
+import argparse
+import calendar
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import parse_tomcat_logs
+
+LEVELS = (b'ERROR', b'WARN', b'FATAL', b'DEBUG')
+
+PACKAGES = (b'com.scalix.api', b'com.scalix.caa', b'com.scalix.swa',
+            b'com.scalix.wireless', b'com.scalix.platform')
+
+EXCEPTIONS = (b'java.lang.NullPointerException',
+              b'java.lang.IllegalStateException',
+              b'java.io.IOException',
+              b'javax.mail.MessagingException',
+              b'com.scalix.api.MapiException')
+
+# name -> (description, parse_files arguments or None for special mode).
+# jobs=None is replaced with --jobs value
+MODES = {
+    'serial': ('serial grouping', {}),
+    'parallel': ('process pool, one file per worker',
+                 {'jobs': None, 'chunk_size': 0}),
+    'chunked': ('process pool, files split into 8MB ranges',
+                {'jobs': None, 'chunk_size': 8 * 1024 * 1024}),
+    'stream': ('streaming output', {'stream': True}),
+    'dedup': ('unique log entries', {'dedup': True}),
+    'archive': ('one archive file per log file', {'archive': True}),
+    'incremental': ('incremental mode, first run', {'incremental': True}),
+    'index': ('SQLite index', None),
+    'summary': ('counters by caller, level and minute', None),
+}
+
+
+def generate_log(filename, size, error_ratio=0.3, depth=20, callers=50,
+                 ignored_ratio=0.5, seed=0):
+    """Generates tomcat log file similar to scalix-api.log
+
+    :param filename: AnyStr
+    :param size: approximate file size in bytes
+    :param error_ratio: part of log entries with stack trace
+    :param depth: max number of stack frames
+    :param callers: number of distinct callers
+    :param ignored_ratio: part of INFO log entries
+    :param seed: random seed, the same seed gives the same file
+    :return: number of lines
+    """
+    rnd = random.Random(seed)
+    caller_names = [
+        '{0}{1}.{2}'.format(rnd.choice(('Mapi', 'Sync', 'Auth', 'Folder',
+                                        'Message', 'Http', 'Contacts')),
+                            rnd.choice(('Factory', 'Service', 'Handler',
+                                        'Interceptor', 'Formatter')) +
+                            str(index),
+                            rnd.choice(('create', 'run', 'intercept',
+                                        'parse', 'format'))).encode()
+        for index in range(callers)
+    ]
+    timestamp = calendar.timegm((2016, 4, 12, 0, 0, 0))
+    written = 0
+    lines = 0
+    with open(filename, 'wb') as log_fd:
+        while written < size:
+            timestamp += rnd.random()
+            level = b'INFO' if rnd.random() < ignored_ratio else \
+                rnd.choice(LEVELS)
+            entry = [
+                '{0}.{1:03d} [{2}] [http-8080-{3}] [{4}:{5}] Request {6} '
+                'failed for user{7}@scalix.com\n'.format(
+                    time.strftime('%Y-%m-%d %H:%M:%S',
+                                  time.gmtime(timestamp)),
+                    rnd.randint(0, 999), level.decode(), rnd.randint(1, 50),
+                    rnd.choice(caller_names).decode(), rnd.randint(1, 2000),
+                    rnd.randint(1, 10 ** 6), rnd.randint(1, 5000)
+                ).encode()
+            ]
+            if rnd.random() < error_ratio:
+                entry.append(rnd.choice(EXCEPTIONS) + b': id ' +
+                             str(rnd.randint(1, 10 ** 6)).encode() + b'\n')
+                for frame in range(rnd.randint(1, depth)):
+                    entry.append(
+                        b'\tat ' + rnd.choice(PACKAGES) +
+                        '.Class{0}.method{1}(Class{0}.java:{2})\n'.format(
+                            frame, rnd.randint(0, 3), rnd.randint(1, 900)
+                        ).encode()
+                    )
+            for line in entry:
+                written += len(line)
+            lines += len(entry)
+            log_fd.writelines(entry)
+    return lines
+
+
+def generate_logs(directory, files, size, seed=0, **kwargs):
+    """Generates `files` log files in directory
+
+    :param directory: AnyStr
+    :param files: number of files
+    :param size: size of each file in bytes
+    :param seed: random seed
+    :param kwargs: see `generate_log`
+    :return: number of lines
+    """
+    return sum(
+        generate_log(os.path.join(directory, 'scalix-{0}.log'.format(index)),
+                     size, seed=seed + index, **kwargs)
+        for index in range(files)
+    )
+
+
+def directory_size(path):
+    """Total size of files in directory
+
+    :param path: AnyStr
+    :return: int
+    """
+    return sum(os.path.getsize(os.path.join(root, name))
+               for root, _, names in os.walk(path) for name in names)
+
+
+def peak_rss():
+    """Peak RSS of this process and of the biggest child process in KB
+
+    :return: tuple
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+
+
+def run_mode(mode, log_dir, output_dir, jobs=2):
+    """Runs mode of parser in this process. Results are written to output_dir
+
+    :param mode: key of MODES
+    :param log_dir: AnyStr
+    :param output_dir: AnyStr
+    :param jobs: number of worker processes for parallel modes
+    :return: dict with seconds, peak RSS in KB and output size in bytes
+    """
+    parse_tomcat_logs.CURRENT_DIR = output_dir.encode()
+    parse_tomcat_logs.STATE_FILE = os.path.join(
+        output_dir, '.parse_tomcat_logs.state'
+    ).encode()
+    devnull = open(os.devnull, 'w')
+    stdout, sys.stdout = sys.stdout, devnull
+    try:
+        start = time.time()
+        kwargs = MODES[mode][1]
+        if kwargs and 'jobs' in kwargs:
+            kwargs = dict(kwargs, jobs=jobs)
+        if mode == 'index':
+            parse_tomcat_logs.update_index(
+                os.path.join(output_dir, 'index.db'), log_dir
+            )
+        elif mode == 'summary':
+            parse_tomcat_logs.summarize_dirs(
+                os.path.join(output_dir, 'summary.json'), log_dir
+            )
+        else:
+            parse_tomcat_logs.parse_files(log_dir, **kwargs)
+        seconds = time.time() - start
+    finally:
+        sys.stdout = stdout
+        devnull.close()
+    rss, children_rss = peak_rss()
+    return {'seconds': seconds, 'peak_rss_kb': rss,
+            'workers_peak_rss_kb': children_rss,
+            'output_bytes': directory_size(output_dir)}
+
+
+def benchmark(modes, log_dir, lines, repeat=1, jobs=2):
+    """Runs each mode in separate process `repeat` times and keeps the
+    fastest run
+
+    :param modes: list of MODES keys
+    :param log_dir: AnyStr
+    :param lines: number of lines in log files
+    :param repeat: int
+    :param jobs: number of worker processes for parallel modes
+    :return: list of dicts
+    """
+    size = directory_size(log_dir)
+    results = []
+    for mode in modes:
+        best = None
+        for _ in range(repeat):
+            output_dir = tempfile.mkdtemp(prefix='parse_tomcat_logs_')
+            try:
+                data = subprocess.check_output(
+                    [sys.executable, os.path.abspath(__file__), '--run', mode,
+                     '--log-dir', log_dir, '--output-dir', output_dir,
+                     '--jobs', str(jobs)]
+                )
+            finally:
+                shutil.rmtree(output_dir)
+            result = json.loads(data.decode())
+            if best is None or result['seconds'] < best['seconds']:
+                best = result
+        best.update(mode=mode, jobs=jobs, input_bytes=size, lines=lines,
+                    lines_per_sec=lines / best['seconds'],
+                    mb_per_sec=size / best['seconds'] / 1024 / 1024)
+        results.append(best)
+    return results
+
+
+def print_results(results):
+    """Prints results table
+
+    :param results: list of dicts
+    :return:
+    """
+    row = '{0:<12} {1:>9} {2:>12} {3:>9} {4:>10} {5:>12} {6:>13}'
+    print(row.format('Mode', 'Seconds', 'Lines/sec', 'MB/sec', 'RSS MB',
+                     'Workers MB', 'Output MB'))
+    for result in results:
+        print(row.format(
+            result['mode'], '{0:.2f}'.format(result['seconds']),
+            '{0:.0f}'.format(result['lines_per_sec']),
+            '{0:.1f}'.format(result['mb_per_sec']),
+            '{0:.1f}'.format(result['peak_rss_kb'] / 1024.0),
+            '{0:.1f}'.format(result['workers_peak_rss_kb'] / 1024.0),
+            '{0:.1f}'.format(result['output_bytes'] / 1024.0 / 1024)
+        ))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('--modes', nargs='*', default=sorted(MODES),
+                        choices=sorted(MODES), help='Modes to benchmark')
+    parser.add_argument('--files', type=int, default=4,
+                        help='Number of generated log files')
+    parser.add_argument('--size', type=int, default=64,
+                        help='Size of each generated log file in MB')
+    parser.add_argument('--error-ratio', type=float, default=0.3,
+                        help='Part of log entries with stack trace')
+    parser.add_argument('--depth', type=int, default=20,
+                        help='Max number of stack frames')
+    parser.add_argument('--callers', type=int, default=50,
+                        help='Number of distinct callers')
+    parser.add_argument('--ignored-ratio', type=float, default=0.5,
+                        help='Part of ignored INFO log entries')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Random seed of generated logs')
+    parser.add_argument('--repeat', type=int, default=1,
+                        help='Run each mode N times and keep the fastest run')
+    parser.add_argument('--jobs', type=int,
+                        default=max(multiprocessing.cpu_count(), 2),
+                        help='Number of worker processes for parallel modes')
+    parser.add_argument('--json', metavar='FILENAME',
+                        help='Save results with generator settings as json '
+                             'to compare them later')
+    parser.add_argument('--run', choices=sorted(MODES), help=argparse.SUPPRESS)
+    parser.add_argument('--log-dir', help=argparse.SUPPRESS)
+    parser.add_argument('--output-dir', help=argparse.SUPPRESS)
+    cmd_args = parser.parse_args()
+
+    if cmd_args.run:
+        print(json.dumps(run_mode(cmd_args.run, cmd_args.log_dir,
+                                  cmd_args.output_dir, cmd_args.jobs)))
+        sys.exit(0)
+
+    settings = dict((key, getattr(cmd_args, key)) for key in (
+        'files', 'size', 'error_ratio', 'depth', 'callers', 'ignored_ratio',
+        'seed'
+    ))
+    logs_dir = tempfile.mkdtemp(prefix='tomcat_logs_')
+    try:
+        print('Generating logs in', logs_dir, '...')
+        total_lines = generate_logs(
+            logs_dir, cmd_args.files, cmd_args.size * 1024 * 1024,
+            seed=cmd_args.seed, error_ratio=cmd_args.error_ratio,
+            depth=cmd_args.depth, callers=cmd_args.callers,
+            ignored_ratio=cmd_args.ignored_ratio
+        )
+        bench_results = benchmark(cmd_args.modes, logs_dir, total_lines,
+                                  cmd_args.repeat, cmd_args.jobs)
+    finally:
+        shutil.rmtree(logs_dir)
+    print_results(bench_results)
+    if cmd_args.json:
+        with open(cmd_args.json, 'w') as json_fd:
+            json.dump({'settings': settings, 'results': bench_results},
+                      json_fd, indent=1)
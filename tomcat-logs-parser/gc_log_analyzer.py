@@ -0,0 +1,649 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Module to analyze HotSpot GC logs of tomcat JVM: pause time distribution,
+allocation rate, promotion rate and time spent in GC pauses by time interval.
+JDK 8 -XX:+PrintGCDetails (with or without -XX:+PrintGCDateStamps) and JDK 9+
+unified logging (-Xlog:gc*) formats are supported. Pause spikes can be
+correlated with error bursts found by parse_tomcat_logs.py in the same time
+interval
+
+"""
+from __future__ import unicode_literals, with_statement, print_function
+import argparse
+import csv
+import glob
+import itertools
+import json
+import math
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+
+from parse_tomcat_logs import open_log, parse_time, summarize_dirs
+from tomcat_access_log import QUANTILES, LatencySketch
+
+# GC log files, e.g. gc.log, gc.log.0.current, tomcat-gc.log.1.gz
+GC_LOG_PATTERNS = ('*gc*.log*', )
+
+SIZE_UNITS = {b'B': 1, b'K': 1024, b'M': 1024 ** 2, b'G': 1024 ** 3}
+
+SIZE = r'([\d.]+)([BKMG])'
+
+# JDK 8: 2016-04-12T10:00:01.123+0200: 12.345: [GC (Allocation Failure) ...
+JDK8_EXPR = re.compile(
+    r'(?:(?P<datetime>\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})[.,]\d+[-+]\d{4}: )?'
+    r'(?P<uptime>\d+[.,]\d+): \[(?P<name>Full GC|GC)(?P<rest>.*)'.encode()
+)
+# generation sizes, e.g. [PSYoungGen: 524800K->43690K(611840K)]
+JDK8_GEN_EXPR = re.compile(
+    (r'\[(?P<gen>[A-Za-z][\w ]*?): ' + SIZE + '->' + SIZE + r'\(' + SIZE +
+     r'\)(?:, [\d.]+ secs)?\]').encode()
+)
+JDK8_HEAP_EXPR = re.compile((SIZE + '->' + SIZE + r'\(' + SIZE +
+                             r'\)').encode())
+JDK8_PAUSE_EXPR = re.compile(r', (\d+[.,]\d+) secs\]'.encode())
+# G1 details: [Eden: 24.0M(24.0M)->0.0B(13.0M) Survivors: 0.0B->3072.0K
+# Heap: 24.0M(256.0M)->8.5M(256.0M)]
+JDK8_G1_EXPR = re.compile(
+    (r'\[Eden: ' + SIZE + r'\([\d.]+[BKMG]\)->' + SIZE +
+     r'\([\d.]+[BKMG]\) Survivors: ' + SIZE + '->' + SIZE + r' Heap: ' +
+     SIZE + r'\([\d.]+[BKMG]\)->' + SIZE + r'\(' + SIZE + r'\)\]').encode()
+)
+
+# JDK 9+: [2016-04-12T10:00:01.123+0200][12.345s][info][gc] GC(3) ...
+UNIFIED_DECORATIONS_EXPR = re.compile(r'^(?:\[[^\]]*\])+'.encode())
+UNIFIED_DATETIME_EXPR = re.compile(
+    r'\[(\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2})[.,]\d+[-+]\d{4}\]'.encode()
+)
+UNIFIED_UPTIME_EXPR = re.compile(r'\[(\d+[.,]\d+)s\]'.encode())
+UNIFIED_PAUSE_EXPR = re.compile(
+    (r'^GC\((\d+)\) Pause (.*?)(?: ' + SIZE + '->' + SIZE + r'\(' + SIZE +
+     r'\))? (\d+[.,]\d+)ms$').encode()
+)
+UNIFIED_REGIONS_EXPR = re.compile(
+    r'^GC\((\d+)\) (Eden|Survivor|Old) regions: (\d+)->(\d+)'.encode()
+)
+UNIFIED_GEN_EXPR = re.compile(
+    (r'^GC\((\d+)\) (\w+): ' + SIZE + r'(?:\([\d.]+[BKMG]\))?->' +
+     SIZE).encode()
+)
+REGION_SIZE_EXPR = re.compile(
+    (r'Heap [Rr]egion [Ss]ize: ' + SIZE).encode()
+)
+
+YOUNG_GENS = frozenset((b'PSYoungGen', b'DefNew', b'ParNew', b'ASParNew'))
+OLD_GENS = frozenset((b'ParOldGen', b'PSOldGen', b'Tenured', b'CMS',
+                      b'ASCMS'))
+
+# max number of GC ids with heap details waiting for their pause line
+MAX_PENDING_DETAILS = 1024
+
+
+def size_bytes(value, unit):
+    """Converts GC log size to bytes
+
+    :param value: bytes, e.g. b'24.0'
+    :param unit: bytes, one of SIZE_UNITS
+    :return: int
+    """
+    return int(float(value) * SIZE_UNITS[unit])
+
+
+class GcEvent(object):
+    """GC pause with heap occupancy before and after it in bytes. Unknown
+    values are None
+
+    """
+    __slots__ = ('datetime', 'uptime', 'kind', 'pause', 'heap_before',
+                 'heap_after', 'heap_size', 'young_before', 'young_after',
+                 'old_before', 'old_after')
+
+    def __init__(self, datetime, uptime, kind, pause=None):
+        self.datetime = datetime
+        self.uptime = uptime
+        self.kind = kind
+        self.pause = pause
+        self.heap_before = self.heap_after = self.heap_size = None
+        self.young_before = self.young_after = None
+        self.old_before = self.old_after = None
+
+    def set_heap(self, values):
+        """Sets heap occupancy from 6 regular expression groups
+
+        :param values: tuple
+        :return:
+        """
+        self.heap_before = size_bytes(*values[0:2])
+        self.heap_after = size_bytes(*values[2:4])
+        self.heap_size = size_bytes(*values[4:6])
+
+    @property
+    def promoted(self):
+        """Bytes promoted to old generation by young or mixed pause
+
+        :return: int or None
+        """
+        if self.kind not in ('young', 'mixed'):
+            return None
+        if self.old_before is not None:
+            return max(self.old_after - self.old_before, 0)
+        if self.young_before is not None and self.heap_before is not None:
+            return max(self.young_before - self.young_after -
+                       (self.heap_before - self.heap_after), 0)
+        return None
+
+
+def pause_kind(name, default='other'):
+    """Kind of GC pause: young, mixed, full or other (remark, cleanup etc.)
+
+    :param name: bytes, pause description
+    :param default: kind of pause without known keywords
+    :return: str
+    """
+    name = name.lower()
+    for keyword, kind in ((b'full', 'full'), (b'mixed', 'mixed'),
+                          (b'young', 'young'), (b'remark', 'other'),
+                          (b'cleanup', 'other'), (b'mark', 'other')):
+        if keyword in name:
+            return kind
+    return default
+
+
+def jdk8_events(lines):
+    """GC pauses of JDK 8 GC log. G1 pauses logged with -XX:+PrintGCDetails
+    are completed by the following [Eden: ...] line
+
+    :param lines: iterable of bytes
+    :return: generator of GcEvent
+    """
+    pending = None
+    for line in lines:
+        match = JDK8_EXPR.search(line)
+        if match:
+            if pending:
+                yield pending
+                pending = None
+            rest = match.group('rest')
+            if rest.startswith(b' concurrent'):
+                continue
+            datetime = match.group('datetime')
+            event = GcEvent(datetime.replace(b'T', b' ') if datetime else None,
+                            float(match.group('uptime').replace(b',', b'.')),
+                            'full' if match.group('name') == b'Full GC'
+                            else pause_kind(rest, 'young'))
+            pauses = JDK8_PAUSE_EXPR.findall(rest)
+            if pauses:
+                event.pause = float(pauses[-1].replace(b',', b'.')) * 1000
+            for gen in JDK8_GEN_EXPR.finditer(rest):
+                name = gen.group('gen')
+                if name in YOUNG_GENS:
+                    event.young_before = size_bytes(*gen.group(2, 3))
+                    event.young_after = size_bytes(*gen.group(4, 5))
+                elif name in OLD_GENS:
+                    event.old_before = size_bytes(*gen.group(2, 3))
+                    event.old_after = size_bytes(*gen.group(4, 5))
+            heap = JDK8_HEAP_EXPR.search(JDK8_GEN_EXPR.sub(b'', rest))
+            if heap:
+                event.set_heap(heap.groups())
+                yield event
+            else:
+                pending = event
+            continue
+        if pending and b'[Eden: ' in line:
+            match = JDK8_G1_EXPR.search(line)
+            if match:
+                values = match.groups()
+                pending.young_before = (size_bytes(*values[0:2]) +
+                                        size_bytes(*values[4:6]))
+                pending.young_after = (size_bytes(*values[2:4]) +
+                                       size_bytes(*values[6:8]))
+                pending.set_heap(values[8:14])
+            yield pending
+            pending = None
+    if pending:
+        yield pending
+
+
+def unified_events(lines):
+    """GC pauses of JDK 9+ unified GC log. Generation sizes and G1 regions
+    logged by gc+heap before the pause line are added to the pause
+
+    :param lines: iterable of bytes
+    :return: generator of GcEvent
+    """
+    region_size = None
+    details = {}
+    for line in lines:
+        decorations = UNIFIED_DECORATIONS_EXPR.match(line)
+        if not decorations:
+            continue
+        message = line[decorations.end():].strip()
+        if not message.startswith(b'GC('):
+            match = region_size is None and REGION_SIZE_EXPR.search(message)
+            if match:
+                region_size = size_bytes(*match.groups())
+            continue
+        match = UNIFIED_PAUSE_EXPR.match(message)
+        if not match:
+            match = UNIFIED_REGIONS_EXPR.match(message) or \
+                UNIFIED_GEN_EXPR.match(message)
+            if not match:
+                continue
+            if len(details) >= MAX_PENDING_DETAILS:
+                details.clear()
+            gc_details = details.setdefault(match.group(1), {})
+            name = match.group(2)
+            if match.re is UNIFIED_REGIONS_EXPR:
+                if region_size:
+                    gc_details[name] = (int(match.group(3)) * region_size,
+                                        int(match.group(4)) * region_size)
+            elif name in YOUNG_GENS or name in OLD_GENS:
+                gc_details[name] = (size_bytes(*match.group(3, 4)),
+                                    size_bytes(*match.group(5, 6)))
+            continue
+        prefix = line[:decorations.end()]
+        datetime = UNIFIED_DATETIME_EXPR.search(prefix)
+        uptime = UNIFIED_UPTIME_EXPR.search(prefix)
+        values = match.groups()
+        event = GcEvent(
+            datetime.group(1).replace(b'T', b' ') if datetime else None,
+            float(uptime.group(1).replace(b',', b'.')) if uptime else None,
+            pause_kind(values[1]),
+            float(values[8].replace(b',', b'.'))
+        )
+        if values[2]:
+            event.set_heap(values[2:8])
+        gc_details = details.pop(values[0], {})
+        young = [gc_details[name] for name in (b'Eden', b'Survivor')
+                 if name in gc_details] or \
+            [gc_details[name] for name in YOUNG_GENS if name in gc_details]
+        if young:
+            event.young_before = sum(before for before, _ in young)
+            event.young_after = sum(after for _, after in young)
+        old = [gc_details[name] for name in (b'Old', ) + tuple(OLD_GENS)
+               if name in gc_details]
+        if old:
+            event.old_before, event.old_after = old[0]
+        yield event
+
+
+def gc_events(lines):
+    """GC pauses of JDK 8 or JDK 9+ GC log, format is detected by the first
+    line which is not empty
+
+    :param lines: iterable of bytes
+    :return: generator of GcEvent
+    """
+    lines = iter(lines)
+    first = []
+    for line in lines:
+        if line.strip():
+            first.append(line)
+            break
+    if not first:
+        return
+    parse = unified_events if first[0].startswith(b'[') else jdk8_events
+    for event in parse(itertools.chain(first, lines)):
+        yield event
+
+
+def interval_key(datetime, interval=1):
+    """Start of time interval of datetime
+
+    :param datetime: bytes 'YYYY-MM-DD HH:MM[:SS]' or uptime '+HHHH:MM:SS',
+        see `GcSummary.event_datetime`
+    :param interval: length of time interval in minutes
+    :return: bytes 'YYYY-MM-DD HH:MM' or '+HHHH:MM'
+    """
+    if datetime.startswith(b'+'):
+        hours, minutes = datetime[1:].split(b':')[:2]
+        minutes = int(hours) * 60 + int(minutes)
+        if interval > 1:
+            minutes = minutes // interval * interval
+        return '+{0:04d}:{1:02d}'.format(minutes // 60, minutes % 60).encode()
+    if interval <= 1:
+        return datetime[:16]
+    minutes = (int(datetime[11:13]) * 60 + int(datetime[14:16])) // \
+        interval * interval
+    return datetime[:11] + '{0:02d}:{1:02d}'.format(minutes // 60,
+                                                    minutes % 60).encode()
+
+
+class GcInterval(object):
+    """GC pauses, allocated and promoted bytes of time interval
+
+    """
+    __slots__ = ('pauses', 'full', 'allocated', 'promoted')
+
+    def __init__(self):
+        self.pauses = LatencySketch()
+        self.full = 0
+        self.allocated = 0
+        self.promoted = 0
+
+    def as_dict(self, seconds, errors=None):
+        """Statistics of time interval
+
+        :param seconds: length of time interval
+        :param errors: number of log entries found by parse_tomcat_logs.py
+            in time interval or None
+        :return: dict
+        """
+        pauses = self.pauses.as_dict()
+        res = {
+            'gcs': pauses['count'],
+            'full_gcs': self.full,
+            'pause_ms': round(self.pauses.total, 3),
+            'gc_time_pct': round(self.pauses.total / seconds / 10, 3),
+            'max_pause_ms': pauses['max'],
+            'allocation_mb_sec': round(self.allocated / seconds / 1024 ** 2,
+                                       3),
+            'promotion_mb_sec': round(self.promoted / seconds / 1024 ** 2, 3),
+        }
+        for name, _ in QUANTILES:
+            res['pause_{0}_ms'.format(name)] = pauses[name]
+        if errors is not None:
+            res['errors'] = errors
+        return res
+
+
+class GcSummary(object):
+    """GC statistics by time interval and pause time distribution of all
+    pauses
+
+    """
+    __slots__ = ('intervals', 'pauses', 'kinds', 'interval', 'start',
+                 'since', 'until')
+
+    def __init__(self, interval=1, start=None, since=None, until=None):
+        self.intervals = defaultdict(GcInterval)
+        self.pauses = LatencySketch()
+        self.kinds = defaultdict(int)
+        self.interval = max(interval, 1)
+        self.start = start
+        self.since = since
+        self.until = until
+
+    def event_datetime(self, event):
+        """Datetime of GC event. Uptime is converted to datetime if JVM
+        start time is known, otherwise it is returned as '+HHHH:MM:SS'
+
+        :param event: GcEvent
+        :return: bytes or None
+        """
+        if event.datetime:
+            return event.datetime
+        if event.uptime is None:
+            return None
+        if self.start is not None:
+            return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(
+                self.start + event.uptime)).encode()
+        uptime = int(event.uptime)
+        return '+{0:04d}:{1:02d}:{2:02d}'.format(
+            uptime // 3600, uptime // 60 % 60, uptime % 60).encode()
+
+    def add_events(self, events):
+        """Adds GC pauses of one GC log. Allocated bytes are heap occupancy
+        before pause minus heap occupancy after the previous pause
+
+        :param events: iterable of GcEvent
+        :return:
+        """
+        heap_after = None
+        for event in events:
+            datetime = self.event_datetime(event)
+            allocated = None
+            if heap_after is not None and event.heap_before is not None:
+                allocated = max(event.heap_before - heap_after, 0)
+            if event.heap_after is not None:
+                heap_after = event.heap_after
+            if datetime is None or self.since and datetime < self.since or \
+                    self.until and datetime >= self.until:
+                continue
+            stats = self.intervals[interval_key(datetime, self.interval)]
+            if event.pause is not None:
+                stats.pauses.add(event.pause)
+                self.pauses.add(event.pause)
+            self.kinds[event.kind] += 1
+            if event.kind == 'full':
+                stats.full += 1
+            if allocated:
+                stats.allocated += allocated
+            promoted = event.promoted
+            if promoted:
+                stats.promoted += promoted
+
+    def rows(self, errors=None):
+        """Statistics by time interval. Time intervals with log entries
+        outside of time range of GC logs are skipped
+
+        :param errors: dict time interval -> number of log entries or None
+        :return: generator of tuples time interval, dict
+        """
+        seconds = self.interval * 60
+        keys = set(self.intervals)
+        if errors and keys:
+            first, last = min(keys), max(keys)
+            keys.update(key for key in errors if first <= key <= last)
+        for key in sorted(keys):
+            yield key.decode('latin-1'), self.intervals[key].as_dict(
+                seconds, errors.get(key, 0) if errors is not None else None
+            )
+
+    def as_dict(self, errors=None):
+        """Summary as json serializable dict
+
+        :param errors: dict time interval -> number of log entries or None
+        :return: dict
+        """
+        return {'pauses': self.pauses.as_dict(), 'kinds': self.kinds,
+                'intervals': dict(self.rows(errors))}
+
+
+def gc_log_files(path):
+    """List of GC log files in directory
+
+    :param path: AnyStr
+    :return: list
+    """
+    if os.path.isfile(path):
+        return [path]
+    if not os.path.isdir(path):
+        return []
+    path = os.path.realpath(path)
+    files = set()
+    for pattern in GC_LOG_PATTERNS:
+        files.update(glob.glob(os.path.join(path, pattern)))
+    return sorted(files)
+
+
+def error_counts(summaries, interval=1):
+    """Number of log entries by time interval
+
+    :param summaries: dict log file -> ErrorSummary, see
+        `parse_tomcat_logs.summarize_dirs`
+    :param interval: length of time interval in minutes
+    :return: dict
+    """
+    res = defaultdict(int)
+    for summary in summaries.values():
+        for (minute, _, _), value in summary.counts.items():
+            res[interval_key(minute, interval)] += value
+    return res
+
+
+def correlation(pairs):
+    """Pearson correlation coefficient
+
+    :param pairs: list of tuples x, y
+    :return: float or None if it is not defined
+    """
+    if len(pairs) < 2:
+        return None
+    count = float(len(pairs))
+    mean_x = sum(x for x, _ in pairs) / count
+    mean_y = sum(y for _, y in pairs) / count
+    cov = sum((x - mean_x) * (y - mean_y) for x, y in pairs)
+    var_x = sum((x - mean_x) ** 2 for x, _ in pairs)
+    var_y = sum((y - mean_y) ** 2 for _, y in pairs)
+    if not var_x or not var_y:
+        return None
+    return cov / math.sqrt(var_x * var_y)
+
+
+def print_spikes(rows, pause_threshold, gc_time_threshold):
+    """Prints time intervals with long pauses or high GC time with number of
+    log entries compared to median of all time intervals
+
+    :param rows: list of tuples time interval, dict, see `GcSummary.rows`
+    :param pause_threshold: milliseconds
+    :param gc_time_threshold: percent of time interval
+    :return:
+    """
+    with_errors = 'errors' in rows[0][1] if rows else False
+    if with_errors:
+        counts = sorted(stats['errors'] for _, stats in rows)
+        median = counts[len(counts) // 2] or 1
+        coefficient = correlation([(stats['gc_time_pct'], stats['errors'])
+                                   for _, stats in rows])
+        print('Correlation of GC time and errors:',
+              'n/a' if coefficient is None else round(coefficient, 3))
+    spikes = [(key, stats) for key, stats in rows
+              if stats['max_pause_ms'] >= pause_threshold or
+              stats['gc_time_pct'] >= gc_time_threshold]
+    print('{0} time intervals with pause >= {1} ms or GC time >= {2}%'.format(
+        len(spikes), pause_threshold, gc_time_threshold))
+    if not spikes:
+        return
+    row = '{0:<17} {1:>6} {2:>6} {3:>12} {4:>8}' + \
+        (' {5:>8} {6:>9}' if with_errors else '')
+    print(row.format('Interval', 'GCs', 'Full', 'Max pause ms', 'GC time',
+                     'Errors', 'x median'))
+    for key, stats in spikes:
+        print(row.format(key, stats['gcs'], stats['full_gcs'],
+                         stats['max_pause_ms'],
+                         '{0}%'.format(stats['gc_time_pct']),
+                         stats.get('errors'),
+                         round(stats.get('errors', 0) / float(median), 1)
+                         if with_errors else None))
+
+
+def analyze_gc_logs(filename, *args, **kwargs):
+    """Analyzes GC logs in a single streaming pass, optionally counts log
+    entries of tomcat logs in the same time intervals, prints pause spikes
+    and saves statistics as csv (if filename ends with .csv) or json
+
+    :param filename: AnyStr result filename or None
+    :param args: list of directories or GC log files
+    :param kwargs: interval - length of time interval in minutes, start -
+        JVM start timestamp for GC logs without datetime, since, until, see
+        `parse_tomcat_logs.parse_time`, logs - list of tomcat log
+        directories to correlate with, jobs, pause_threshold,
+        gc_time_threshold, see `print_spikes`
+    :return: GcSummary
+    """
+    interval = kwargs.get('interval', 1)
+    since = kwargs.get('since')
+    until = kwargs.get('until')
+    summary = GcSummary(interval, kwargs.get('start'), since, until)
+    for path in args:
+        print('Searching for GC log files in', path)
+        for file_ in gc_log_files(path):
+            print('Proccessing', file_, '...')
+            with open_log(file_) as lfd:
+                summary.add_events(gc_events(lfd))
+
+    errors = None
+    if kwargs.get('logs'):
+        errors = error_counts(
+            summarize_dirs(None, *kwargs['logs'], jobs=kwargs.get('jobs', 1),
+                           since=since, until=until),
+            interval
+        )
+    rows = list(summary.rows(errors))
+    pauses = summary.pauses.as_dict()
+    print('{0} GC pauses, p50 {1} ms, p95 {2} ms, p99 {3} ms, max {4} '
+          'ms'.format(pauses['count'], pauses['p50'], pauses['p95'],
+                      pauses['p99'], pauses['max']))
+    print_spikes(rows, kwargs.get('pause_threshold', 500),
+                 kwargs.get('gc_time_threshold', 10))
+    if not filename:
+        return summary
+    if filename.endswith('.csv'):
+        columns = ('gcs', 'full_gcs', 'pause_ms', 'gc_time_pct') + tuple(
+            'pause_{0}_ms'.format(name) for name, _ in QUANTILES
+        ) + ('max_pause_ms', 'allocation_mb_sec', 'promotion_mb_sec') + (
+            ('errors', ) if errors is not None else ()
+        )
+        with open(filename, 'w') as csv_fd:
+            writer = csv.writer(csv_fd)
+            writer.writerow(('interval', ) + columns)
+            writer.writerows((key, ) + tuple(stats[column]
+                                             for column in columns)
+                             for key, stats in rows)
+    else:
+        with open(filename, 'w') as json_fd:
+            json.dump(summary.as_dict(errors), json_fd, indent=1,
+                      sort_keys=True)
+    print('GC summary saved to', filename)
+    return summary
+
+
+def parse_command(argv):
+    """Analyzes GC logs, see `--help`
+
+    :param argv: command line arguments
+    :return:
+    """
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('paths', nargs='+',
+                        help='Directories with GC logs or GC log files')
+    parser.add_argument('--output', '-o', metavar='FILENAME',
+                        help='Save statistics by time interval as csv (if '
+                             'FILENAME ends with .csv) or json')
+    parser.add_argument('--logs', nargs='+', metavar='DIRECTORY',
+                        help='Count log entries of tomcat logs in these '
+                             'directories to correlate them with GC pauses')
+    parser.add_argument('--interval', type=int, default=1,
+                        help='Length of time interval in minutes')
+    parser.add_argument('--since',
+                        help='Analyze GC pauses and log entries logged at or '
+                             'after this time: YYYY-MM-DD[ HH:MM[:SS]], '
+                             'today, yesterday, -Nm, -Nh, -Nd')
+    parser.add_argument('--until',
+                        help='Analyze GC pauses and log entries logged '
+                             'before this time, same formats as --since')
+    parser.add_argument('--jvm-start', metavar='TIME',
+                        help='JVM start time YYYY-MM-DD HH:MM:SS to convert '
+                             'uptime of GC logs without -XX:+PrintGCDateStamps'
+                             ' or time decoration')
+    parser.add_argument('--pause-threshold', type=float, default=500,
+                        help='Report time intervals with GC pause of at '
+                             'least this number of milliseconds')
+    parser.add_argument('--gc-time-threshold', type=float, default=10,
+                        help='Report time intervals with at least this '
+                             'percent of time spent in GC pauses')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes to count log '
+                             'entries of tomcat logs')
+    cmd_args = parser.parse_args(argv)
+    try:
+        since = parse_time(cmd_args.since) if cmd_args.since else None
+        until = parse_time(cmd_args.until) if cmd_args.until else None
+        start = time.mktime(time.strptime(
+            cmd_args.jvm_start, '%Y-%m-%d %H:%M:%S'
+        )) if cmd_args.jvm_start else None
+    except ValueError as exc:
+        parser.error(str(exc))
+    analyze_gc_logs(cmd_args.output, *cmd_args.paths,
+                    interval=max(cmd_args.interval, 1), start=start,
+                    since=since, until=until, logs=cmd_args.logs,
+                    jobs=cmd_args.jobs,
+                    pause_threshold=cmd_args.pause_threshold,
+                    gc_time_threshold=cmd_args.gc_time_threshold)
+
+
+if __name__ == '__main__':
+    parse_command(sys.argv[1:])
@@ -4,22 +4,133 @@
 
 """
 from __future__ import unicode_literals, with_statement, print_function
+import argparse
+import bz2
+import cProfile
+import csv
+import errno
+import gzip
+import itertools
+import json
+import mmap
+import multiprocessing
 import re
 import shutil
+import sqlite3
+import struct
+import subprocess
 import sys
 import os
+import time
 import glob
-from collections import defaultdict
+import hashlib
+import heapq
+from collections import defaultdict, OrderedDict
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    import resource
+except ImportError:
+    resource = None
 
 
 CURRENT_DIR = os.path.realpath(os.path.dirname(__file__)).encode()
 
+SXTOMCAT_BIN = '/opt/scalix-tomcat/bin'
+
 EXPR = re.compile(
     r'^(?P<datetime>\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}:\d{2}.\d{1,})\s+'
     r'\[(?P<level>.*?)\](.*)\[(?P<caller>\S+\.\S+?):\d+\](?P<descr>.*)'
     r'$'.encode()
 )
 
+# EXPR for matching at line start inside memory mapped file and cheap regular
+# expression to find the next line which can match it, see iter_events.
+# Starting with a literal newline lets re skip quickly to the next line
+HEADER_EXPR = re.compile(EXPR.pattern, re.M)
+HEADER_START = re.compile(r'\n(?=\d{4}-\d{2}-\d{2}\s)'.encode())
+
+# rotated log files compressed by logrotate, e.g. scalix-api.log.1.gz
+COMPRESSED_LOG_PATTERNS = ('*.log*.gz', '*.log*.bz2', '*.log*.xz')
+
+# first exception class in log entry, stack frame and numbers for fingerprint
+EXCEPTION_EXPR = re.compile(
+    r'((?:[\w$]+\.)+[\w$]*(?:Exception|Error|Throwable))\b'.encode()
+)
+FRAME_EXPR = re.compile(r'^\s+at\s+(\S+)'.encode())
+NUMBER_EXPR = re.compile(r'\d+'.encode())
+
+# follow mode: poll interval grows from min to max while log files are idle,
+# unfinished log entry is written after flush timeout, directories are
+# searched for new log files every rescan interval (seconds)
+FOLLOW_MIN_INTERVAL = 0.1
+FOLLOW_MAX_INTERVAL = 2.0
+FOLLOW_FLUSH_TIMEOUT = 2.0
+FOLLOW_RESCAN_INTERVAL = 10.0
+FOLLOW_READ_SIZE = 1024 * 1024
+
+# SQLite index of log entries. Live log files are tracked by path, rotated
+# log files by log name and fingerprint of the first INDEX_HEAD_SIZE bytes
+# (head), which do not change when logrotate renames or compresses them
+INDEX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    inode INTEGER,
+    size INTEGER,
+    offset INTEGER,
+    head TEXT
+);
+CREATE TABLE IF NOT EXISTS rotated (
+    head TEXT PRIMARY KEY,
+    path TEXT,
+    inode INTEGER,
+    offset INTEGER,
+    done INTEGER
+);
+CREATE TABLE IF NOT EXISTS errors (
+    path TEXT,
+    inode INTEGER,
+    offset INTEGER,
+    length INTEGER,
+    datetime TEXT,
+    level TEXT,
+    caller TEXT,
+    caller_class TEXT,
+    fingerprint TEXT
+);
+CREATE INDEX IF NOT EXISTS errors_datetime ON errors (datetime);
+CREATE INDEX IF NOT EXISTS errors_caller_class ON errors (caller_class,
+                                                          datetime);
+CREATE INDEX IF NOT EXISTS errors_caller ON errors (caller, datetime);
+"""
+INDEX_HEAD_SIZE = 4096
+
+# number of stack frames in fingerprint of log entry
+FINGERPRINT_FRAMES = 5
+
+# checkpoints of incremental mode
+STATE_FILE = os.path.join(CURRENT_DIR, b'.parse_tomcat_logs.state')
+
+# log files bigger than this are split into several ranges in parallel mode
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# streaming mode limits
+MAX_OPEN_FILES = 256
+WRITE_BUFFER_SIZE = 64 * 1024
+
+# archive output: log entries of each caller are stored in segments followed
+# by json index and trailer with magic and offset of index
+ARCHIVE_SUFFIX = b'.archive'
+ARCHIVE_MAGIC = b'TCLOGAR1'
+ARCHIVE_TRAILER = struct.Struct(str('>8sQ'))
+# max size of log entries buffered before they are written to archive in
+# streaming and follow mode
+ARCHIVE_BUFFER_SIZE = 16 * 1024 * 1024
+
 IGNORE_LEVELS = [
     b'INFO',
     None
@@ -32,6 +143,21 @@ IGNORE_CALLERS = [
     b'ContactsFormatter.formatMessage'
 ]
 
+# config files with additional ignored levels and callers, one per line
+IGNORE_CONFIG_FILES = ('ignore_java_levels', 'ignore_java_callers')
+
+# max number of cached results of caller rules
+IGNORE_CACHE_SIZE = 64 * 1024
+
+# IgnoreRules built from IGNORE_LEVELS, IGNORE_CALLERS and config files on
+# first use, see ignore_rules
+_IGNORE_RULES = None
+
+# ParseStats of current task when statistics are collected and profiler of
+# worker process, see measure_task
+_STATS = None
+_PROFILER = None
+
 CONFIG_PATH = (
     os.path.realpath(os.path.dirname(__file__)),
     os.path.join(os.sep, 'etc', 'opt'),
@@ -62,14 +188,67 @@ class ErrorDescription(object):
 
 
 def log_files(path):
-    """List of log files in directory
+    """List of log files in directory. Log files compressed by xz are skipped
+    without lzma module (Python 2). Uncompressed rotated log files, e.g.
+    scalix-api.log.1, are not listed: incremental mode, index and follow
+    mode treat uncompressed log files as live log files
 
     :param path:
     :return: list
     """
     if not os.path.isdir(path):
         return []
-    return glob.glob(os.path.join(os.path.realpath(path), "*.log"))
+    path = os.path.realpath(path)
+    files = glob.glob(os.path.join(path, "*.log"))
+    for pattern in COMPRESSED_LOG_PATTERNS:
+        found = glob.glob(os.path.join(path, pattern))
+        if found and lzma is None and pattern.endswith('.xz'):
+            print('Skipping {0} log files compressed by xz in {1}, lzma '
+                  'module is not available'.format(len(found), path),
+                  file=sys.stderr)
+            continue
+        files.extend(found)
+    return sorted(files)
+
+
+def is_compressed(filename):
+    """Checks if log file is compressed rotated log file
+
+    :param filename: AnyStr
+    :return: boolean
+    """
+    return os.path.splitext(filename)[1] in ('.gz', '.bz2', '.xz')
+
+
+def open_log(filename):
+    """Opens log file for reading in binary mode. Compressed log files are
+    decompressed on the fly
+
+    :param filename: AnyStr
+    :return: file object
+    """
+    ext = os.path.splitext(filename)[1]
+    if ext == '.gz':
+        return gzip.open(filename, 'rb')
+    if ext == '.bz2':
+        return bz2.BZ2File(filename, 'rb')
+    if ext == '.xz':
+        if lzma is None:
+            raise RuntimeError('lzma module is required to read '
+                               '{0}'.format(filename))
+        return lzma.open(filename, 'rb')
+    return open(filename, 'rb')
+
+
+def is_header_candidate(line):
+    """Cheap check if line can be the first line of log entry. Log entry
+    starts with date 'YYYY-MM-DD', so stack frames, exception messages etc.
+    are rejected without running `EXPR`
+
+    :param line: bytes
+    :return: boolean
+    """
+    return line[4:5] == b'-' and line[7:8] == b'-'
 
 
 def get_line_description(line):
@@ -78,7 +257,7 @@ def get_line_description(line):
     :param line:
     :return: ErrorDescription
     """
-    if not line:
+    if not line or not is_header_candidate(line):
         return None
     match = EXPR.match(line)
     if match:
@@ -86,6 +265,90 @@ def get_line_description(line):
     return None
 
 
+class IgnoreRules(object):
+    """Compiled ignore rules. Caller rule is exact caller
+    (`Message.parseRecipientHeader`), prefix (`com.scalix.caa.*`, `Mapi*`) or
+    glob with `*` and `?` (`*Formatter.format*`). Exact callers are looked up
+    in a dict, prefixes in sets of prefixes of the same length and globs are
+    joined into one regular expression. Result of each lookup is cached, so
+    every distinct caller is matched against prefixes and globs only once
+
+    """
+    __slots__ = ('levels', 'callers', 'prefixes', 'globs', 'source')
+
+    def __init__(self, levels=(), callers=(), source=None):
+        self.levels = frozenset(level.strip() for level in levels if level)
+        self.callers = {}
+        prefixes = defaultdict(set)
+        globs = []
+        for caller in callers:
+            caller = caller and caller.strip()
+            if not caller or caller.startswith(b'#'):
+                continue
+            wildcards = caller.count(b'*') + caller.count(b'?')
+            if not wildcards:
+                self.callers[caller] = True
+            elif wildcards == 1 and caller.endswith(b'*'):
+                prefixes[len(caller) - 1].add(caller[:-1])
+            else:
+                globs.append(b''.join(
+                    b'.*' if part == b'*' else b'.' if part == b'?' else
+                    re.escape(part) for part in re.split(b'([*?])', caller)
+                ))
+        self.prefixes = tuple((length, frozenset(values))
+                              for length, values in sorted(prefixes.items()))
+        self.globs = None
+        if globs:
+            self.globs = re.compile(b'(?:' + b'|'.join(globs) + b')$')
+        self.source = source
+
+    def ignore_caller(self, caller):
+        """Should we ignore log entries of this caller or not
+
+        :param caller: bytes
+        :return: boolean
+        """
+        ignored = self.callers.get(caller)
+        if ignored is None:
+            ignored = (
+                any(caller[:length] in values
+                    for length, values in self.prefixes) or
+                bool(self.globs and self.globs.match(caller))
+            )
+            if len(self.callers) < IGNORE_CACHE_SIZE:
+                self.callers[caller] = ignored
+        return ignored
+
+    def ignore(self, level, caller):
+        """Should we ignore log entry with this level and caller or not
+
+        :param level: bytes
+        :param caller: bytes
+        :return: boolean
+        """
+        return level.strip() in self.levels or self.ignore_caller(caller)
+
+
+def reset_ignore_rules():
+    """Drops compiled ignore rules, they are compiled again from
+    `IGNORE_LEVELS`, `IGNORE_CALLERS` and config files on next use. Should be
+    called after lists were changed, use `load_ignore_list` to compile them
+    at once
+
+    :return:
+    """
+    global _IGNORE_RULES
+    _IGNORE_RULES = None
+
+
+def ignore_rules():
+    """Compiled ignore rules, config files are read on the first call
+
+    :return: IgnoreRules
+    """
+    return _IGNORE_RULES or load_ignore_list()
+
+
 def ignore_error(error):
     """Should we ignore this log entry or not
 
@@ -95,115 +358,2553 @@ def ignore_error(error):
     if not error:
         return True
 
-    return (error.level in IGNORE_LEVELS
-            or error.caller in IGNORE_CALLERS)
+    return ignore_rules().ignore(error.level, error.caller)
+
 
+def classify_line(line, ignore=True):
+    """Classifies log line. It does the same as `get_line_description` and
+    `ignore_error` but faster: lines which are not log entry headers are
+    rejected by `is_header_candidate` before `EXPR` is executed and
+    ErrorDescription is not created for ignored log entries.
 
-def group_errors(filename):
+    Target throughput on a single core is 5M lines/sec for stack frames and
+    other lines which are not headers and 500K lines/sec for header lines,
+    i.e. at least 1M lines/sec for typical error log.
+
+    :param line: bytes
+    :param ignore: apply ignore rules, see `ignore_error`
+    :return: None if line is not log entry header, False if log entry should
+        be ignored, ErrorDescription otherwise
     """
+    if line[4:5] != b'-' or line[7:8] != b'-':
+        return None
+    match = EXPR.match(line)
+    if not match:
+        return None
+    datetime, level, caller, descr = match.group('datetime', 'level',
+                                                 'caller', 'descr')
+    rules = ignore and (_IGNORE_RULES or ignore_rules())
+    if rules and (level.strip() in rules.levels or
+                  rules.ignore_caller(caller)):
+        return False
+    return ErrorDescription(datetime, level, caller, descr)
 
-    :param filename:
-    :return:
+
+def line_records(lines, offset=0, ignore=True, pending=None):
+    """Log entries which are not ignored in lines of log file with their
+    offsets. Lines before the first log entry are skipped. It is the only
+    parser of lines into log entries: compressed log files, incremental and
+    follow modes and index are built on it, memory mapped log files are
+    parsed by `mapped_records`
+
+    :param lines: iterable of bytes
+    :param offset: offset of the first line in file
+    :param ignore: skip log entries matching ignore rules
+    :param pending: list of lines of unfinished log entry from previous call.
+        If it is given the last log entry is not returned, its lines are left
+        in this list instead
+    :return: generator of tuples ErrorDescription, offset, list of lines of
+        log entry
+    """
+    entry = list(pending or ())
+    error = classify_line(entry[0], ignore) if entry else None
+    start = offset - sum(len(line) for line in entry)
+    ignored = 0
+    if _STATS is not None:
+        lines = counted_lines(lines, _STATS)
+    for line in lines:
+        header = classify_line(line, ignore)
+        if header is None:
+            if error:
+                entry.append(line)
+        else:
+            if error:
+                yield error, start, entry
+            error = header
+            start = offset
+            if header:
+                entry = [line]
+            else:
+                entry = []
+                ignored += 1
+        offset += len(line)
+    if pending is None:
+        if error:
+            yield error, start, entry
+    else:
+        pending[:] = entry if error else []
+    if _STATS is not None:
+        _STATS.ignored += ignored
+
+
+def line_events(lines, ignore=True, pending=None):
+    """Log entries which are not ignored in lines of log file, see
+    `line_records`
+
+    :param lines: iterable of bytes
+    :param ignore: skip log entries matching ignore rules
+    :param pending: see `line_records`
+    :return: generator of tuples ErrorDescription, bytes with lines of log
+        entry
+    """
+    for error, _, entry in line_records(lines, 0, ignore, pending):
+        yield error, b''.join(entry)
+
+
+def mapped_records(mapped, start, end, ignore=True):
+    """Log entries which are not ignored in range [start, end) of memory
+    mapped log file. Only lines which look like log entry headers are
+    matched, see `iter_events`
+
+    :param mapped: mmap.mmap
+    :param start: offset of line start
+    :param end: int
+    :param ignore: skip log entries matching ignore rules
+    :return: generator of tuples ErrorDescription, offset of log entry,
+        offset of its end
+    """
+    rules = ignore_rules() if ignore else IgnoreRules()
+    find = mapped.find
+    match_header = HEADER_EXPR.match
+    error = None
+    entry_start = start
+    ignored = 0
+    candidates = itertools.chain(
+        (start,),
+        (match.end() for match in HEADER_START.finditer(mapped, start, end))
+    )
+    for pos in candidates:
+        eol = find(b'\n', pos, end)
+        match = match_header(mapped, pos, end if eol == -1 else eol + 1)
+        if not match:
+            continue
+        if error:
+            yield error, entry_start, pos
+        datetime, level, caller, descr = match.group('datetime', 'level',
+                                                     'caller', 'descr')
+        if level.strip() in rules.levels or rules.ignore_caller(caller):
+            error = None
+            ignored += 1
+        else:
+            error = ErrorDescription(datetime, level, caller, descr)
+            entry_start = pos
+    if error:
+        yield error, entry_start, end
+    if _STATS is not None:
+        _STATS.ignored += ignored
+
+
+def mapped_events(mapped, start, end, ignore=True):
+    """Log entries which are not ignored in range [start, end) of memory
+    mapped log file, see `iter_events`
+
+    :param mapped: mmap.mmap
+    :param start: offset of line start
+    :param end: int
+    :param ignore: skip log entries matching ignore rules
+    :return: generator of tuples ErrorDescription, memoryview with lines of
+        log entry
+    """
+    try:
+        view = memoryview(mapped)
+    except TypeError:
+        # mmap does not support memoryview in Python 2, entries are copied
+        view = mapped
+    for error, entry_start, entry_end in mapped_records(mapped, start, end,
+                                                        ignore):
+        yield error, view[entry_start:entry_end]
+
+
+def iter_events(path, start=0, end=None, since=None, until=None,
+                ignore=True):
+    """Log entries of log file which are not ignored, see `ignore_error`.
+
+    Log file is memory mapped and only lines which look like log entry
+    headers are matched, stack traces are not split into lines. Each log
+    entry is a memoryview slice of mapped file, nothing is copied. File is
+    unmapped when all slices are released, so slices kept after iteration
+    keep whole file mapped: use `bytes(entry)` to keep log entry.
+
+    Compressed log files are read line by line and log entries are bytes.
+
+    :param path: AnyStr log filename
+    :param start: offset of the first log entry, offsets are not supported
+        for compressed log files
+    :param end: offset of the end of the last log entry, end of file by
+        default
+    :param since: bytes, see `parse_time`. Log entries logged before are
+        skipped
+    :param until: bytes, see `parse_time`. Iteration stops at the first log
+        entry logged at or after it
+    :param ignore: skip log entries matching ignore rules, all log entries
+        are returned if it is False
+    :return: generator of tuples ErrorDescription, memoryview or bytes with
+        lines of log entry including header
+    """
+    if is_compressed(path):
+        with open_log(path) as lfd:
+            events = line_events(lfd, ignore)
+            if since or until:
+                events = window_events(events, since, until)
+            for event in events:
+                yield event
+        return
+
+    with open(path, 'rb') as lfd:
+        size = os.fstat(lfd.fileno()).st_size
+        end = size if end is None else min(end, size)
+        if start >= end:
+            return
+        mapped = mmap.mmap(lfd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            if since:
+                start = find_time_offset(mapped, since, start, end)
+            if until:
+                end = find_time_offset(mapped, until, start, end)
+            if _STATS is not None:
+                _STATS.bytes += end - start
+                _STATS.lines += count_lines(mapped, start, end)
+            for event in mapped_events(mapped, start, end, ignore):
+                yield event
+        finally:
+            try:
+                mapped.close()
+            except BufferError:
+                # log entries are still referenced, file is unmapped when
+                # they are released
+                pass
+
+
+def group_events(events, output=None):
+    """Groups log entries by caller class
+
+    :param events: iterable of tuples ErrorDescription, log entry, see
+        `iter_events`
+    :param output: object with `write(error, lines)` method, e.g. OutputPool
+        or UniqueErrors. Log entries are passed to it as soon as they are
+        parsed instead of grouping them in memory. Lines passed to
+        `output.write` are valid only during the call
+    :return: tuple grouped log entries and summary by caller class
     """
     res = defaultdict(list)
-    stacktrace = []
     summary = defaultdict(int)
+    split = isinstance(output, UniqueErrors)
+    for error, entry in events:
+        key = error.caller_class
+        summary[key] += 1
+        if output is None:
+            res[key].append(bytes(entry))
+        elif split:
+            output.write(error, bytes(entry).splitlines(True))
+        else:
+            output.write(error, [entry])
+    return res, summary
 
-    def __save_data(err):
-        if not err:
-            return
-        summary[err.caller_class] += 1
-        res[err.caller_class].extend(stacktrace[:-1])
 
+def filter_events(events, levels=None, callers=None):
+    """Log entries with specified levels and callers
+
+    :param events: iterable of tuples ErrorDescription, log entry, see
+        `iter_events`
+    :param levels: collection of levels (bytes), all levels by default
+    :param callers: collection of caller classes or callers (bytes), all
+        callers by default
+    :return: generator of tuples ErrorDescription, log entry
+    """
+    for error, entry in events:
+        if levels and error.level not in levels:
+            continue
+        if callers and (error.caller_class not in callers and
+                        error.caller not in callers):
+            continue
+        yield error, entry
+
+
+def merge_events(streams):
+    """Merges log entries of several log files by datetime. Log entries of
+    each log file are expected to be sorted by datetime, only the next log
+    entry of each log file is kept in heap, so memory usage depends on number
+    of log files only
+
+    :param streams: list of iterables of tuples ErrorDescription, log entry,
+        see `iter_events`
+    :return: generator of tuples index of stream, ErrorDescription, log entry
+    """
+    heap = []
+    for index, events in enumerate(streams):
+        events = iter(events)
+        for error, entry in events:
+            heap.append((error.datetime, index, error, entry, events))
+            break
+    heapq.heapify(heap)
+    while heap:
+        _, index, error, entry, events = heap[0]
+        yield index, error, entry
+        for error, entry in events:
+            heapq.heapreplace(heap, (error.datetime, index, error, entry,
+                                     events))
+            break
+        else:
+            heapq.heappop(heap)
+
+
+def group_errors(filename, output=None, window=None, start=0, end=None):
+    """Groups log entries of log file by caller class
+
+    :param filename:
+    :param output: see `group_events`
+    :param window: None or tuple (since, until), see `iter_events`
+    :param start: offset of the first log entry
+    :param end: offset of the end of the last log entry, end of file by
+        default
+    :return:
+    """
     if not os.path.isfile(filename):
         print('Found `{0}` but its directory '.format(filename))
-        return res, summary
+        return defaultdict(list), defaultdict(int)
 
-    with open(filename, 'rb') as lfd:
-        prev = None
-        for line in lfd:
-            stacktrace.append(line)
-            error = get_line_description(line)
-            if ignore_error(error):
-                if error:
-                    __save_data(prev)
-                    prev = None
-                    del stacktrace[:]
+    return group_events(iter_events(filename, start, end, *(window or ())),
+                        output)
+
+
+def parse_time(value):
+    """Converts time argument into value comparable with log entry datetime.
+    Absolute time is 'YYYY-MM-DD[ HH:MM[:SS]]', 'today' or 'yesterday',
+    relative time is number of minutes, hours or days before now, e.g.
+    '-30m', '-1h', '-2d'
+
+    :param value: str
+    :return: bytes
+    """
+    match = re.match(r'^-(\d+)([mhd])$', value)
+    if value in ('today', 'yesterday'):
+        days = 1 if value == 'yesterday' else 0
+        value = time.strftime('%Y-%m-%d',
+                              time.localtime(time.time() - days * 86400))
+    elif match:
+        seconds = int(match.group(1)) * {'m': 60, 'h': 3600,
+                                         'd': 86400}[match.group(2)]
+        value = time.strftime('%Y-%m-%d %H:%M:%S',
+                              time.localtime(time.time() - seconds))
+    elif not re.match(r'^\d{4}-\d{2}-\d{2}(\s+\d{2}:\d{2}(:\d{2})?)?$', value):
+        raise ValueError('Invalid time {0}. Supported formats: '
+                         'YYYY-MM-DD[ HH:MM[:SS]], today, yesterday, -Nm, '
+                         '-Nh, -Nd'.format(value))
+    return ' '.join(value.split()).encode()
+
+
+def window_events(events, since=None, until=None):
+    """Log entries logged in time window [since, until). Reading stops at the
+    first log entry logged at or after `until`
+
+    :param events: iterable of tuples ErrorDescription, log entry
+    :param since: bytes, see `parse_time`
+    :param until: bytes, see `parse_time`
+    :return: generator of tuples ErrorDescription, log entry
+    """
+    for error, entry in events:
+        if until and error.datetime >= until:
+            return
+        if not since or error.datetime >= since:
+            yield error, entry
+
+
+def counted_lines(lines, stats):
+    """Counts lines and bytes read, used only when statistics are collected
+
+    :param lines: iterable of bytes
+    :param stats: ParseStats
+    :return: generator
+    """
+    for line in lines:
+        stats.lines += 1
+        stats.bytes += len(line)
+        yield line
+
+
+def count_lines(mapped, start, end):
+    """Number of lines in range [start, end) of memory mapped file
+
+    :param mapped: mmap.mmap
+    :param start: int
+    :param end: int
+    :return: int
+    """
+    # lines are found in place, so statistics do not copy the file
+    lines = 0
+    find = mapped.find
+    pos = find(b'\n', start, end)
+    while pos != -1:
+        lines += 1
+        pos = find(b'\n', pos + 1, end)
+    if end > start and mapped[end - 1:end] != b'\n':
+        lines += 1
+    return lines
+
+
+def mapped_lines(mapped, start, end):
+    """Lines of memory mapped file in range [start, end)
+
+    :param mapped: mmap.mmap
+    :param start: int
+    :param end: int
+    :return: generator
+    """
+    mapped.seek(start)
+    readline = mapped.readline
+    while start < end:
+        line = readline()
+        start += len(line)
+        yield line
+
+
+def find_record_start(mapped, pos, end):
+    """Finds offset of the first line at or after `pos` which matches `EXPR`.
+    Lines before such line belongs to the previous log entry
+
+    :param mapped: mmap.mmap
+    :param pos: int
+    :param end: int
+    :return: int offset or `end` if there are no such line
+    """
+    if pos > 0:
+        pos = mapped.find(b'\n', pos - 1, end)
+        if pos == -1:
+            return end
+        pos += 1
+    mapped.seek(pos)
+    while pos < end:
+        line = mapped.readline()
+        if is_header_candidate(line) and EXPR.match(line):
+            return pos
+        pos += len(line)
+    return end
+
+
+def find_time_offset(mapped, timestamp, start, end):
+    """Binary search of the first log entry logged at or after `timestamp`.
+    Log entries are expected to be sorted by datetime, which is true for
+    tomcat logs. Only few pages of file are read
+
+    :param mapped: mmap.mmap
+    :param timestamp: bytes, see `parse_time`
+    :param start: int
+    :param end: int
+    :return: int offset or `end` if there are no such log entry
+    """
+    low, high = start, end
+    while low < high:
+        middle = (low + high) // 2
+        pos = find_record_start(mapped, middle, end)
+        if pos < end:
+            mapped.seek(pos)
+            datetime = EXPR.match(mapped.readline()).group('datetime')
+            if datetime < timestamp:
+                low = pos + 1
                 continue
-            __save_data(prev)
-            prev = error
-            del stacktrace[:-1]
-    del stacktrace[:]
-    return res, summary
+        high = middle
+    return find_record_start(mapped, low, end)
 
 
-def parse_files(path):
-    """Walks thru .log files in specified directory. Creates directory with
-    log file filename and each log entry(caller) is in separate file
+def split_file(filename, chunk_size=CHUNK_SIZE, since=None, until=None):
+    """Splits log file into byte ranges of approximately `chunk_size` bytes.
+    Each range starts with log entry so ranges can be grouped independently.
+    Files which does not need splitting and compressed files have single
+    range (0, None). If `since` or `until` is specified ranges cover only
+    log entries logged in this time window, see `find_time_offset`
 
-    :param path:  AnyStr
-    :return:
+    :param filename: AnyStr
+    :param chunk_size: int
+    :param since: bytes, see `parse_time`
+    :param until: bytes, see `parse_time`
+    :return: list of tuples (start, end)
     """
-    for file_ in log_files(path):
-        print('Proccessing', file_, '...')
-        grouped_errors, summary = group_errors(file_)
-        if not grouped_errors:
-            continue
-        result_dir = os.path.join(CURRENT_DIR, os.path.basename(file_).encode())
-        if os.path.exists(result_dir):
-            print('Directory {0} exists. Deleting ...'.format(result_dir))
-            shutil.rmtree(result_dir)
-        os.mkdir(result_dir)
-        for key, value in grouped_errors.items():
-            print("Instance `{0}` has"
-                  "logged {1} item('s)".format(key.decode(), summary.get(key)))
-            with open(os.path.join(result_dir, key + b'.log'), 'ab') as dest_fd:
-                dest_fd.writelines(value)
+    if not os.path.isfile(filename) or is_compressed(filename):
+        return [(0, None)]
+    size = os.path.getsize(filename)
+    if not size or (not since and not until and
+                    (not chunk_size or size <= chunk_size)):
+        return [(0, None)]
 
+    with open(filename, 'rb') as lfd:
+        mapped = mmap.mmap(lfd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            start, end = 0, size
+            if since:
+                start = find_time_offset(mapped, since, start, end)
+            if until:
+                end = find_time_offset(mapped, until, start, end)
+            bounds = [start]
+            if chunk_size:
+                pos = find_record_start(mapped, start + chunk_size, end)
+                while pos < end:
+                    bounds.append(pos)
+                    pos = find_record_start(mapped, pos + chunk_size, end)
+        finally:
+            mapped.close()
+    bounds.append(end)
+    return list(zip(bounds[:-1], bounds[1:]))
 
-def process_dirs(*args):
-    """Parse log files in specified directories
 
-    :param args: list of directories
-    :return:
+def group_errors_range(task):
+    """Groups log entries in byte range of log file. Used by worker processes
+
+    :param task: tuple (filename, start, end, output, window), end is None
+        for whole file, output is None or `create_output` arguments, window
+        is None or (since, until) for files which are not split by time
+    :return: tuple grouped lines or UniqueErrors and summary by caller class
     """
-    for directory in args:
-        if os.path.isdir(directory):
-            print('Searching for log files in directory', directory)
-            parse_files(directory)
+    filename, start, end, output, window = task
+    output = create_output(filename, output)
+    try:
+        grouped_errors, summary = group_errors(
+            filename, output, window if end is None else None, start, end
+        )
+    finally:
+        if output is not None:
+            output.close()
+    if isinstance(output, UniqueErrors):
+        grouped_errors = output
+    return grouped_errors, summary
+
+
+def merge_grouped_errors(results):
+    """Merges results of `group_errors_range` in file order
+
+    :param results: iterable of tuples grouped lines or UniqueErrors and
+        summary
+    :return: tuple grouped lines or UniqueErrors and summary by caller class
+    """
+    res = defaultdict(list)
+    summary = defaultdict(int)
+    for grouped_errors, counters in results:
+        if isinstance(grouped_errors, UniqueErrors):
+            if not isinstance(res, UniqueErrors):
+                res = UniqueErrors(grouped_errors.frames)
+            res.update(grouped_errors)
         else:
-            print('Directory', directory, 'is not a directory')
+            for key, value in grouped_errors.items():
+                res[key].extend(value)
+        for key, value in counters.items():
+            summary[key] += value
+    return res, summary
 
 
-def get_config_file(filename):
-    """Get absolute filename for existing config filename
+class Checkpoint(object):
+    """Position of incremental parsing in log file. `pending` holds lines of
+    the last log entry which can be continued by newly appended lines
+
+    """
+    __slots__ = ('inode', 'size', 'offset', 'pending')
+
+    def __init__(self, inode=0, size=0, offset=0, pending=None):
+        self.inode = inode
+        self.size = size
+        self.offset = offset
+        self.pending = pending or []
+
+    def lines(self, lfd, complete=True):
+        """Lines of file after checkpoint offset. Offset is moved after each
+        line. Last line without line end is not returned if `complete`,
+        because tomcat may be in the middle of writing it
+
+        :param lfd: file object opened in binary mode
+        :param complete: return only complete lines
+        :return: generator
+        """
+        lfd.seek(self.offset)
+        for line in lfd:
+            if complete and not line.endswith(b'\n'):
+                break
+            self.offset += len(line)
+            yield line
+
+    def as_dict(self):
+        """Checkpoint as json serializable dict
+
+        :return: dict
+        """
+        return {'inode': self.inode, 'size': self.size, 'offset': self.offset,
+                'pending': [line.decode('latin-1') for line in self.pending]}
+
+    @staticmethod
+    def from_dict(data):
+        """Constructs Checkpoint from `as_dict` result
+
+        :param data: dict
+        :return: Checkpoint
+        """
+        return Checkpoint(data['inode'], data['size'], data['offset'],
+                          [line.encode('latin-1') for line in data['pending']])
+
+
+def find_file_by_inode(directory, inode):
+    """Searches directory for file with specified inode, e.g. log file which
+    was renamed by logrotate
+
+    :param directory: AnyStr
+    :param inode: int
+    :return: filename or None
+    """
+    for name in os.listdir(directory):
+        filename = os.path.join(directory, name)
+        if os.path.isfile(filename) and os.stat(filename).st_ino == inode:
+            return filename
+    return None
+
+
+def group_errors_appended(task):
+    """Groups log entries which were appended to log file after checkpoint.
+    If file was truncated parsing starts from the beginning, if it was
+    rotated (inode was changed) the rest of rotated file is parsed first
+
+    :param task: tuple (filename, checkpoint dict or None, output), output
+        is None or `create_output` arguments
+    :return: tuple grouped lines or UniqueErrors, summary and new checkpoint
+        dict
+    """
+    filename, data, output = task
+    checkpoint = Checkpoint.from_dict(data) if data else Checkpoint()
+    output = create_output(filename, output, bool(data))
+    try:
+        results, checkpoint = _group_appended(filename, checkpoint, output)
+    finally:
+        if output is not None:
+            output.close()
+    grouped_errors, summary = merge_grouped_errors(results)
+    if isinstance(output, UniqueErrors):
+        grouped_errors = output
+    return grouped_errors, summary, checkpoint.as_dict()
+
+
+def _group_appended(filename, checkpoint, output):
+    """Groups lines appended after checkpoint, see `group_errors_appended`
+
+    :param filename: AnyStr
+    :param checkpoint: Checkpoint
+    :param output: see `group_events`
+    :return: tuple list of `group_events` results and new checkpoint
+    """
+    results = []
+    stat = os.stat(filename)
+    if checkpoint.inode and checkpoint.inode != stat.st_ino:
+        rotated = find_file_by_inode(os.path.dirname(filename),
+                                     checkpoint.inode)
+        if rotated:
+            print('Log file {0} was rotated to {1}'.format(filename, rotated))
+            with open(rotated, 'rb') as lfd:
+                results.append(group_events(line_events(
+                    checkpoint.lines(lfd, False), pending=checkpoint.pending
+                ), output))
+        results.append(group_events(line_events(checkpoint.pending), output))
+        checkpoint = Checkpoint()
+    elif stat.st_size < checkpoint.offset:
+        print('Log file {0} was truncated'.format(filename))
+        results.append(group_events(line_events(checkpoint.pending), output))
+        checkpoint = Checkpoint()
+
+    with open(filename, 'rb') as lfd:
+        results.append(group_events(line_events(
+            checkpoint.lines(lfd), pending=checkpoint.pending
+        ), output))
+    checkpoint.inode = stat.st_ino
+    checkpoint.size = stat.st_size
+    return results, checkpoint
+
+
+def load_checkpoints(filename):
+    """Loads checkpoints of incremental mode
+
+    :param filename: AnyStr
+    :return: dict log filename -> checkpoint dict
+    """
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, 'rb') as state_fd:
+        return json.loads(state_fd.read().decode())
+
+
+def save_checkpoints(filename, checkpoints):
+    """Saves checkpoints of incremental mode. File is replaced atomically so
+    interrupted run does not break the state
 
     :param filename: AnyStr
+    :param checkpoints: dict log filename -> checkpoint dict
     :return:
     """
-    for config_path in CONFIG_PATH:
-        conf_file = os.path.join(config_path, filename)
-        if not os.path.isfile(conf_file):
-            continue
-        return conf_file
+    tmp_filename = filename + b'.tmp'
+    with open(tmp_filename, 'wb') as state_fd:
+        state_fd.write(json.dumps(checkpoints, indent=1).encode())
+    os.rename(tmp_filename, filename)
 
 
-def load_ignore_list():
+def result_directory(filename, append=False, root=None):
+    """Creates directory for results of log file
+
+    :param filename: AnyStr log filename
+    :param append: keep results of previous run instead of deleting them
+    :param root: bytes directory for result directories, CURRENT_DIR by
+        default
+    :return: AnyStr
     """
+    result_dir = os.path.join(root or CURRENT_DIR,
+                              os.path.basename(filename).encode())
+    if os.path.exists(result_dir) and not append:
+        print('Directory {0} exists. Deleting ...'.format(result_dir))
+        shutil.rmtree(result_dir)
+    if not os.path.exists(result_dir):
+        os.makedirs(result_dir)
+    return result_dir
+
+
+def print_summary(summary):
+    """Prints number of log entries by caller class
 
+    :param summary: dict
     :return:
     """
-    ignore_ = (("ignore_java_levels", IGNORE_LEVELS),
-               ("ignore_java_callers", IGNORE_CALLERS))
-    for filename, dest in ignore_:
-        conf_file = get_config_file(filename)
-        if not conf_file:
-            continue
-        with open(conf_file, "rb") as conf_fd:
-            dest.extend(conf_fd.read().splitlines())
+    for key, value in summary.items():
+        print("Instance `{0}` has"
+              "logged {1} item('s)".format(key.decode(), value))
+
+
+class OutputPool(object):
+    """Per caller result files of log file in streaming mode. At most
+    `max_open` files are kept open, least recently used file is closed when
+    the limit is reached. Result directory is created on the first write
+
+    """
+    __slots__ = ('filename', 'max_open', 'buffering', 'root', 'append',
+                 'directory', '_files')
+
+    def __init__(self, filename, max_open=MAX_OPEN_FILES,
+                 buffering=WRITE_BUFFER_SIZE, root=None, append=False):
+        self.filename = filename
+        self.max_open = max(max_open, 1)
+        self.buffering = buffering
+        self.root = root
+        self.append = append
+        self.directory = None
+        self._files = OrderedDict()
+
+    def write(self, error, lines):
+        """Appends lines of log entry to result file of caller
+
+        :param error: ErrorDescription
+        :param lines: list of bytes
+        :return:
+        """
+        key = error.caller_class
+        dest_fd = self._files.pop(key, None)
+        if dest_fd is None:
+            if self.directory is None:
+                self.directory = result_directory(self.filename, self.append,
+                                                  self.root)
+            if len(self._files) >= self.max_open:
+                self._files.popitem(last=False)[1].close()
+            dest_fd = open(os.path.join(self.directory, key + b'.log'), 'ab',
+                           self.buffering)
+        self._files[key] = dest_fd
+        dest_fd.writelines(lines)
+
+    def flush(self):
+        """Flushes write buffers of open files
+
+        :return:
+        """
+        for dest_fd in self._files.values():
+            dest_fd.flush()
+
+    def close(self):
+        """Closes all open files
+
+        :return:
+        """
+        while self._files:
+            self._files.popitem()[1].close()
+
+
+def fingerprint(error, lines, frames=FINGERPRINT_FRAMES):
+    """Fingerprint of log entry. It is built from caller, exception class and
+    top `frames` stack frames with numbers (line numbers, generated class
+    names etc.) stripped. Description is used for log entries without stack
+    frames
+
+    :param error: ErrorDescription
+    :param lines: lines of log entry
+    :param frames: number of stack frames
+    :return: str
+    """
+    exception = EXCEPTION_EXPR.search(error.description)
+    top = []
+    for line in lines[1:]:
+        frame = FRAME_EXPR.match(line)
+        if frame:
+            if len(top) == frames:
+                break
+            top.append(NUMBER_EXPR.sub(b'#', frame.group(1)))
+        elif not exception and not top:
+            exception = EXCEPTION_EXPR.search(line)
+    parts = [error.caller, exception.group(1) if exception else b'']
+    parts.extend(top or [NUMBER_EXPR.sub(b'#', error.description)])
+    return hashlib.sha1(b'\n'.join(parts)).hexdigest()[:16]
+
+
+class UniqueErrors(object):
+    """Unique log entries by fingerprint. Only the first occurrence of log
+    entry is kept together with number of occurrences and datetime of the
+    first and the last occurrence
+
+    """
+    __slots__ = ('frames', 'entries')
+
+    def __init__(self, frames=FINGERPRINT_FRAMES):
+        self.frames = frames
+        self.entries = OrderedDict()
+
+    def write(self, error, lines):
+        """Adds occurrence of log entry
+
+        :param error: ErrorDescription
+        :param lines: list of bytes
+        :return:
+        """
+        key = (error.caller_class, fingerprint(error, lines, self.frames))
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = [1, error.datetime, error.datetime,
+                                 list(lines)]
+            return
+        entry[0] += 1
+        entry[1] = min(entry[1], error.datetime)
+        entry[2] = max(entry[2], error.datetime)
+
+    def update(self, other):
+        """Adds occurrences from other UniqueErrors
+
+        :param other: UniqueErrors
+        :return:
+        """
+        for key, (count, first, last, lines) in other.entries.items():
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [count, first, last, lines]
+                continue
+            entry[0] += count
+            entry[1] = min(entry[1], first)
+            entry[2] = max(entry[2], last)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def close(self):
+        """Nothing to close, UniqueErrors is kept in memory
+
+        :return:
+        """
+
+    def items(self):
+        """Lines of unique log entries by caller class. Each log entry is
+        preceded by line with number of occurrences
+
+        :return: list of tuples caller class, lines
+        """
+        res = defaultdict(list)
+        for (key, print_), (count, first, last, lines) in self.entries.items():
+            res[key].append(
+                '# fingerprint: {0}, occurrences: {1}, first seen: {2}, '
+                'last seen: {3}\n'.format(print_, count, first.decode(),
+                                          last.decode()).encode()
+            )
+            res[key].extend(lines)
+        return res.items()
+
+
+def archive_filename(filename, root=None):
+    """Archive filename of log file
+
+    :param filename: AnyStr log filename
+    :param root: bytes directory for archives, CURRENT_DIR by default
+    :return: bytes
+    """
+    return os.path.join(root or CURRENT_DIR,
+                        os.path.basename(filename).encode() + ARCHIVE_SUFFIX)
+
+
+def read_archive_index(afd):
+    """Reads index of archive
+
+    :param afd: archive file object opened in binary mode
+    :return: tuple dict caller class: {'entries': number of log entries,
+        'segments': list of [offset, size]} and offset of index
+    """
+    afd.seek(0, os.SEEK_END)
+    size = afd.tell() - ARCHIVE_TRAILER.size
+    magic, offset = b'', 0
+    if size >= 0:
+        afd.seek(size)
+        magic, offset = ARCHIVE_TRAILER.unpack(afd.read(ARCHIVE_TRAILER.size))
+    if magic != ARCHIVE_MAGIC or offset > size:
+        raise ValueError('{0} is not an archive'.format(afd.name))
+    afd.seek(offset)
+    index = json.loads(afd.read(size - offset).decode('latin-1'))
+    return (dict((key.encode('latin-1'), value)
+                 for key, value in index['callers'].items()), offset)
+
+
+class ArchiveWriter(object):
+    """Results of log file in one archive file instead of directory with file
+    per caller class. Log entries of each caller class are written in
+    segments, index with segments of each caller class is written at the end
+    of file on `flush`, so caller class can be read without reading whole
+    archive. In append mode new segments overwrite index of previous run.
+
+    Log entries passed to `write` are buffered by caller class up to
+    `buffering` bytes, so each caller class gets a few big segments instead
+    of segment per log entry
+
+    """
+    __slots__ = ('filename', 'buffering', 'root', 'append', 'afd', 'offset',
+                 'callers', 'dirty', '_buffers', '_buffered')
+
+    def __init__(self, filename, buffering=ARCHIVE_BUFFER_SIZE, root=None,
+                 append=False):
+        self.filename = filename
+        self.buffering = buffering
+        self.root = root
+        self.append = append
+        self.afd = None
+        self.offset = 0
+        self.callers = {}
+        self.dirty = False
+        self._buffers = {}
+        self._buffered = 0
+
+    def _open(self):
+        """Opens archive on the first write, index of previous run is read
+        in append mode
+
+        :return:
+        """
+        archive = archive_filename(self.filename, self.root)
+        if not os.path.exists(os.path.dirname(archive)):
+            os.makedirs(os.path.dirname(archive))
+        if self.append and os.path.exists(archive):
+            self.afd = open(archive, 'r+b')
+            self.callers, self.offset = read_archive_index(self.afd)
+            self.afd.seek(self.offset)
+        else:
+            self.afd = open(archive, 'wb')
+
+    def write(self, error, lines):
+        """Adds lines of log entry to buffer of caller
+
+        :param error: ErrorDescription
+        :param lines: list of bytes
+        :return:
+        """
+        buffered = self._buffers.get(error.caller_class)
+        if buffered is None:
+            buffered = self._buffers[error.caller_class] = [[], 0]
+        buffered[0].extend(bytes(line) for line in lines)
+        buffered[1] += 1
+        self._buffered += sum(len(line) for line in lines)
+        if self._buffered >= self.buffering:
+            self._write_buffers()
+
+    def write_grouped(self, grouped_errors, summary):
+        """Writes lines grouped by caller class
+
+        :param grouped_errors: dict or UniqueErrors
+        :param summary: dict number of log entries by caller class
+        :return:
+        """
+        for key, value in grouped_errors.items():
+            self._write_segment(key, value, summary.get(key, 0))
+
+    def _write_buffers(self):
+        for key, (lines, entries) in self._buffers.items():
+            self._write_segment(key, lines, entries)
+        self._buffers.clear()
+        self._buffered = 0
+
+    def _write_segment(self, key, lines, entries):
+        if self.afd is None:
+            self._open()
+        size = sum(len(line) for line in lines)
+        self.afd.writelines(lines)
+        caller = self.callers.setdefault(key, {'entries': 0, 'segments': []})
+        segments = caller['segments']
+        if segments and sum(segments[-1]) == self.offset:
+            segments[-1][1] += size
+        else:
+            segments.append([self.offset, size])
+        caller['entries'] += entries
+        self.offset += size
+        self.dirty = True
+
+    def flush(self):
+        """Writes buffered log entries and index
+
+        :return:
+        """
+        self._write_buffers()
+        if not self.dirty:
+            return
+        index = {'callers': dict((key.decode('latin-1'), value)
+                                 for key, value in self.callers.items())}
+        self.afd.write(json.dumps(index, sort_keys=True).encode('latin-1'))
+        self.afd.write(ARCHIVE_TRAILER.pack(ARCHIVE_MAGIC, self.offset))
+        self.afd.truncate()
+        self.afd.flush()
+        self.afd.seek(self.offset)
+        self.dirty = False
+
+    def close(self):
+        """Writes index and closes archive
+
+        :return:
+        """
+        self.flush()
+        if self.afd is not None:
+            self.afd.close()
+            self.afd = None
+
+
+def create_output(filename, output, append=False):
+    """Creates object for `output` argument of `group_events`
+
+    :param filename: AnyStr log filename
+    :param output: None, ('stream', max open files, write buffer size,
+        result root directory), ('archive', buffer size, result root
+        directory) or ('dedup', number of stack frames in fingerprint)
+    :param append: keep results of previous run instead of deleting them
+    :return: OutputPool, ArchiveWriter, UniqueErrors or None
+    """
+    if not output:
+        return None
+    if output[0] == 'dedup':
+        return UniqueErrors(*output[1:])
+    if output[0] == 'archive':
+        writer = ArchiveWriter(filename, *output[1:], append=append)
+    else:
+        writer = OutputPool(filename, *output[1:], append=append)
+    if _STATS is not None:
+        return TimedOutput(writer, _STATS)
+    return writer
+
+
+class TimedOutput(object):
+    """Output which adds time spent in writes to statistics, used only when
+    statistics are collected
+
+    """
+    __slots__ = ('output', 'stats')
+
+    def __init__(self, output, stats):
+        self.output = output
+        self.stats = stats
+
+    def write(self, error, lines):
+        """See `OutputPool.write`
+
+        :param error: ErrorDescription
+        :param lines: list of bytes
+        :return:
+        """
+        start = time.time()
+        self.output.write(error, lines)
+        self.stats.write_seconds += time.time() - start
+
+    def flush(self):
+        """See `OutputPool.flush`
+
+        :return:
+        """
+        start = time.time()
+        self.output.flush()
+        self.stats.write_seconds += time.time() - start
+
+    def close(self):
+        """See `OutputPool.close`
+
+        :return:
+        """
+        start = time.time()
+        self.output.close()
+        self.stats.write_seconds += time.time() - start
+
+
+def save_grouped_errors(filename, grouped_errors, summary, append=False,
+                        root=None, archive=False):
+    """Creates directory with log file filename and writes each log
+    entry(caller) into separate file
+
+    :param filename: AnyStr
+    :param grouped_errors: dict
+    :param summary: dict
+    :param append: append to results of previous run instead of deleting them
+    :param root: bytes directory for result directories, CURRENT_DIR by
+        default
+    :param archive: write results to archive file, see `ArchiveWriter`
+    :return:
+    """
+    if archive:
+        print_summary(summary)
+        writer = ArchiveWriter(filename, root=root, append=append)
+        try:
+            writer.write_grouped(grouped_errors, summary)
+        finally:
+            writer.close()
+        return
+    result_dir = result_directory(filename, append, root)
+    print_summary(summary)
+    for key, value in grouped_errors.items():
+        with open(os.path.join(result_dir, key + b'.log'), 'ab') as dest_fd:
+            dest_fd.writelines(value)
+
+
+class ParseStats(object):
+    """Statistics of parsing log file or its range: bytes and lines read,
+    number of log entries and ignored log entries, time spent in parsing and
+    in writing results
+
+    """
+    __slots__ = ('bytes', 'lines', 'entries', 'ignored', 'seconds',
+                 'write_seconds')
+
+    def __init__(self):
+        self.bytes = 0
+        self.lines = 0
+        self.entries = 0
+        self.ignored = 0
+        self.seconds = 0.0
+        self.write_seconds = 0.0
+
+    def update(self, other):
+        """Adds counters of other ParseStats
+
+        :param other: ParseStats
+        :return:
+        """
+        for name in self.__slots__:
+            setattr(self, name, getattr(self, name) + getattr(other, name))
+
+    def as_dict(self):
+        """Statistics as json serializable dict
+
+        :return: dict
+        """
+        res = dict((name, getattr(self, name)) for name in self.__slots__)
+        res.update(
+            headers=self.entries + self.ignored,
+            parse_seconds=max(self.seconds - self.write_seconds, 0.0),
+            mb_per_sec=(self.bytes / self.seconds / 1024 / 1024
+                        if self.seconds else 0.0)
+        )
+        return res
+
+    @staticmethod
+    def from_dict(data):
+        """Constructs ParseStats from `as_dict` result
+
+        :param data: dict
+        :return: ParseStats
+        """
+        stats = ParseStats()
+        for name in stats.__slots__:
+            setattr(stats, name, data[name])
+        return stats
+
+
+def measure_task(args):
+    """Runs worker and collects statistics of its task. Used instead of
+    worker when statistics are collected
+
+    :param args: tuple worker, task, profile filename or None. Profile of
+        worker process is saved to <profile>.<pid>
+    :return: tuple worker result and ParseStats dict
+    """
+    global _STATS, _PROFILER
+    worker, task, profile = args
+    _STATS = stats = ParseStats()
+    start = time.time()
+    try:
+        if profile:
+            if _PROFILER is None:
+                _PROFILER = cProfile.Profile()
+            result = _PROFILER.runcall(worker, task)
+            _PROFILER.dump_stats('{0}.{1}'.format(profile, os.getpid()))
+        else:
+            result = worker(task)
+    finally:
+        _STATS = None
+    stats.seconds = time.time() - start
+    stats.entries = sum(result[1].values())
+    return result, stats.as_dict()
+
+
+def run_statistics(file_stats, seconds, jobs):
+    """Statistics of parse_files run
+
+    :param file_stats: dict filename: ParseStats
+    :param seconds: wall time of run
+    :param jobs: number of worker processes
+    :return: json serializable dict
+    """
+    total = ParseStats()
+    for stats in file_stats.values():
+        total.update(stats)
+    res = {
+        'files': dict((file_, stats.as_dict())
+                      for file_, stats in file_stats.items()),
+        'total': total.as_dict(),
+        'jobs': jobs,
+        'wall_seconds': seconds,
+        'wall_mb_per_sec': total.bytes / seconds / 1024 / 1024
+                           if seconds else 0.0,
+    }
+    if resource is not None:
+        res.update(
+            peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            workers_peak_rss_kb=resource.getrusage(
+                resource.RUSAGE_CHILDREN).ru_maxrss
+        )
+    return res
+
+
+def schedule_files(files, checkpoints=None):
+    """Orders log files for a pool of workers: the biggest files (the most
+    bytes to parse in incremental mode) first, so small files fill the gaps
+    while the last big files are parsed and no worker is left idle at the end
+
+    :param files: list of log filenames
+    :param checkpoints: dict filename: checkpoint dict in incremental mode
+    :return: list
+    """
+    def size(filename):
+        try:
+            file_size = os.path.getsize(filename)
+        except OSError:
+            return 0
+        data = checkpoints.get(filename) if checkpoints else None
+        if data and data['offset'] <= file_size:
+            file_size -= data['offset']
+        return file_size
+    return sorted(files, key=size, reverse=True)
+
+
+def call_indexed(args):
+    """Runs function and returns its result with index of its argument. Used
+    by worker processes, see `imap_ordered`
+
+    :param args: tuple function, index, argument
+    :return: tuple index, result
+    """
+    func, index, arg = args
+    return index, func(arg)
+
+
+def imap_ordered(pool, func, args, order):
+    """Submits arguments to pool in `order`, but yields results in order of
+    `args`. Results which are finished early are kept until all previous
+    results are yielded
+
+    :param pool: multiprocessing.Pool
+    :param func: function of worker processes
+    :param args: list of arguments
+    :param order: indexes of `args` in order of submission
+    :return: generator of results
+    """
+    finished = {}
+    next_index = 0
+    for index, result in pool.imap_unordered(
+            call_indexed, ((func, index, args[index]) for index in order)):
+        finished[index] = result
+        while next_index in finished:
+            yield finished.pop(next_index)
+            next_index += 1
+
+
+def parse_files(path, jobs=1, chunk_size=CHUNK_SIZE, incremental=False,
+                stream=False, max_open=MAX_OPEN_FILES,
+                buffering=WRITE_BUFFER_SIZE, dedup=False,
+                frames=FINGERPRINT_FRAMES, since=None, until=None, roots=None,
+                archive=False, stats=False, profile=None):
+    """Walks thru .log files in specified directory. Creates directory with
+    log file filename and each log entry(caller) is in separate file
+
+    Files are grouped in a pool of `jobs` worker processes, files bigger than
+    `chunk_size` are split into several ranges. Results are merged and
+    written in the same order as in serial mode so output does not depend on
+    the number of jobs.
+
+    In incremental mode only lines appended since previous run are parsed
+    and results are appended to results of previous run.
+
+    In streaming mode log entries are written as soon as they are closed,
+    so memory usage does not depend on number of errors. Files are not split
+    in this mode.
+
+    In dedup mode each unique log entry is written once with number of its
+    occurrences, see `UniqueErrors`. Streaming mode is not used with it. It
+    can not be used in incremental mode: counters of previous runs are not
+    kept, so every run would append another block of the same log entries.
+
+    If `since` or `until` is specified only log entries logged in this time
+    window are grouped. Time window is found by binary search in log files,
+    compressed log files are read up to `until`.
+
+    Log files of several directories share one pool of workers, in parallel
+    mode the biggest files are submitted first, see `schedule_files`, but
+    results are written in order of filenames like in serial mode.
+
+    :param path:  AnyStr directory or list of directories
+    :param jobs: number of worker processes, 0 - one per CPU core
+    :param chunk_size: size of file range for one worker in bytes
+    :param incremental: parse only lines appended since previous run,
+        compressed rotated log files are skipped in this mode because they
+        were parsed before rotation
+    :param stream: write log entries without keeping them in memory
+    :param max_open: max number of open result files in streaming mode
+    :param buffering: write buffer size in streaming mode
+    :param dedup: write unique log entries only
+    :param frames: number of stack frames in fingerprint of log entry
+    :param since: bytes, see `parse_time`. Not used in incremental mode
+    :param until: bytes, see `parse_time`. Not used in incremental mode
+    :param roots: dict directory: bytes directory for its result
+        directories, CURRENT_DIR by default
+    :param archive: write results of each log file to one archive file
+        instead of directory with file per caller, see `ArchiveWriter`
+    :param stats: collect statistics of each log file, see `ParseStats`
+    :param profile: save cProfile profile of run to this file and profiles
+        of worker processes to <profile>.<pid>
+    :return: dict statistics of run, see `run_statistics`, if `stats` is
+        True, None otherwise
+    """
+    if dedup and incremental:
+        raise ValueError('Dedup mode can not be used in incremental mode')
+    started = time.time()
+    roots = roots or {}
+    file_roots = dict(
+        (file_, roots.get(directory))
+        for directory in (path if isinstance(path, (list, tuple)) else [path])
+        for file_ in log_files(directory)
+    )
+    files = sorted(file_roots)
+    jobs = jobs or multiprocessing.cpu_count()
+
+    def output(filename):
+        if dedup:
+            return 'dedup', frames
+        if stream and archive:
+            return 'archive', ARCHIVE_BUFFER_SIZE, file_roots[filename]
+        if stream:
+            return 'stream', max_open, buffering, file_roots[filename]
+        return None
+    stream = stream and not dedup
+    checkpoints = None
+    if incremental:
+        checkpoints = load_checkpoints(STATE_FILE)
+        files = [file_ for file_ in files
+                 if os.path.isfile(file_) and not is_compressed(file_)]
+        tasks = [(file_, checkpoints.get(file_), output(file_))
+                 for file_ in files]
+        worker = group_errors_appended
+    else:
+        if jobs == 1 or stream:
+            chunk_size = 0
+        window = (since, until) if since or until else None
+        tasks = [(file_, start, end, output(file_), window) for file_ in files
+                 for start, end in split_file(file_, chunk_size, since, until)]
+        worker = group_errors_range
+
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+    measured = stats or profile
+    args = tasks
+    if measured:
+        # statistics are returned together with results of tasks
+        file_stats = defaultdict(ParseStats)
+        worker_profile = profile if pool else None
+        args = [(worker, task, worker_profile) for task in tasks]
+        worker = measure_task
+    if pool:
+        rank = dict((file_, index) for index, file_ in
+                    enumerate(schedule_files(files, checkpoints)))
+        order = sorted(range(len(tasks)), key=lambda i: rank[tasks[i][0]])
+        results = imap_ordered(pool, worker, args, order)
+    else:
+        results = (worker(arg) for arg in args)
+    results = zip(tasks, results)
+    if measured:
+        results = unpack_statistics(results, file_stats)
+    profiler = None
+    if profile:
+        # workers are already started, so they do not inherit the profiler
+        profiler = cProfile.Profile()
+        profiler.enable()
+    try:
+        for file_, file_results in itertools.groupby(
+                results, key=lambda item: item[0][0]):
+            print('Proccessing', file_, '...')
+            append = False
+            if checkpoints is not None:
+                _, (grouped_errors, summary, checkpoint) = next(file_results)
+                append = file_ in checkpoints
+                checkpoints[file_] = checkpoint
+            else:
+                grouped_errors, summary = merge_grouped_errors(
+                    result for _, result in file_results
+                )
+            if stream:
+                print_summary(summary)
+            elif grouped_errors:
+                start = time.time()
+                save_grouped_errors(file_, grouped_errors, summary, append,
+                                    file_roots[file_], archive)
+                if measured:
+                    seconds = time.time() - start
+                    file_stats[file_].write_seconds += seconds
+                    file_stats[file_].seconds += seconds
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(profile)
+        if pool:
+            pool.terminate()
+            pool.join()
+    if checkpoints is not None:
+        save_checkpoints(STATE_FILE, checkpoints)
+    if stats:
+        return run_statistics(file_stats, time.time() - started, jobs)
+    return None
+
+
+def unpack_statistics(results, file_stats):
+    """Separates statistics from results of `measure_task`
+
+    :param results: iterable of tuples task, (result, ParseStats dict)
+    :param file_stats: dict filename: ParseStats, statistics of tasks are
+        added to it
+    :return: generator of tuples task, result
+    """
+    for task, (result, data) in results:
+        file_stats[task[0]].update(ParseStats.from_dict(data))
+        yield task, result
+
+
+class ErrorSummary(object):
+    """Number of log entries by minute, level and caller class with datetime
+    of the first and the last log entry of each caller class. Stack traces
+    are not stored
+
+    """
+    __slots__ = ('counts', 'first', 'last')
+
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.first = {}
+        self.last = {}
+
+    def add(self, error):
+        """Counts log entry
+
+        :param error: ErrorDescription
+        :return:
+        """
+        key = error.caller_class
+        datetime = error.datetime
+        self.counts[(datetime[:16], error.level, key)] += 1
+        if key not in self.first or datetime < self.first[key]:
+            self.first[key] = datetime
+        if key not in self.last or datetime > self.last[key]:
+            self.last[key] = datetime
+
+    def update(self, other):
+        """Adds counters of other ErrorSummary
+
+        :param other: ErrorSummary
+        :return:
+        """
+        for key, value in other.counts.items():
+            self.counts[key] += value
+        for key, datetime in other.first.items():
+            if key not in self.first or datetime < self.first[key]:
+                self.first[key] = datetime
+        for key, datetime in other.last.items():
+            if key not in self.last or datetime > self.last[key]:
+                self.last[key] = datetime
+
+    def callers(self):
+        """Number of log entries by caller class
+
+        :return: dict
+        """
+        res = defaultdict(int)
+        for (_, _, key), value in self.counts.items():
+            res[key] += value
+        return res
+
+    def as_dict(self):
+        """Summary as json serializable dict: callers with count, first and
+        last datetime, number of log entries by level and by minute and level
+
+        :return: dict
+        """
+        levels = defaultdict(int)
+        minutes = defaultdict(lambda: defaultdict(int))
+        for (minute, level, _), value in self.counts.items():
+            levels[level.decode('latin-1')] += value
+            minutes[minute.decode('latin-1')][level.decode('latin-1')] += value
+        return {
+            'callers': dict(
+                (key.decode('latin-1'),
+                 {'count': value,
+                  'first': self.first[key].decode('latin-1'),
+                  'last': self.last[key].decode('latin-1')})
+                for key, value in self.callers().items()
+            ),
+            'levels': levels,
+            'minutes': minutes,
+        }
+
+    def rows(self):
+        """Rows for csv file: minute, level, caller class, number of log
+        entries, first and last datetime of caller class
+
+        :return: generator of tuples
+        """
+        for (minute, level, key), value in sorted(self.counts.items()):
+            yield (minute.decode('latin-1'), level.decode('latin-1'),
+                   key.decode('latin-1'), value,
+                   self.first[key].decode('latin-1'),
+                   self.last[key].decode('latin-1'))
+
+
+def summarize_range(task):
+    """Counts log entries in byte range of log file without storing their
+    lines. Used by worker processes
+
+    :param task: tuple (filename, start, end, window), see
+        `group_errors_range`
+    :return: ErrorSummary
+    """
+    filename, start, end, window = task
+    summary = ErrorSummary()
+    add = summary.add
+    window = window if end is None else None
+    for error, _ in iter_events(filename, start, end, *(window or ())):
+        add(error)
+    return summary
+
+
+def summarize_dirs(filename, *args, **kwargs):
+    """Counts log entries of log files in specified directories in a single
+    pass and saves summary as csv (if filename ends with .csv) or json
+
+    :param filename: AnyStr result filename or None
+    :param args: list of directories
+    :param kwargs: jobs, chunk_size, since and until, see `parse_files`
+    :return: OrderedDict log file -> ErrorSummary
+    """
+    jobs = kwargs.get('jobs', 1) or multiprocessing.cpu_count()
+    chunk_size = kwargs.get('chunk_size', CHUNK_SIZE) if jobs > 1 else 0
+    since = kwargs.get('since')
+    until = kwargs.get('until')
+    window = (since, until) if since or until else None
+    tasks = []
+    for directory in args:
+        print('Searching for log files in directory', directory)
+        tasks.extend((file_, start, end, window)
+                     for file_ in log_files(directory) if os.path.isfile(file_)
+                     for start, end in split_file(file_, chunk_size, since,
+                                                  until))
+
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap(summarize_range, tasks)
+    else:
+        results = (summarize_range(task) for task in tasks)
+    summaries = OrderedDict()
+    try:
+        for file_, file_results in itertools.groupby(
+                zip(tasks, results), key=lambda item: item[0][0]):
+            print('Proccessing', file_, '...')
+            summary = ErrorSummary()
+            for _, result in file_results:
+                summary.update(result)
+            print_summary(summary.callers())
+            summaries[file_] = summary
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+
+    if not filename:
+        return summaries
+    if filename.endswith('.csv'):
+        with open(filename, 'w') as csv_fd:
+            writer = csv.writer(csv_fd)
+            writer.writerow(('file', 'minute', 'level', 'caller', 'count',
+                             'first', 'last'))
+            for file_, summary in summaries.items():
+                writer.writerows((file_, ) + row for row in summary.rows())
+    else:
+        with open(filename, 'w') as json_fd:
+            json.dump(dict((file_, summary.as_dict())
+                           for file_, summary in summaries.items()),
+                      json_fd, indent=1, sort_keys=True)
+    print('Summary saved to', filename)
+    return summaries
+
+
+def process_dirs(*args, **kwargs):
+    """Parse log files in specified directories. Log files of all directories
+    are parsed by one pool of workers
+
+    :param args: list of directories
+    :param kwargs: options for parse_files
+    :return: `parse_files` result
+    """
+    directories = []
+    for directory in args:
+        if os.path.isdir(directory):
+            print('Searching for log files in directory', directory)
+            directories.append(directory)
+        else:
+            print('Directory', directory, 'is not a directory')
+    if directories:
+        return parse_files(directories, **kwargs)
+    return None
+
+
+def tomcat_instances():
+    """Mounted Scalix tomcat instances, found like in sxstats.sh
+
+    :return: list of tuples instance name, log directory
+    """
+    get_instances = os.path.join(SXTOMCAT_BIN,
+                                 'sxtomcat-get-mounted-instances')
+    get_inst_dir = os.path.join(SXTOMCAT_BIN, 'sxtomcat-get-inst-dir')
+    if not os.path.isfile(get_instances):
+        return []
+    instances = []
+    for instance in subprocess.check_output([get_instances]).split():
+        instance = instance.decode()
+        instance_dir = subprocess.check_output(
+            [get_inst_dir, instance]
+        ).strip().decode()
+        print('Found instance {0}. Instance folder {1}'.format(instance,
+                                                             instance_dir))
+        instances.append((instance, os.path.join(instance_dir, 'logs')))
+    return instances
+
+
+def instance_roots(instances):
+    """Result root directory of each instance log directory, results of
+    instance are saved in CURRENT_DIR/<instance>
+
+    :param instances: list of tuples, see `tomcat_instances`
+    :return: dict log directory: bytes result root directory
+    """
+    return dict((log_dir, os.path.join(CURRENT_DIR, instance.encode()))
+                for instance, log_dir in instances)
+
+
+class FollowedLog(object):
+    """Log file followed like with `tail -F`. Log entries are written to
+    output as soon as they are closed, rotated and truncated log files are
+    reopened
+
+    """
+    __slots__ = ('filename', 'output', 'lfd', 'inode', 'partial', 'pending',
+                 'updated')
+
+    def __init__(self, filename, output, from_start=False):
+        self.filename = filename
+        self.output = output
+        self.lfd = None
+        self.inode = None
+        self.partial = b''
+        self.pending = []
+        self.updated = time.time()
+        self.open(from_start)
+
+    def open(self, from_start=True):
+        """Opens log file
+
+        :param from_start: read log file from the beginning, otherwise only
+            lines appended after this call are read
+        :return:
+        """
+        try:
+            self.lfd = open(self.filename, 'rb')
+        except (IOError, OSError):
+            self.lfd = None
+            return
+        self.inode = os.fstat(self.lfd.fileno()).st_ino
+        if not from_start:
+            self.lfd.seek(0, os.SEEK_END)
+
+    def read(self, final=False):
+        """Groups lines appended to log file
+
+        :param final: log file is not written any more, so the last line
+            without line end is complete
+        :return: list of `group_events` results
+        """
+        results = []
+        while True:
+            data = self.lfd.read(FOLLOW_READ_SIZE)
+            if not data:
+                break
+            self.updated = time.time()
+            lines = (self.partial + data).splitlines(True)
+            self.partial = (lines.pop() if not lines[-1].endswith(b'\n')
+                            else b'')
+            results.append(group_events(
+                line_events(lines, pending=self.pending), self.output
+            ))
+        if final and self.partial:
+            results.append(group_events(
+                line_events([self.partial], pending=self.pending), self.output
+            ))
+            self.partial = b''
+        return results
+
+    def flush(self):
+        """Writes unfinished log entry
+
+        :return: `group_events` result
+        """
+        result = group_events(line_events(self.pending), self.output)
+        del self.pending[:]
+        return result
+
+    def poll(self):
+        """Reads new lines. If there are no new lines checks if log file was
+        rotated or truncated and writes unfinished log entry after
+        FOLLOW_FLUSH_TIMEOUT
+
+        :return: summary by caller class
+        """
+        if self.lfd is None:
+            self.open()
+            if self.lfd is None:
+                return {}
+        results = self.read()
+        if not results:
+            try:
+                stat = os.stat(self.filename)
+            except OSError:
+                stat = None
+            if stat is None or stat.st_ino != self.inode:
+                results.extend(self.read(True))
+                results.append(self.flush())
+                self.lfd.close()
+                self.open()
+            elif stat.st_size < self.lfd.tell():
+                print('Log file {0} was truncated'.format(self.filename))
+                results.append(self.flush())
+                self.lfd.seek(0)
+                self.partial = b''
+            elif (self.pending and
+                  time.time() - self.updated > FOLLOW_FLUSH_TIMEOUT):
+                results.append(self.flush())
+        self.output.flush()
+        return merge_grouped_errors(results)[1]
+
+    def close(self):
+        """Writes unfinished log entry and closes log and result files
+
+        :return: summary by caller class
+        """
+        summary = {}
+        if self.lfd is not None:
+            summary = merge_grouped_errors(self.read(True) +
+                                           [self.flush()])[1]
+            self.lfd.close()
+        self.output.close()
+        return summary
+
+
+def follow_dirs(*args, **kwargs):
+    """Follows log files in specified directories like `tail -F` and writes
+    log entries as soon as they are closed. Directories are polled with
+    interval from FOLLOW_MIN_INTERVAL up to FOLLOW_MAX_INTERVAL, so CPU is not
+    used while log files are idle. Runs until interrupted
+
+    :param args: list of directories
+    :param kwargs: max_open and buffering for OutputPool of each log file,
+        roots - dict directory: result root directory, archive - write
+        results to archive files, see `ArchiveWriter`
+    :return:
+    """
+    max_open = kwargs.get('max_open', MAX_OPEN_FILES)
+    buffering = kwargs.get('buffering', WRITE_BUFFER_SIZE)
+    roots = kwargs.get('roots') or {}
+    archive = kwargs.get('archive', False)
+    logs = OrderedDict()
+    interval = FOLLOW_MIN_INTERVAL
+    rescan = 0
+    try:
+        while True:
+            now = time.time()
+            if now >= rescan:
+                if reload_ignore_rules():
+                    print('Ignore rules were reloaded')
+                for directory in args:
+                    for file_ in log_files(directory):
+                        if file_ in logs or is_compressed(file_):
+                            continue
+                        print('Following', file_, '...')
+                        # log files created after start are read from the
+                        # beginning
+                        if archive:
+                            output = ArchiveWriter(file_,
+                                                   root=roots.get(directory),
+                                                   append=True)
+                        else:
+                            output = OutputPool(file_, max_open, buffering,
+                                                roots.get(directory),
+                                                append=True)
+                        logs[file_] = FollowedLog(file_, output,
+                                                  from_start=bool(rescan))
+                rescan = now + FOLLOW_RESCAN_INTERVAL
+            for file_, log in logs.items():
+                summary = log.poll()
+                if summary:
+                    print('Proccessing', file_, '...')
+                    print_summary(summary)
+            if any(log.updated >= now for log in logs.values()):
+                interval = FOLLOW_MIN_INTERVAL
+            else:
+                interval = min(interval * 2, FOLLOW_MAX_INTERVAL)
+            time.sleep(interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for file_, log in logs.items():
+            summary = log.close()
+            if summary:
+                print('Proccessing', file_, '...')
+                print_summary(summary)
+
+
+def timeline_dirs(*args, **kwargs):
+    """Prints log entries of all log files in specified directories merged
+    by datetime. Each log entry is prefixed with log filename. Ignore rules
+    are not applied, so the timeline is complete: use `levels` and `callers`
+    to filter it
+
+    :param args: list of directories
+    :param kwargs: levels and callers, see `filter_events`, since and until,
+        see `iter_events`, stacktrace - print whole log entries instead of
+        headers, out - binary file object, stdout by default
+    :return: number of printed log entries
+    """
+    out = kwargs.get('out') or getattr(sys.stdout, 'buffer', sys.stdout)
+    stacktrace = kwargs.get('stacktrace', True)
+    files = [file_ for directory in args for file_ in log_files(directory)]
+    names = [os.path.basename(file_).encode() + b': ' for file_ in files]
+    streams = [
+        filter_events(iter_events(file_, since=kwargs.get('since'),
+                                  until=kwargs.get('until'), ignore=False),
+                      kwargs.get('levels'), kwargs.get('callers'))
+        for file_ in files
+    ]
+    count = 0
+    for index, _, entry in merge_events(streams):
+        out.write(names[index])
+        if not stacktrace:
+            entry = bytes(entry).partition(b'\n')[0] + b'\n'
+        out.write(entry)
+        if entry[-1:] != b'\n':
+            out.write(b'\n')
+        count += 1
+    out.flush()
+    return count
+
+
+def log_head(filename, size=INDEX_HEAD_SIZE):
+    """Log name and fingerprint of the beginning of log file. It identifies
+    content of log file after logrotate renamed or compressed it, e.g.
+    catalina.log, catalina.log.1 and catalina.log.2.gz
+
+    :param filename: AnyStr
+    :param size: max number of bytes to fingerprint, log file which was
+        rotated before it grew to INDEX_HEAD_SIZE is identified by shorter
+        head
+    :return: str or None if log file is empty
+    """
+    with open_log(filename) as lfd:
+        data = lfd.read(size)
+    if not data:
+        return None
+    return '{0}:{1}:{2}'.format(os.path.basename(filename).split('.')[0],
+                                len(data), hashlib.sha1(data).hexdigest()[:16])
+
+
+def index_range(path, key, offset, final=False):
+    """Builds index rows for log entries of log file starting at offset
+
+    :param path: AnyStr log file
+    :param key: tuple (path, inode) saved in index rows
+    :param offset: offset of line start
+    :param final: log file is not written any more, so the last log entry is
+        indexed too. Otherwise it will be indexed by next run when it is
+        finished
+    :return: tuple rows, offset of the first log entry which is not indexed
+    """
+    rows = []
+    if is_compressed(path):
+        with open_log(path) as lfd:
+            lfd.seek(offset)
+            for error, start, lines in line_records(lfd, offset):
+                rows.append(index_row(key[0], key[1], error, start, lines))
+            return rows, lfd.tell()
+
+    with open(path, 'rb') as lfd:
+        size = os.fstat(lfd.fileno()).st_size
+        if size <= offset:
+            return rows, offset
+        mapped = mmap.mmap(lfd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            # the last line without line end may be written right now
+            end = size if final else \
+                mapped.rfind(b'\n', offset, size) + 1 or offset
+            for error, start, entry_end in mapped_records(mapped, offset, end):
+                if entry_end == end and not final:
+                    # the last log entry may be continued
+                    end = start
+                    break
+                lines = mapped[start:entry_end].splitlines(True)
+                rows.append(index_row(key[0], key[1], error, start, lines))
+            return rows, end
+        finally:
+            mapped.close()
+
+
+def index_file(task):
+    """Builds index rows for log entries added to live log file since
+    previous indexing. If it was rotated (inode was changed) the rest of
+    rotated file is indexed first, if it was already compressed the rest is
+    left to `index_rotated`. Used by worker processes
+
+    :param task: tuple (filename, (inode, size, offset, head) or None)
+    :return: tuple rows, new (inode, size, offset, head), `rotated` table
+        row (head, path, inode, offset, done) or None, True if rows of this
+        file should be deleted because it was truncated
+    """
+    filename, state = task
+    stat = os.stat(filename)
+    inode, size, offset, head = state or (0, 0, 0, None)
+    rows = []
+    rotated = None
+    truncated = False
+    if inode and inode != stat.st_ino:
+        path = find_file_by_inode(os.path.dirname(filename), inode)
+        if path:
+            print('Log file {0} was rotated to {1}'.format(filename, path))
+            head = log_head(path)
+            rows, offset = index_range(path, (filename, inode), offset, True)
+        if head:
+            rotated = (head, filename, inode, offset, bool(path))
+        offset = 0
+        head = None
+    elif stat.st_size < size:
+        truncated = True
+        offset = 0
+        head = None
+    appended, offset = index_range(filename, (filename, stat.st_ino), offset)
+    rows.extend(appended)
+    if not head or stat.st_size <= INDEX_HEAD_SIZE:
+        head = log_head(filename)
+    state = (stat.st_ino, stat.st_size, offset, head)
+    return rows, state, rotated, truncated
+
+
+def index_rotated(task):
+    """Builds index rows for compressed rotated log file. Log entries which
+    were indexed from the live log file are skipped, only the rest which was
+    not read before rotation is indexed. Used by worker processes
+
+    :param task: tuple (filename, head, `rotated` table row or None, `files`
+        table row (inode, size, offset, head) of this file saved by older
+        version or None)
+    :return: tuple rows, new `rotated` table row
+    """
+    filename, head, rotated, legacy = task
+    stat = os.stat(filename)
+    rows = []
+    if rotated is None:
+        offset = 0
+        if legacy is None or legacy[:2] != (stat.st_ino, stat.st_size):
+            rows, offset = index_range(filename, (filename, stat.st_ino), 0,
+                                       True)
+    elif not rotated[4]:
+        rows, offset = index_range(filename, (filename, stat.st_ino),
+                                   rotated[3], True)
+    else:
+        offset = rotated[3]
+    return rows, (head, filename, stat.st_ino, offset, True)
+
+
+def index_row(filename, inode, error, offset, lines):
+    """Row of `errors` table
+
+    :param filename: AnyStr
+    :param inode: int
+    :param error: ErrorDescription
+    :param offset: int
+    :param lines: lines of log entry
+    :return: tuple
+    """
+    return (filename, inode, offset, sum(len(line) for line in lines),
+            error.datetime.decode('latin-1'), error.level.decode('latin-1'),
+            error.caller.decode('latin-1'),
+            error.caller_class.decode('latin-1'), fingerprint(error, lines))
+
+
+def update_index(database, *args, **kwargs):
+    """Adds log entries of log files in specified directories to SQLite
+    index. Only log entries added since previous run are parsed. Rotated
+    log files are indexed after live ones, so log entries of live log file
+    are not indexed again when logrotate renames or compresses it
+
+    :param database: AnyStr SQLite database filename
+    :param args: list of directories
+    :param kwargs: jobs - number of worker processes, 0 - one per CPU core
+    :return:
+    """
+    jobs = kwargs.get('jobs', 1) or multiprocessing.cpu_count()
+    conn = sqlite3.connect(database)
+    conn.executescript(INDEX_SCHEMA)
+    if 'head' not in [row[1] for row in
+                      conn.execute('PRAGMA table_info(files)')]:
+        conn.execute('ALTER TABLE files ADD COLUMN head TEXT')
+    states = dict(
+        (row[0], row[1:]) for row in
+        conn.execute('SELECT path, inode, size, offset, head FROM files')
+    )
+    live = []
+    compressed = []
+    for directory in args:
+        print('Searching for log files in directory', directory)
+        for file_ in log_files(directory):
+            if os.path.isfile(file_):
+                (compressed if is_compressed(file_) else live).append(file_)
+
+    pool = None
+    try:
+        tasks = [(file_, states.get(file_)) for file_ in live]
+        if jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap(index_file, tasks) if pool else \
+            (index_file(task) for task in tasks)
+        for file_, (rows, state, rotated, truncated) in zip(live, results):
+            with conn:
+                if truncated:
+                    print('Log file {0} was truncated'.format(file_))
+                    conn.execute('DELETE FROM errors WHERE path = ? AND '
+                                 'inode = ?', (file_, state[0]))
+                conn.executemany('INSERT INTO errors VALUES (?, ?, ?, ?, ?, '
+                                 '?, ?, ?, ?)', rows)
+                conn.execute('INSERT OR REPLACE INTO files VALUES '
+                             '(?, ?, ?, ?, ?)', (file_, ) + state)
+                if rotated:
+                    conn.execute('INSERT OR REPLACE INTO rotated VALUES '
+                                 '(?, ?, ?, ?, ?)', rotated)
+            print('Indexed {0} log entries of {1}'.format(len(rows), file_))
+
+        rotated = dict(
+            (row[0], row) for row in
+            conn.execute('SELECT head, path, inode, offset, done FROM rotated')
+        )
+        sizes = set(int(head.split(':')[-2]) for head in rotated)
+        sizes.add(INDEX_HEAD_SIZE)
+        tasks = []
+        for file_ in compressed:
+            heads = [log_head(file_, size) for size in sorted(sizes)]
+            head = next((head for head in heads if head in rotated),
+                        heads[-1])
+            if head:
+                tasks.append((file_, head, rotated.get(head),
+                              states.get(file_)))
+        if pool is None and jobs > 1 and len(tasks) > 1:
+            pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap(index_rotated, tasks) if pool else \
+            (index_rotated(task) for task in tasks)
+        for (file_, head, previous, _), (rows, row) in zip(tasks, results):
+            with conn:
+                if previous and previous[1:3] != row[1:3]:
+                    # rows of log entries follow renamed log file
+                    conn.execute('UPDATE errors SET path = ?, inode = ? '
+                                 'WHERE path = ? AND inode = ?',
+                                 row[1:3] + previous[1:3])
+                conn.executemany('INSERT INTO errors VALUES (?, ?, ?, ?, ?, '
+                                 '?, ?, ?, ?)', rows)
+                conn.execute('INSERT OR REPLACE INTO rotated VALUES '
+                             '(?, ?, ?, ?, ?)', row)
+                conn.execute('DELETE FROM files WHERE path = ?', (file_, ))
+            print('Indexed {0} log entries of {1}'.format(len(rows), file_))
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        conn.close()
+
+
+def read_entry(path, inode, offset, length):
+    """Reads log entry from log file. If log file was rotated, rotated log
+    file is searched by inode
+
+    :param path: AnyStr
+    :param inode: int
+    :param offset: int
+    :param length: int
+    :return: bytes or None if log file does not exist any more
+    """
+    if not os.path.isfile(path) or os.stat(path).st_ino != inode:
+        path = find_file_by_inode(os.path.dirname(path), inode)
+        if not path:
+            return None
+    with open_log(path) as lfd:
+        lfd.seek(offset)
+        return lfd.read(length)
+
+
+def query_index(database, caller=None, level=None, since=None, until=None,
+                top=None, group_by='caller_class', stacktrace=False,
+                limit=None):
+    """Prints log entries from SQLite index
+
+    :param database: AnyStr SQLite database filename
+    :param caller: caller class or caller
+    :param level: log level
+    :param since: bytes, see `parse_time`
+    :param until: bytes, see `parse_time`
+    :param top: print `top` values of `group_by` column with the most log
+        entries instead of log entries
+    :param group_by: column for `top`
+    :param stacktrace: print log entries read from log files
+    :param limit: max number of log entries
+    :return:
+    """
+    conditions = []
+    params = []
+    if caller:
+        conditions.append('(caller_class = ? OR caller = ?)')
+        params.extend((caller, caller))
+    if level:
+        conditions.append('level = ?')
+        params.append(level)
+    if since:
+        conditions.append('datetime >= ?')
+        params.append(since.decode())
+    if until:
+        conditions.append('datetime < ?')
+        params.append(until.decode())
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    conn = sqlite3.connect(database)
+    try:
+        if top:
+            query = ('SELECT {0}, COUNT(*) FROM errors{1} GROUP BY {0} '
+                     'ORDER BY 2 DESC LIMIT ?'.format(group_by, where))
+            for value, count in conn.execute(query, params + [top]):
+                print('{0}\t{1}'.format(count, value))
+            return
+        query = ('SELECT path, inode, offset, length, datetime, level, caller '
+                 'FROM errors{0} ORDER BY datetime'.format(where))
+        if limit:
+            query += ' LIMIT {0:d}'.format(limit)
+        for path, inode, offset, length, datetime, level_, caller_ in \
+                conn.execute(query, params):
+            if not stacktrace:
+                print('{0} [{1}] [{2}] {3}:{4}'.format(datetime, level_,
+                                                       caller_, path, offset))
+                continue
+            entry = read_entry(path, inode, offset, length)
+            if entry is None:
+                print('{0} [{1}] [{2}] {3}:{4} log file does not exist '
+                      'any more'.format(datetime, level_, caller_, path,
+                                        offset))
+                continue
+            print(entry.decode('latin-1'), end='')
+    finally:
+        conn.close()
+
+
+def list_archive(filename):
+    """Prints caller classes in archive with number of log entries and size
+
+    :param filename: AnyStr archive filename
+    :return:
+    """
+    with open(filename, 'rb') as afd:
+        index, _ = read_archive_index(afd)
+    for key in sorted(index):
+        print('{0}\t{1}\t{2}'.format(
+            index[key]['entries'],
+            sum(size for _, size in index[key]['segments']),
+            key.decode('latin-1')
+        ))
+
+
+def extract_archive(filename, callers=None, directory=None):
+    """Prints log entries of caller classes from archive or writes them into
+    <caller class>.log files like in directory output
+
+    :param filename: AnyStr archive filename
+    :param callers: list of caller classes (bytes), all by default
+    :param directory: AnyStr directory for extracted files. Log entries are
+        printed if it is not specified
+    :return:
+    """
+    with open(filename, 'rb') as afd:
+        index, _ = read_archive_index(afd)
+        for key in sorted(index) if callers is None else callers:
+            if key not in index:
+                raise KeyError('Caller {0} is not in archive {1}'.format(
+                    key.decode('latin-1'), filename))
+            dest_fd = None
+            if directory is not None:
+                dest_fd = open(os.path.join(directory, key + b'.log'), 'wb')
+            try:
+                for offset, size in index[key]['segments']:
+                    afd.seek(offset)
+                    while size > 0:
+                        data = afd.read(min(size, ARCHIVE_BUFFER_SIZE))
+                        if not data:
+                            break
+                        size -= len(data)
+                        if dest_fd is None:
+                            print(data.decode('latin-1'), end='')
+                        else:
+                            dest_fd.write(data)
+            finally:
+                if dest_fd is not None:
+                    dest_fd.close()
+
+
+def get_config_file(filename):
+    """Get absolute filename for existing config filename
+
+    :param filename: AnyStr
+    :return:
+    """
+    for config_path in CONFIG_PATH:
+        conf_file = os.path.join(config_path, filename)
+        if not os.path.isfile(conf_file):
+            continue
+        return conf_file
+
+
+def ignore_config_source():
+    """Config files with ignore rules and their modification times
+
+    :return: tuple of tuples (config file or None, mtime or None) in order of
+        IGNORE_CONFIG_FILES
+    """
+    source = []
+    for filename in IGNORE_CONFIG_FILES:
+        conf_file = get_config_file(filename)
+        try:
+            mtime = conf_file and os.path.getmtime(conf_file)
+        except OSError:
+            conf_file = mtime = None
+        source.append((conf_file, mtime))
+    return tuple(source)
+
+
+def load_ignore_list():
+    """Reads ignore rules from config files and compiles them together with
+    `IGNORE_LEVELS` and `IGNORE_CALLERS`
+
+    :return: IgnoreRules
+    """
+    global _IGNORE_RULES
+    source = ignore_config_source()
+    levels, callers = list(IGNORE_LEVELS), list(IGNORE_CALLERS)
+    for (conf_file, _), dest in zip(source, (levels, callers)):
+        if not conf_file:
+            continue
+        with open(conf_file, "rb") as conf_fd:
+            dest.extend(conf_fd.read().splitlines())
+    _IGNORE_RULES = IgnoreRules(levels, callers, source)
+    return _IGNORE_RULES
+
+
+def reload_ignore_rules():
+    """Compiles ignore rules again if config files were created, changed or
+    deleted since rules were loaded
+
+    :return: boolean, True if rules were reloaded
+    """
+    if _IGNORE_RULES is None or _IGNORE_RULES.source == ignore_config_source():
+        return False
+    load_ignore_list()
+    return True
+
+
+def parse_command(argv):
+    """Groups log entries of tomcat log files, see `--help`
+
+    :param argv: command line arguments
+    :return:
+    """
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('directories', nargs='*',
+                        help='Directories with tomcat log files. Current '
+                             'directory is used by default')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes. 0 - one per CPU '
+                             'core, 1 - serial mode (default)')
+    parser.add_argument('--chunk-size', type=int,
+                        default=CHUNK_SIZE // (1024 * 1024),
+                        help='In parallel mode log files bigger than this '
+                             'size in MB are split and parsed by several '
+                             'workers. 0 - do not split files')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Parse only lines appended since previous run '
+                             'and append them to results of previous run')
+    parser.add_argument('--stream', action='store_true',
+                        help='Write log entries as soon as they are parsed '
+                             'instead of keeping them in memory')
+    parser.add_argument('--max-open-files', type=int, default=MAX_OPEN_FILES,
+                        help='Max number of open result files in streaming '
+                             'mode')
+    parser.add_argument('--write-buffer', type=int,
+                        default=WRITE_BUFFER_SIZE // 1024,
+                        help='Write buffer size in KB of result files in '
+                             'streaming mode')
+    parser.add_argument('--dedup', action='store_true',
+                        help='Write each unique log entry once with number '
+                             'of occurrences, first and last datetime')
+    parser.add_argument('--dedup-frames', type=int, default=FINGERPRINT_FRAMES,
+                        help='Number of top stack frames which identify '
+                             'unique log entry')
+    parser.add_argument('--follow', '-f', action='store_true',
+                        help='Follow log files like `tail -F` and write log '
+                             'entries as soon as they are logged')
+    parser.add_argument('--index', metavar='DATABASE',
+                        help='Add log entries to SQLite index instead of '
+                             'grouping them. Use `query` command to search '
+                             'in index')
+    parser.add_argument('--summary', metavar='FILENAME',
+                        help='Only count log entries by caller, level and '
+                             'minute in a single pass and save counters as '
+                             'csv (if FILENAME ends with .csv) or json')
+    parser.add_argument('--since', type=parse_time,
+                        help='Group only log entries logged at or after this '
+                             'time: YYYY-MM-DD[ HH:MM[:SS]] or relative to '
+                             'now -Nm, -Nh, -Nd')
+    parser.add_argument('--until', type=parse_time,
+                        help='Group only log entries logged before this time, '
+                             'same format as --since')
+    parser.add_argument('--archive', action='store_true',
+                        help='Save results of each log file in one '
+                             '<log file>.archive file instead of directory '
+                             'with file per caller. Use `archive` command to '
+                             'list or extract callers')
+    parser.add_argument('--stats', metavar='FILENAME',
+                        help='Save statistics of each log file and of whole '
+                             'run as json: bytes, lines, log entries, ignored '
+                             'log entries, time of parsing and writing, '
+                             'MB/sec and peak RSS. - prints them')
+    parser.add_argument('--profile', metavar='FILENAME',
+                        help='Save cProfile profile of run to FILENAME and '
+                             'profiles of worker processes to FILENAME.<pid>')
+    parser.add_argument('--all-instances', action='store_true',
+                        help='Parse log directories of all mounted Scalix '
+                             'tomcat instances instead of specified '
+                             'directories. Results of each instance are saved '
+                             'in its own directory')
+    cmd_args = parser.parse_args(argv)
+    if (cmd_args.since or cmd_args.until) and (cmd_args.incremental or
+                                               cmd_args.follow or
+                                               cmd_args.index):
+        parser.error('--since and --until can not be used with --incremental, '
+                     '--follow or --index')
+    if cmd_args.dedup and cmd_args.incremental:
+        parser.error('--dedup can not be used with --incremental')
+    if (cmd_args.stats or cmd_args.profile) and (cmd_args.follow or
+                                                 cmd_args.index or
+                                                 cmd_args.summary):
+        parser.error('--stats and --profile can not be used with --follow, '
+                     '--index or --summary')
+    directories = cmd_args.directories or [os.getcwd()]
+    roots = None
+    if cmd_args.all_instances:
+        instances = tomcat_instances()
+        if not instances:
+            parser.error('No mounted tomcat instances found')
+        directories = [log_dir for _, log_dir in instances]
+        roots = instance_roots(instances)
+    if cmd_args.summary:
+        summarize_dirs(cmd_args.summary, *directories,
+                       jobs=cmd_args.jobs,
+                       chunk_size=cmd_args.chunk_size * 1024 * 1024,
+                       since=cmd_args.since, until=cmd_args.until)
+    elif cmd_args.index:
+        update_index(cmd_args.index, *directories, jobs=cmd_args.jobs)
+    elif cmd_args.follow:
+        follow_dirs(*directories, max_open=cmd_args.max_open_files,
+                    buffering=cmd_args.write_buffer * 1024, roots=roots,
+                    archive=cmd_args.archive)
+    else:
+        run_stats = process_dirs(
+            *directories, roots=roots, archive=cmd_args.archive,
+            jobs=cmd_args.jobs, chunk_size=cmd_args.chunk_size * 1024 * 1024,
+            incremental=cmd_args.incremental, stream=cmd_args.stream,
+            max_open=cmd_args.max_open_files,
+            buffering=cmd_args.write_buffer * 1024,
+            dedup=cmd_args.dedup, frames=cmd_args.dedup_frames,
+            since=cmd_args.since, until=cmd_args.until,
+            stats=bool(cmd_args.stats), profile=cmd_args.profile
+        )
+        if cmd_args.stats == '-':
+            print(json.dumps(run_stats, indent=1, sort_keys=True))
+        elif cmd_args.stats and run_stats:
+            with open(cmd_args.stats, 'w') as stats_fd:
+                json.dump(run_stats, stats_fd, indent=1, sort_keys=True)
+
+
+def query_command(argv):
+    """Searches log entries in SQLite index, see `query --help`
+
+    :param argv: command line arguments
+    :return:
+    """
+    parser = argparse.ArgumentParser(prog='parse_tomcat_logs.py query',
+                                     add_help=True)
+    parser.add_argument('--index', metavar='DATABASE', required=True,
+                        help='SQLite index created with --index option')
+    parser.add_argument('--caller',
+                        help='Caller class or caller, e.g. MapiFactory or '
+                             'MapiFactory.create')
+    parser.add_argument('--level', help='Log level, e.g. ERROR')
+    parser.add_argument('--since', type=parse_time,
+                        help='Log entries logged at or after this time: '
+                             'YYYY-MM-DD[ HH:MM[:SS]], today, yesterday or '
+                             'relative to now -Nm, -Nh, -Nd')
+    parser.add_argument('--until', type=parse_time,
+                        help='Log entries logged before this time, same '
+                             'format as --since')
+    parser.add_argument('--top', type=int, metavar='N',
+                        help='Show N callers with the most log entries '
+                             'instead of log entries')
+    parser.add_argument('--group-by', default='caller_class',
+                        choices=('caller_class', 'caller', 'level',
+                                 'fingerprint'),
+                        help='Column for --top')
+    parser.add_argument('--stacktrace', action='store_true',
+                        help='Print log entries read from log files')
+    parser.add_argument('--limit', type=int,
+                        help='Max number of log entries')
+    cmd_args = parser.parse_args(argv)
+    try:
+        query_index(cmd_args.index, caller=cmd_args.caller,
+                    level=cmd_args.level, since=cmd_args.since,
+                    until=cmd_args.until, top=cmd_args.top,
+                    group_by=cmd_args.group_by,
+                    stacktrace=cmd_args.stacktrace, limit=cmd_args.limit)
+    except IOError as exc:
+        # output is piped to `head` or `less` which was closed
+        if exc.errno != errno.EPIPE:
+            raise
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def timeline_command(argv):
+    """Prints log entries of all log files merged by datetime, see
+    `timeline --help`
+
+    :param argv: command line arguments
+    :return:
+    """
+    parser = argparse.ArgumentParser(prog='parse_tomcat_logs.py timeline',
+                                     add_help=True)
+    parser.add_argument('directories', nargs='*',
+                        help='Directories with tomcat log files. Current '
+                             'directory is used by default')
+    parser.add_argument('--level', action='append',
+                        help='Only log entries with this level, e.g. ERROR. '
+                             'Can be repeated')
+    parser.add_argument('--caller', action='append',
+                        help='Only log entries of this caller class or '
+                             'caller, e.g. MapiFactory or MapiFactory.create. '
+                             'Can be repeated')
+    parser.add_argument('--since', type=parse_time,
+                        help='Log entries logged at or after this time: '
+                             'YYYY-MM-DD[ HH:MM[:SS]], today, yesterday or '
+                             'relative to now -Nm, -Nh, -Nd')
+    parser.add_argument('--until', type=parse_time,
+                        help='Log entries logged before this time, same '
+                             'format as --since')
+    parser.add_argument('--no-stacktrace', action='store_true',
+                        help='Print only the first line of log entries')
+    cmd_args = parser.parse_args(argv)
+    try:
+        timeline_dirs(*cmd_args.directories or [os.getcwd()],
+                      levels=set(level.upper().encode()
+                                 for level in cmd_args.level or ()),
+                      callers=set(caller.encode()
+                                  for caller in cmd_args.caller or ()),
+                      since=cmd_args.since, until=cmd_args.until,
+                      stacktrace=not cmd_args.no_stacktrace)
+    except IOError as exc:
+        # output is piped to `head` or `less` which was closed
+        if exc.errno != errno.EPIPE:
+            raise
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+
+
+def archive_command(argv):
+    """Lists or extracts caller classes of archive, see `archive --help`
+
+    :param argv: command line arguments
+    :return:
+    """
+    parser = argparse.ArgumentParser(prog='parse_tomcat_logs.py archive',
+                                     add_help=True)
+    parser.add_argument('archive',
+                        help='Archive created with --archive option')
+    parser.add_argument('callers', nargs='*',
+                        help='Caller classes to print, e.g. MapiFactory. '
+                             'Caller classes with number of log entries and '
+                             'size in bytes are listed by default')
+    parser.add_argument('--output', '-o', metavar='DIRECTORY',
+                        help='Extract caller classes (all by default) into '
+                             '<caller class>.log files in DIRECTORY')
+    cmd_args = parser.parse_args(argv)
+    callers = [caller.encode() for caller in cmd_args.callers] or None
+    try:
+        if cmd_args.output:
+            if not os.path.isdir(cmd_args.output):
+                os.makedirs(cmd_args.output)
+            extract_archive(cmd_args.archive, callers,
+                            cmd_args.output.encode())
+        elif callers:
+            extract_archive(cmd_args.archive, callers)
+        else:
+            list_archive(cmd_args.archive)
+    except (IOError, OSError, KeyError, ValueError) as exc:
+        parser.error(exc.args[0] if isinstance(exc, KeyError) else str(exc))
 
 
-load_ignore_list()
+COMMANDS = {
+    'query': query_command,
+    'archive': archive_command,
+    'timeline': timeline_command,
+}
 
 if __name__ == '__main__':
-    process_dirs(*sys.argv[1:] or [os.getcwd()])
+    if sys.argv[1:2] and sys.argv[1] in COMMANDS:
+        COMMANDS[sys.argv[1]](sys.argv[2:])
+    else:
+        parse_command(sys.argv[1:])
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Tests of parse_tomcat_logs.py: parallel, chunked and streaming modes must
+write the same results as serial mode. Run with
+python -m unittest test_parse_tomcat_logs
+
+"""
+from __future__ import unicode_literals, with_statement, print_function
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+import benchmark
+
+SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      'parse_tomcat_logs.py')
+
+
+class ParseFilesTest(unittest.TestCase):
+    """Results of parse_tomcat_logs.py in different modes. Results are saved
+    next to the script, so it is copied to temporary directory for each run
+
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        cls.logs = tempfile.mkdtemp()
+        # names are not in order of sizes, so parallel mode parses
+        # scalix-api.log first
+        for name, size, seed in (('catalina.log', 200 * 1024, 1),
+                                 ('localhost.log', 600 * 1024, 2),
+                                 ('scalix-api.log', 3 * 1024 * 1024, 3)):
+            benchmark.generate_log(os.path.join(cls.logs, name), size,
+                                   seed=seed)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.logs)
+
+    def setUp(self):
+        self.runs = []
+
+    def tearDown(self):
+        for directory in self.runs:
+            shutil.rmtree(directory)
+
+    def run_parser(self, *args):
+        """Runs copy of parse_tomcat_logs.py on test logs
+
+        :param args: command line options
+        :return: tuple stdout, dict relative filename: sha1 of results
+        """
+        directory = tempfile.mkdtemp()
+        self.runs.append(directory)
+        script = os.path.join(directory, 'parse_tomcat_logs.py')
+        shutil.copy(SCRIPT, script)
+        stdout = subprocess.check_output(
+            [sys.executable, script, self.logs] + list(args)
+        )
+        results = {}
+        for root, _, names in os.walk(directory):
+            for name in names:
+                filename = os.path.join(root, name)
+                if name.startswith('parse_tomcat_logs.py') or \
+                        '__pycache__' in filename:
+                    continue
+                with open(filename, 'rb') as result_fd:
+                    results[os.path.relpath(filename, directory)] = \
+                        hashlib.sha1(result_fd.read()).hexdigest()
+        return stdout, results
+
+    def test_jobs(self):
+        stdout, results = self.run_parser()
+        self.assertTrue(results)
+        self.assertEqual(self.run_parser('--jobs', '4'), (stdout, results))
+
+    def test_chunks(self):
+        _, results = self.run_parser()
+        self.assertEqual(
+            self.run_parser('--jobs', '4', '--chunk-size', '1')[1], results
+        )
+
+    def test_stream(self):
+        _, results = self.run_parser()
+        self.assertEqual(
+            self.run_parser('--stream', '--max-open-files', '3')[1], results
+        )
+
+    def test_last_entry(self):
+        logs = tempfile.mkdtemp()
+        self.runs.append(logs)
+        with open(os.path.join(logs, 'catalina.log'), 'wb') as log_fd:
+            log_fd.write(
+                b'2016-04-12 10:00:00.000 [ERROR] [http-8080-1] '
+                b'[Foo.bar:1] first\n'
+                b'2016-04-12 10:00:01.000 [ERROR] [http-8080-1] '
+                b'[Foo.bar:1] last\n'
+                b'java.lang.IllegalStateException: last\n'
+                b'\tat com.scalix.Foo.bar(Foo.java:1)\n'
+            )
+        for args in ([], ['--jobs', '2', '--chunk-size', '1'], ['--stream']):
+            directory = tempfile.mkdtemp()
+            self.runs.append(directory)
+            script = os.path.join(directory, 'parse_tomcat_logs.py')
+            shutil.copy(SCRIPT, script)
+            subprocess.check_output([sys.executable, script, logs] + args)
+            with open(os.path.join(directory, 'catalina.log',
+                                   'Foo.log'), 'rb') as result_fd:
+                self.assertTrue(result_fd.read().endswith(
+                    b'\tat com.scalix.Foo.bar(Foo.java:1)\n'
+                ), args)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,714 @@
+#!/usr/bin/env python
+# -*- coding: UTF-8 -*-
+"""Module to analyze request latency in tomcat access logs written by
+AccessLogValve with response time (%D or %T)
+
+"""
+from __future__ import unicode_literals, with_statement, print_function
+import argparse
+import contextlib
+import csv
+import datetime
+import glob
+import itertools
+import json
+import math
+import mmap
+import multiprocessing
+import os
+import re
+import sys
+from collections import defaultdict
+
+from parse_tomcat_logs import (CHUNK_SIZE, is_compressed, mapped_lines,
+                               open_log)
+
+# access logs of AccessLogValve, e.g. localhost_access_log.2016-04-12.txt
+ACCESS_LOG_PATTERNS = ('*access_log*', )
+
+# default AccessLogValve pattern with response time in milliseconds
+DEFAULT_PATTERN = '%h %l %u %t "%r" %s %b %D'
+
+PATTERN_ALIASES = {
+    'common': '%h %l %u %t "%r" %s %b',
+    'combined': '%h %l %u %t "%r" %s %b "%{Referer}i" "%{User-Agent}i"',
+}
+
+# regular expressions of AccessLogValve pattern codes, named groups are used
+# by AccessLogFormat
+FIELD_EXPRS = {
+    'D': r'(?P<duration>\d+)',
+    'T': r'(?P<seconds>\d+(?:\.\d+)?)',
+    'U': r'(?P<url>\S+)',
+    'm': r'(?P<method>\S+)',
+    'q': r'(?P<query>\S*)',
+    'r': r'(?P<request>.*?)',
+    's': r'(?P<status>\S+)',
+    't': r'\[(?P<time>[^\]]+)\]',
+}
+
+MONTHS = dict((name.encode(), '{0:02d}'.format(index).encode())
+              for index, name in enumerate(('Jan', 'Feb', 'Mar', 'Apr', 'May',
+                                            'Jun', 'Jul', 'Aug', 'Sep', 'Oct',
+                                            'Nov', 'Dec'), 1))
+
+# path segments replaced with {id} in URL patterns: numbers, hex ids, uuids
+# and email addresses
+ID_SEGMENT_EXPR = re.compile(
+    r'^(?:\d+|[0-9a-fA-F-]{8,}|[^@]+@[^@]+)$'.encode()
+)
+
+# query parameters kept in URL patterns, e.g. ActiveSync command
+KEEP_QUERY_PARAMS = (b'Cmd', )
+
+# max number of distinct URL patterns, requests of other URLs are counted
+# as OTHER_PATTERN
+MAX_URL_PATTERNS = 1000
+OTHER_PATTERN = b'(other)'
+
+# max number of cached URL patterns of raw URLs
+URL_CACHE_SIZE = 64 * 1024
+
+# relative accuracy of quantiles and max number of buckets of LatencySketch
+SKETCH_ACCURACY = 0.01
+SKETCH_MAX_BUCKETS = 2048
+SKETCH_GAMMA = (1 + SKETCH_ACCURACY) / (1 - SKETCH_ACCURACY)
+SKETCH_MULTIPLIER = 1 / math.log(SKETCH_GAMMA)
+
+QUANTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+# columns of csv file
+ROW_FIELDS = (('minute', 'url', 'status', 'count', 'mean') +
+              tuple(name for name, _ in QUANTILES) + ('max', ))
+
+# AccessLogValve writes requests when they complete with time of their start,
+# so minutes are closed when requests of CLOSE_DELAY minutes later are merged
+CLOSE_DELAY = 60
+
+
+class LatencySketch(object):
+    """Mergeable quantile sketch with relative accuracy like DDSketch. Each
+    value is counted in bucket ceil(log(value, gamma)), so quantile is
+    returned with SKETCH_ACCURACY relative error. Number of buckets grows
+    with logarithm of value range only and is limited by SKETCH_MAX_BUCKETS,
+    the lowest buckets are merged when the limit is reached. Sketches are
+    merged by adding bucket counters
+
+    """
+    __slots__ = ('counts', 'zeros', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = {}
+        self.zeros = 0
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, value):
+        """Adds value
+
+        :param value: float, milliseconds
+        :return:
+        """
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zeros += 1
+            return
+        index = int(math.ceil(math.log(value) * SKETCH_MULTIPLIER))
+        counts = self.counts
+        counts[index] = counts.get(index, 0) + 1
+        if len(counts) > SKETCH_MAX_BUCKETS:
+            self._collapse()
+
+    def _collapse(self):
+        indexes = sorted(self.counts)
+        low = indexes[:len(indexes) - SKETCH_MAX_BUCKETS + 1]
+        self.counts[low[-1]] = sum(self.counts.pop(index) for index in low)
+
+    def update(self, other):
+        """Adds values of other LatencySketch
+
+        :param other: LatencySketch
+        :return:
+        """
+        counts = self.counts
+        for index, value in other.counts.items():
+            counts[index] = counts.get(index, 0) + value
+        self.zeros += other.zeros
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+        if len(counts) > SKETCH_MAX_BUCKETS:
+            self._collapse()
+
+    def quantile(self, quantile):
+        """Value of quantile
+
+        :param quantile: float from 0 to 1
+        :return: float
+        """
+        if not self.count:
+            return 0.0
+        rank = quantile * (self.count - 1)
+        seen = self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen > rank:
+                return min(2 * SKETCH_GAMMA ** index / (SKETCH_GAMMA + 1),
+                           self.max)
+        return self.max
+
+    def as_dict(self):
+        """Number of requests, mean, quantiles and max in milliseconds
+
+        :return: dict
+        """
+        res = {'count': self.count,
+               'mean': round(self.total / self.count, 3) if self.count else 0,
+               'max': self.max}
+        for name, quantile in QUANTILES:
+            res[name] = round(self.quantile(quantile), 3)
+        return res
+
+
+class AccessLogFormat(object):
+    """Regular expression built from AccessLogValve pattern
+
+    """
+    __slots__ = ('expr', 'request', 'method', 'seconds', 'scale')
+
+    def __init__(self, pattern=DEFAULT_PATTERN, unit='ms'):
+        pattern = PATTERN_ALIASES.get(pattern, pattern)
+        parts = []
+        names = set()
+        for literal, header, code in re.findall(
+                r'([^%]*)(?:%(?:\{([^}]*)\})?(\w|%))?', pattern):
+            parts.append(re.escape(literal))
+            if not code:
+                continue
+            if code == '%':
+                parts.append('%')
+                continue
+            expr = FIELD_EXPRS.get(code) if not header else None
+            if expr is None:
+                # headers, cookies etc. may contain spaces
+                expr = r'.*?' if header else r'\S+'
+            name = re.search(r'\?P<(\w+)>', expr)
+            if name and name.group(1) in names:
+                expr = re.sub(r'\?P<\w+>', '?:', expr)
+            elif name:
+                names.add(name.group(1))
+            parts.append(expr)
+        if 'time' not in names or not (names & {'duration', 'seconds'}) or \
+                not (names & {'request', 'url'}):
+            raise ValueError('Pattern {0} should contain %t, %r or %U and %D '
+                             'or %T'.format(pattern))
+        self.expr = re.compile(('^' + ''.join(parts) + r'\s*$').encode())
+        self.request = 'request' in names
+        self.method = 'method' in names
+        self.seconds = 'duration' not in names
+        # AccessLogValve writes %D in milliseconds before Tomcat 10.1 and in
+        # microseconds since Tomcat 10.1
+        self.scale = 1000.0 if self.seconds else {'ms': 1.0,
+                                                  'us': 0.001}[unit]
+
+    def parse(self, line):
+        """Parses access log line
+
+        :param line: bytes
+        :return: None if line does not match pattern or tuple time, method,
+            url, status, response time in milliseconds
+        """
+        match = self.expr.match(line)
+        if not match:
+            return None
+        if self.request:
+            request = match.group('request').split()
+            if len(request) < 2:
+                return None
+            method, url = request[0], request[1]
+        else:
+            method = match.group('method') if self.method else b'-'
+            url = match.group('url')
+        duration = match.group('seconds' if self.seconds else 'duration')
+        return (match.group('time'), method, url, match.group('status'),
+                float(duration) * self.scale)
+
+
+def url_pattern(url, depth=0):
+    """URL pattern: query string and path parameters are removed (except
+    KEEP_QUERY_PARAMS), ids are replaced with {id}
+
+    :param url: bytes
+    :param depth: max number of path segments, 0 - all segments
+    :return: bytes
+    """
+    path, _, query = url.partition(b'?')
+    path = path.split(b';', 1)[0]
+    segments = [b'{id}' if ID_SEGMENT_EXPR.match(segment) else segment
+                for segment in path.split(b'/')]
+    if depth and len(segments) > depth + 1:
+        segments = segments[:depth + 1] + [b'...']
+    pattern = b'/'.join(segments)
+    params = [param for param in query.split(b'&')
+              if param.partition(b'=')[0] in KEEP_QUERY_PARAMS]
+    if params:
+        pattern += b'?' + b'&'.join(params)
+    return pattern
+
+
+def time_minute(value, interval=1):
+    """Minute of AccessLogValve time, e.g. 12/Apr/2016:10:03:17 +0200 is
+    2016-04-12 10:03
+
+    :param value: bytes
+    :param interval: length of time interval in minutes, minute is rounded
+        down to start of interval
+    :return: bytes
+    """
+    minute = int(value[15:17])
+    hour = value[12:14]
+    if interval > 1:
+        minutes = (int(hour) * 60 + minute) // interval * interval
+        hour = '{0:02d}'.format(minutes // 60).encode()
+        minute = minutes % 60
+    return (value[7:11] + b'-' + MONTHS[value[3:6]] + b'-' + value[0:2] +
+            b' ' + hour + ':{0:02d}'.format(minute).encode())
+
+
+def minutes_before(minute, delay, interval=1):
+    """Minute `delay` minutes before `minute`, e.g. 2016-04-12 10:03 and 5
+    minutes is 2016-04-12 09:58
+
+    :param minute: bytes, see `time_minute`
+    :param delay: number of minutes
+    :param interval: length of time interval in minutes, minute is rounded
+        down to start of interval
+    :return: bytes
+    """
+    value = (datetime.datetime.strptime(minute.decode(), '%Y-%m-%d %H:%M') -
+             datetime.timedelta(minutes=delay))
+    value -= datetime.timedelta(
+        minutes=(value.hour * 60 + value.minute) % interval
+    )
+    return value.strftime('%Y-%m-%d %H:%M').encode()
+
+
+class LatencySummary(object):
+    """Latency sketches by minute, URL pattern and status class and total
+    by URL pattern and status class. Sketches of closed minutes are removed,
+    see `close_minutes`
+
+    """
+    __slots__ = ('minutes', 'total', 'patterns', 'requests', 'skipped',
+                 'closed', 'late', '_urls', '_times')
+
+    def __init__(self):
+        self.minutes = defaultdict(LatencySketch)
+        self.total = defaultdict(LatencySketch)
+        self.patterns = set()
+        self.requests = 0
+        self.skipped = 0
+        self.closed = b''
+        self.late = 0
+        self._urls = {}
+        self._times = {}
+
+    def add_lines(self, lines, log_format, interval=1, depth=0):
+        """Adds response times of access log lines
+
+        :param lines: iterable of bytes
+        :param log_format: AccessLogFormat
+        :param interval: length of time interval in minutes
+        :param depth: max number of path segments in URL pattern
+        :return:
+        """
+        parse = log_format.parse
+        urls = self._urls
+        times = self._times
+        for line in lines:
+            request = parse(line)
+            if request is None:
+                if line.strip():
+                    self.skipped += 1
+                continue
+            time_, method, url, status, duration = request
+            request = method + b' ' + url
+            pattern = urls.get(request)
+            if pattern is None:
+                pattern = method + b' ' + url_pattern(url, depth)
+                if pattern not in self.patterns:
+                    if len(self.patterns) < MAX_URL_PATTERNS:
+                        self.patterns.add(pattern)
+                    else:
+                        pattern = OTHER_PATTERN
+                if len(urls) >= URL_CACHE_SIZE:
+                    urls.clear()
+                urls[request] = pattern
+            minute = times.get(time_[:17])
+            if minute is None:
+                minute = times[time_[:17]] = time_minute(time_, interval)
+            key = (pattern, status[:1] + b'xx')
+            self.minutes[(minute, ) + key].add(duration)
+            self.total[key].add(duration)
+            self.requests += 1
+
+    def update(self, other):
+        """Merges sketches of other LatencySummary. Requests of closed
+        minutes are added to total only and counted in `late`
+
+        :param other: LatencySummary
+        :return:
+        """
+        for key, sketch in other.minutes.items():
+            if key[0] < self.closed:
+                self.late += sketch.count
+            else:
+                self.minutes[key].update(sketch)
+        for key, sketch in other.total.items():
+            self.total[key].update(sketch)
+        self.patterns.update(other.patterns)
+        self.requests += other.requests
+        self.skipped += other.skipped
+        self.late += other.late
+
+    def close_minutes(self, before):
+        """Removes sketches of minutes before `before`, so memory does not
+        grow with time span of access logs
+
+        :param before: bytes, see `time_minute`
+        :return: list of rows of removed sketches sorted by minute, see
+            `rows`
+        """
+        keys = sorted(key for key in self.minutes if key[0] < before)
+        self.closed = max(self.closed, before)
+        return [self.row(key, self.minutes.pop(key)) for key in keys]
+
+    def __getstate__(self):
+        return (dict(self.minutes), dict(self.total), self.patterns,
+                self.requests, self.skipped, self.closed, self.late)
+
+    def __setstate__(self, state):
+        self.__init__()
+        (minutes, total, self.patterns, self.requests, self.skipped,
+         self.closed, self.late) = state
+        self.minutes.update(minutes)
+        self.total.update(total)
+
+    def slowest(self, top=10, quantile=0.99):
+        """URL patterns with the biggest response time quantile
+
+        :param top: number of URL patterns
+        :param quantile: float from 0 to 1
+        :return: list of tuples URL pattern, LatencySketch of all status
+            classes
+        """
+        patterns = defaultdict(LatencySketch)
+        for (pattern, _), sketch in self.total.items():
+            patterns[pattern].update(sketch)
+        return sorted(patterns.items(),
+                      key=lambda item: -item[1].quantile(quantile))[:top]
+
+    @staticmethod
+    def row(key, sketch):
+        """Row of csv file, see `ROW_FIELDS`
+
+        :param key: tuple minute, URL pattern, status class
+        :param sketch: LatencySketch
+        :return: tuple
+        """
+        stats = sketch.as_dict()
+        return (tuple(value.decode('latin-1') for value in key) +
+                tuple(stats[name] for name in ROW_FIELDS[3:]))
+
+    def rows(self):
+        """Rows of csv file: minute, URL pattern, status class, number of
+        requests, mean, quantiles and max response time
+
+        :return: generator of tuples
+        """
+        for key, sketch in sorted(self.minutes.items()):
+            yield self.row(key, sketch)
+
+    def as_dict(self, closed=()):
+        """Summary as json serializable dict: statistics of response time by
+        URL pattern and status class and by minute, URL pattern and status
+        class
+
+        :param closed: rows of closed minutes, see `close_minutes`
+        :return: dict
+        """
+        total = defaultdict(dict)
+        for (pattern, status), sketch in self.total.items():
+            total[pattern.decode('latin-1')][status.decode('latin-1')] = \
+                sketch.as_dict()
+        minutes = defaultdict(lambda: defaultdict(dict))
+        for row in itertools.chain(closed, self.rows()):
+            minutes[row[0]][row[1]][row[2]] = dict(zip(ROW_FIELDS[3:],
+                                                       row[3:]))
+        return {'requests': self.requests, 'skipped_lines': self.skipped,
+                'late_requests': self.late, 'total': total,
+                'minutes': minutes}
+
+
+def access_log_files(path):
+    """List of access log files in directory
+
+    :param path: AnyStr
+    :return: list
+    """
+    if os.path.isfile(path):
+        return [path]
+    if not os.path.isdir(path):
+        return []
+    path = os.path.realpath(path)
+    files = set()
+    for pattern in ACCESS_LOG_PATTERNS:
+        files.update(glob.glob(os.path.join(path, pattern)))
+    return sorted(files)
+
+
+def split_access_log(filename, chunk_size=CHUNK_SIZE):
+    """Splits access log file into byte ranges of approximately `chunk_size`
+    bytes at line boundaries. Compressed and small files have single range
+    (0, None)
+
+    :param filename: AnyStr
+    :param chunk_size: int
+    :return: list of tuples (start, end)
+    """
+    size = os.path.getsize(filename)
+    if is_compressed(filename) or not chunk_size or size <= chunk_size:
+        return [(0, None)]
+    bounds = [0]
+    with open(filename, 'rb') as lfd:
+        mapped = mmap.mmap(lfd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            pos = mapped.find(b'\n', chunk_size)
+            while pos != -1 and pos + 1 < size:
+                bounds.append(pos + 1)
+                pos = mapped.find(b'\n', pos + 1 + chunk_size)
+        finally:
+            mapped.close()
+    bounds.append(size)
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+@contextlib.contextmanager
+def open_range(filename, start, end):
+    """Opens byte range of access log file
+
+    :param filename: AnyStr
+    :param start: int
+    :param end: int or None for whole file
+    :return: context manager of iterable of lines
+    """
+    if end is None:
+        with open_log(filename) as lfd:
+            yield lfd
+        return
+    with open(filename, 'rb') as lfd:
+        mapped = mmap.mmap(lfd.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield mapped_lines(mapped, start, end)
+        finally:
+            mapped.close()
+
+
+def first_minute(task, max_lines=100):
+    """Minute of the first request in byte range of access log file
+
+    :param task: see `analyze_range`
+    :param max_lines: max number of lines to read
+    :return: bytes or None if the first lines do not match pattern
+    """
+    filename, start, end, pattern, unit, interval, _ = task
+    parse = AccessLogFormat(pattern, unit).parse
+    with open_range(filename, start, end) as lines:
+        for line in itertools.islice(lines, max_lines):
+            request = parse(line)
+            if request is not None:
+                return time_minute(request[0], interval)
+    return None
+
+
+def analyze_range(task):
+    """Builds latency sketches of byte range of access log file. Used by
+    worker processes
+
+    :param task: tuple (filename, start, end, pattern, unit, interval,
+        depth), end is None for whole file, see `AccessLogFormat` and
+        `LatencySummary.add_lines`
+    :return: LatencySummary
+    """
+    filename, start, end, pattern, unit, interval, depth = task
+    summary = LatencySummary()
+    with open_range(filename, start, end) as lines:
+        summary.add_lines(lines, AccessLogFormat(pattern, unit), interval,
+                          depth)
+    return summary
+
+
+def print_slowest(summary, top=10):
+    """Prints URL patterns with the biggest 99th percentile of response time
+
+    :param summary: LatencySummary
+    :param top: number of URL patterns
+    :return:
+    """
+    row = '{0:>9} {1:>9} {2:>9} {3:>9} {4:>9}  {5}'
+    print(row.format('Requests', 'p50 ms', 'p95 ms', 'p99 ms', 'Max ms',
+                     'URL'))
+    for pattern, sketch in summary.slowest(top):
+        stats = sketch.as_dict()
+        print(row.format(stats['count'], stats['p50'], stats['p95'],
+                         stats['p99'], stats['max'],
+                         pattern.decode('latin-1')))
+
+
+def analyze_dirs(filename, *args, **kwargs):
+    """Builds latency sketches of access logs in specified directories in a
+    single pass and saves them as csv (if filename ends with .csv) or json.
+    Sketches of all files are merged in order of their first request, so
+    minutes before chunks left to merge are closed and written to csv file
+    as soon as possible
+
+    :param filename: AnyStr result filename or None
+    :param args: list of directories or access log files
+    :param kwargs: jobs, chunk_size, see `parse_tomcat_logs.parse_files`,
+        pattern, unit, see `AccessLogFormat`, interval, depth, see
+        `LatencySummary.add_lines`, top - number of the slowest URL patterns
+        to print
+    :return: LatencySummary
+    """
+    jobs = kwargs.get('jobs', 1) or multiprocessing.cpu_count()
+    chunk_size = kwargs.get('chunk_size', CHUNK_SIZE)
+    interval = kwargs.get('interval', 1)
+    options = (kwargs.get('pattern', DEFAULT_PATTERN),
+               kwargs.get('unit', 'ms'), interval, kwargs.get('depth', 0))
+    # fails early on invalid pattern
+    AccessLogFormat(*options[:2])
+    tasks = []
+    for path in args:
+        print('Searching for access log files in', path)
+        tasks.extend((file_, start, end) + options
+                     for file_ in access_log_files(path)
+                     for start, end in split_access_log(file_, chunk_size))
+    starts = sorted((first_minute(task) or b'', index)
+                    for index, task in enumerate(tasks))
+    tasks = [tasks[index] for _, index in starts]
+
+    closed = []
+    save_rows = closed.extend
+    csv_fd = None
+    if filename and filename.endswith('.csv'):
+        csv_fd = open(filename, 'w')
+        writer = csv.writer(csv_fd)
+        writer.writerow(ROW_FIELDS)
+        save_rows = writer.writerows
+    elif not filename:
+        save_rows = len
+    pool = None
+    if jobs > 1 and len(tasks) > 1:
+        pool = multiprocessing.Pool(min(jobs, len(tasks)))
+        results = pool.imap(analyze_range, tasks)
+    else:
+        results = (analyze_range(task) for task in tasks)
+    summary = LatencySummary()
+    try:
+        files = set()
+        for index, (task, result) in enumerate(zip(tasks, results)):
+            if task[0] not in files:
+                files.add(task[0])
+                print('Proccessing', task[0], '...')
+            summary.update(result)
+            if index + 1 < len(tasks) and starts[index + 1][0]:
+                save_rows(summary.close_minutes(minutes_before(
+                    starts[index + 1][0], CLOSE_DELAY, interval
+                )))
+        if csv_fd:
+            writer.writerows(summary.rows())
+    finally:
+        if pool:
+            pool.terminate()
+            pool.join()
+        if csv_fd:
+            csv_fd.close()
+
+    print('{0} requests, {1} lines do not match pattern'.format(
+        summary.requests, summary.skipped))
+    if summary.late:
+        print('{0} requests logged more than {1} minutes before the previous '
+              'chunk are counted in total only'.format(summary.late,
+                                                       CLOSE_DELAY))
+    print_slowest(summary, kwargs.get('top', 10))
+    if not filename:
+        return summary
+    if not csv_fd:
+        with open(filename, 'w') as json_fd:
+            json.dump(summary.as_dict(closed), json_fd, indent=1,
+                      sort_keys=True)
+    print('Latency summary saved to', filename)
+    return summary
+
+
+def parse_command(argv):
+    """Analyzes response time in tomcat access logs, see `--help`
+
+    :param argv: command line arguments
+    :return:
+    """
+    parser = argparse.ArgumentParser(add_help=True)
+    parser.add_argument('paths', nargs='*',
+                        help='Directories with tomcat access logs or access '
+                             'log files. Current directory is used by '
+                             'default')
+    parser.add_argument('--output', '-o', metavar='FILENAME',
+                        help='Save statistics by minute, URL and status '
+                             'class as csv (if FILENAME ends with .csv) or '
+                             'json')
+    parser.add_argument('--pattern', default=DEFAULT_PATTERN,
+                        help='AccessLogValve pattern of access logs, common '
+                             'or combined with %%D or %%T. Default: '
+                             '{0}'.format(DEFAULT_PATTERN.replace('%', '%%')))
+    parser.add_argument('--unit', default='ms', choices=('ms', 'us'),
+                        help='Unit of %%D: ms before Tomcat 10.1 (default), '
+                             'us since Tomcat 10.1')
+    parser.add_argument('--interval', type=int, default=1,
+                        help='Length of time interval in minutes')
+    parser.add_argument('--depth', type=int, default=0,
+                        help='Max number of path segments in URL pattern. '
+                             '0 - all segments')
+    parser.add_argument('--top', type=int, default=10,
+                        help='Number of the slowest URLs to print')
+    parser.add_argument('--jobs', '-j', type=int, default=1,
+                        help='Number of worker processes. 0 - one per CPU '
+                             'core, 1 - serial mode (default)')
+    parser.add_argument('--chunk-size', type=int,
+                        default=CHUNK_SIZE // (1024 * 1024),
+                        help='Access logs bigger than this size in MB are '
+                             'split into chunks, parsed by several workers '
+                             'in parallel mode. Sketches of minutes before '
+                             'the next chunk are closed, so memory does not '
+                             'grow with time span of access logs. 0 - do not '
+                             'split files')
+    cmd_args = parser.parse_args(argv)
+    try:
+        AccessLogFormat(cmd_args.pattern, cmd_args.unit)
+    except ValueError as exc:
+        parser.error(str(exc))
+    analyze_dirs(cmd_args.output, *cmd_args.paths or [os.getcwd()],
+                 jobs=cmd_args.jobs,
+                 chunk_size=cmd_args.chunk_size * 1024 * 1024,
+                 pattern=cmd_args.pattern, unit=cmd_args.unit,
+                 interval=max(cmd_args.interval, 1), depth=cmd_args.depth,
+                 top=cmd_args.top)
+
+
+if __name__ == '__main__':
+    parse_command(sys.argv[1:])